@@ -12,6 +12,10 @@ sys.path.append(os.getcwd())
 from app.models import Base
 target_metadata = Base.metadata
 
+def include_object(object, name, type_, reflected, compare_to):
+    """Служебные таблицы полнотекстового поиска (FTS5) создаёт миграция, а не модели"""
+    return not (type_ == "table" and name.startswith("messages_fts"))
+
 # Это объект конфигурации Alembic
 config = context.config
 
@@ -25,6 +29,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -43,7 +48,8 @@ def run_migrations_online() -> None:
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
-            target_metadata=target_metadata
+            target_metadata=target_metadata,
+            include_object=include_object
         )
 
         with context.begin_transaction():
@@ -0,0 +1,78 @@
+"""message full-text search
+
+Revision ID: 3f9a6c1d2e47
+Revises: 8c58f23e7bf5
+Create Date: 2026-10-17 12:20:41.552903
+
+На Postgres GIN-индекс строится CREATE INDEX CONCURRENTLY вне транзакции
+миграции. Добавление вычисляемой колонки content_tsv переписывает таблицу —
+это одна блокирующая операция, её стоит запускать в окно обслуживания.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '3f9a6c1d2e47'
+down_revision: Union[str, Sequence[str], None] = '8c58f23e7bf5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    # Проиндексировать уже существующие сообщения
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS messages_fts_au",
+    "DROP TRIGGER IF EXISTS messages_fts_ad",
+    "DROP TRIGGER IF EXISTS messages_fts_ai",
+    "DROP TABLE IF EXISTS messages_fts",
+]
+
+POSTGRES_UPGRADE = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED",
+]
+
+POSTGRES_DOWNGRADE = [
+    "ALTER TABLE messages DROP COLUMN IF EXISTS content_tsv",
+]
+
+# Выполняются вне транзакции (CONCURRENTLY): после POSTGRES_UPGRADE и до POSTGRES_DOWNGRADE
+POSTGRES_CREATE_INDEX = "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_content_tsv ON messages USING gin (content_tsv)"
+POSTGRES_DROP_INDEX = "DROP INDEX CONCURRENTLY IF EXISTS ix_messages_content_tsv"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Поиск по тексту сообщений: FTS5 в SQLite, tsvector + GIN в Postgres
+    dialect = op.get_bind().dialect.name
+    statements = {"sqlite": SQLITE_UPGRADE, "postgresql": POSTGRES_UPGRADE}.get(dialect, [])
+    for statement in statements:
+        op.execute(statement)
+    if dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute(POSTGRES_CREATE_INDEX)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute(POSTGRES_DROP_INDEX)
+    statements = {"sqlite": SQLITE_DOWNGRADE, "postgresql": POSTGRES_DOWNGRADE}.get(dialect, [])
+    for statement in statements:
+        op.execute(statement)
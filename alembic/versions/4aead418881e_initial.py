@@ -4,6 +4,10 @@ Revision ID: 4aead418881e
 Revises: 
 Create Date: 2026-02-02 14:02:24.723855
 
+Исходная схема (до индексов истории чата, seq и сводок диалогов).
+Таблицы, которые уже есть в базе, пропускаются: так принимается база,
+созданная create_tables.py со старыми моделями. Базу, созданную по текущим
+моделям, нужно не мигрировать, а пометить: alembic stamp head.
 """
 from typing import Sequence, Union
 
@@ -20,9 +24,93 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     """Upgrade schema."""
-    pass
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('email', sa.String(), nullable=True),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('hashed_password', sa.String(), nullable=True),
+            sa.Column('salt', sa.String(), nullable=True),
+            sa.Column('is_admin', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_users_id', 'users', ['id'])
+        op.create_index('ix_users_email', 'users', ['email'], unique=True)
+
+    if 'services' not in existing:
+        op.create_table(
+            'services',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(length=200), nullable=False),
+            sa.Column('icon', sa.String(length=50), nullable=True),
+            sa.Column('short_description', sa.String(length=300), nullable=True),
+            sa.Column('full_description', sa.Text(), nullable=True),
+            sa.Column('features', sa.JSON(), nullable=True),
+            sa.Column('technologies', sa.JSON(), nullable=True),
+            sa.Column('price_range', sa.String(length=100), nullable=True),
+            sa.Column('duration', sa.String(length=100), nullable=True),
+            sa.Column('order_index', sa.Integer(), nullable=True),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_services_id', 'services', ['id'])
+
+    if 'projects' not in existing:
+        op.create_table(
+            'projects',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(), nullable=True),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('service_id', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.ForeignKeyConstraint(['service_id'], ['services.id']),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_projects_id', 'projects', ['id'])
+
+    if 'messages' not in existing:
+        op.create_table(
+            'messages',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('content', sa.Text(), nullable=True),
+            sa.Column('sender_id', sa.Integer(), nullable=True),
+            sa.Column('receiver_id', sa.Integer(), nullable=True),
+            sa.Column('is_owner', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.ForeignKeyConstraint(['receiver_id'], ['users.id']),
+            sa.ForeignKeyConstraint(['sender_id'], ['users.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_messages_id', 'messages', ['id'])
+
+    if 'transactions' not in existing:
+        op.create_table(
+            'transactions',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('project_id', sa.Integer(), nullable=True),
+            sa.Column('amount', sa.Integer(), nullable=True),
+            sa.Column('currency', sa.String(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.ForeignKeyConstraint(['project_id'], ['projects.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_transactions_id', 'transactions', ['id'])
 
 
 def downgrade() -> None:
     """Downgrade schema."""
-    pass
+    op.drop_table('transactions')
+    op.drop_table('messages')
+    op.drop_table('projects')
+    op.drop_table('services')
+    op.drop_table('users')
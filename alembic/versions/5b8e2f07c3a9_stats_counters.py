@@ -0,0 +1,99 @@
+"""stats counters
+
+Revision ID: 5b8e2f07c3a9
+Revises: e3d5a8c91f20
+Create Date: 2026-10-17 15:05:41.208317
+
+Таблица stats_counters (итоги и значения за день для статистики админки) с
+начальным заполнением по текущим данным, индексы (status, created_at) проектов
+и транзакций для сверки счётчиков (на Postgres — CONCURRENTLY). Префикс status
+покрывает сверку, а целиком их используют списки админки, поэтому отдельных
+индексов по одному статусу нет. Дни старше
+недели не заполняются — их и не читают; дальше счётчики ведут write-пути и
+сверяет app.stats_counters.
+"""
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '5b8e2f07c3a9'
+down_revision: Union[str, Sequence[str], None] = 'e3d5a8c91f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_DAYS = 7
+
+# Сверка счётчиков по статусам и списки админки с фильтром по статусу (имя, таблица, колонки)
+INDEXES = [
+    ('ix_projects_status_created_at', 'projects', ['status', 'created_at']),
+    ('ix_transactions_status_created_at', 'transactions', ['status', 'created_at']),
+]
+
+# Итоги: (счётчик, выражение, таблица)
+TOTALS = [
+    ('users', 'count(*)', 'users'),
+    ('users.admins', 'coalesce(sum(CASE WHEN is_admin THEN 1 ELSE 0 END), 0)', 'users'),
+    ('projects', 'count(*)', 'projects'),
+    ('services', 'count(*)', 'services'),
+    ('messages', 'count(*)', 'messages'),
+    ('messages.from_users', 'coalesce(sum(CASE WHEN is_owner THEN 1 ELSE 0 END), 0)', 'messages'),
+    ('transactions', 'count(*)', 'transactions'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'stats_counters',
+        sa.Column('bucket', sa.String(length=10), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('bucket', 'name'),
+    )
+    for name, expression, table in TOTALS:
+        op.execute(
+            f"INSERT INTO stats_counters (bucket, name, value, updated_at) "
+            f"SELECT '', '{name}', {expression}, CURRENT_TIMESTAMP FROM {table}"
+        )
+    for table in ('projects', 'transactions'):
+        op.execute(
+            f"INSERT INTO stats_counters (bucket, name, value, updated_at) "
+            f"SELECT '', '{table}.status.' || status, count(*), CURRENT_TIMESTAMP FROM {table} "
+            f"WHERE status IS NOT NULL GROUP BY status"
+        )
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - timedelta(days=BACKFILL_DAYS - 1)
+    for name, table in (('users.new', 'users'), ('projects.new', 'projects')):
+        day = 'CAST(date(created_at) AS VARCHAR(10))'
+        op.execute(
+            sa.text(
+                f"INSERT INTO stats_counters (bucket, name, value, updated_at) "
+                f"SELECT {day}, '{name}', count(*), CURRENT_TIMESTAMP FROM {table} "
+                f"WHERE created_at >= :since GROUP BY {day}"
+            ).bindparams(since=since)
+        )
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY нельзя внутри транзакции
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+        return
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
+    op.drop_table('stats_counters')
@@ -0,0 +1,61 @@
+"""message conversation seq
+
+Revision ID: 8c58f23e7bf5
+Revises: bd1d85e1760b
+Create Date: 2026-10-17 11:52:37.904115
+
+Номер диалога и seq уже сохранённым сообщениям проставляются двумя UPDATE на
+стороне БД (seq — ROW_NUMBER() по диалогу), без выборки таблицы в Python.
+UPDATE ... FROM есть в Postgres и в SQLite начиная с 3.33. Уникальный индекс
+(conversation_id, seq) на Postgres строится CONCURRENTLY после фиксации UPDATE.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '8c58f23e7bf5'
+down_revision: Union[str, Sequence[str], None] = 'bd1d85e1760b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('conversation_id', sa.Integer(), nullable=True))
+    op.add_column('messages', sa.Column('seq', sa.Integer(), nullable=True))
+
+    # Проставляем диалог и порядковый номер уже сохранённым сообщениям
+    op.execute("UPDATE messages SET conversation_id = CASE WHEN is_owner THEN sender_id ELSE receiver_id END")
+    op.execute(
+        "UPDATE messages SET seq = numbered.seq FROM ("
+        "SELECT id, ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS seq "
+        "FROM messages WHERE conversation_id IS NOT NULL"
+        ") AS numbered WHERE messages.id = numbered.id"
+    )
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY нельзя внутри транзакции: autocommit_block сначала фиксирует UPDATE
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ux_messages_conversation_id_seq', 'messages', ['conversation_id', 'seq'],
+                unique=True, postgresql_concurrently=True, if_not_exists=True,
+            )
+        return
+    op.create_index('ux_messages_conversation_id_seq', 'messages', ['conversation_id', 'seq'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index(
+                'ux_messages_conversation_id_seq', table_name='messages',
+                postgresql_concurrently=True, if_exists=True,
+            )
+    else:
+        op.drop_index('ux_messages_conversation_id_seq', table_name='messages')
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_column('seq')
+        batch_op.drop_column('conversation_id')
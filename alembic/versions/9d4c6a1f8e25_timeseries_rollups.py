@@ -0,0 +1,80 @@
+"""timeseries rollups
+
+Revision ID: 9d4c6a1f8e25
+Revises: 5b8e2f07c3a9
+Create Date: 2026-10-17 16:20:13.774105
+
+Почасовые и подневные ряды сообщений и транзакций (app.timeseries). Ряды
+заполняются по существующим строкам одним INSERT ... SELECT ... GROUP BY на
+таблицу и шаг; дальше их ведут write-пути и сверка счётчиков. Пересобрать
+историю заново можно через `python -m app.timeseries backfill`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '9d4c6a1f8e25'
+down_revision: Union[str, Sequence[str], None] = '5b8e2f07c3a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+GRANULARITIES = ('hour', 'day')
+
+
+def _bucket(granularity: str, dialect: str) -> str:
+    """Начало часа или дня — так же, как его считает app.timeseries"""
+    if dialect == 'postgresql':
+        return f"date_trunc('{granularity}', timezone('UTC', created_at))"
+    # Формат DateTime в SQLite у SQLAlchemy — с микросекундами: иначе не совпадут ключи и сравнения
+    pattern = '%Y-%m-%d %H:00:00.000000' if granularity == 'hour' else '%Y-%m-%d 00:00:00.000000'
+    return f"strftime('{pattern}', created_at)"
+
+
+def _backfill() -> None:
+    dialect = op.get_bind().dialect.name
+    for granularity in GRANULARITIES:
+        bucket = _bucket(granularity, dialect)
+        direction = "CASE WHEN is_owner THEN 'from_users' ELSE 'from_admin' END"
+        op.execute(
+            f"INSERT INTO message_rollups (granularity, bucket_start, direction, count) "
+            f"SELECT '{granularity}', {bucket}, {direction}, count(*) FROM messages "
+            f"WHERE created_at IS NOT NULL GROUP BY {bucket}, {direction}"
+        )
+        # NULL статус и валюта хранятся пустой строкой (входят в первичный ключ)
+        op.execute(
+            f"INSERT INTO transaction_rollups (granularity, bucket_start, status, currency, count, amount) "
+            f"SELECT '{granularity}', {bucket}, coalesce(status, ''), coalesce(currency, ''), "
+            f"count(*), coalesce(sum(amount), 0) FROM transactions "
+            f"WHERE created_at IS NOT NULL GROUP BY {bucket}, coalesce(status, ''), coalesce(currency, '')"
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'message_rollups',
+        sa.Column('granularity', sa.String(length=5), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('direction', sa.String(length=10), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'direction'),
+    )
+    op.create_table(
+        'transaction_rollups',
+        sa.Column('granularity', sa.String(length=5), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('status', sa.String(length=32), nullable=False),
+        sa.Column('currency', sa.String(length=8), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.Column('amount', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'status', 'currency'),
+    )
+    _backfill()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('transaction_rollups')
+    op.drop_table('message_rollups')
@@ -0,0 +1,55 @@
+"""conversation summaries
+
+Revision ID: a51c0e9b7d13
+Revises: 3f9a6c1d2e47
+Create Date: 2026-10-17 12:58:06.104377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'a51c0e9b7d13'
+down_revision: Union[str, Sequence[str], None] = '3f9a6c1d2e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'conversations',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('last_message_id', sa.Integer(), nullable=True),
+        sa.Column('last_message_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('unread_for_admin', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('unread_for_user', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+    # Входящие админа: ORDER BY last_message_at DESC, user_id DESC
+    op.create_index('ix_conversations_last_message_at_user_id', 'conversations', ['last_message_at', 'user_id'])
+
+    # Сводки по уже существующим сообщениям; непрочитанные начинаем с нуля
+    op.execute(
+        """
+        INSERT INTO conversations (user_id, last_message_id, last_message_at,
+                                   unread_for_admin, unread_for_user, message_count)
+        SELECT totals.conversation_id, m.id, m.created_at, 0, 0, totals.message_count
+        FROM (
+            SELECT conversation_id, MAX(seq) AS last_seq, COUNT(*) AS message_count
+            FROM messages
+            WHERE conversation_id IS NOT NULL
+            GROUP BY conversation_id
+        ) AS totals
+        JOIN messages AS m ON m.conversation_id = totals.conversation_id AND m.seq = totals.last_seq
+        JOIN users AS u ON u.id = totals.conversation_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_last_message_at_user_id', table_name='conversations')
+    op.drop_table('conversations')
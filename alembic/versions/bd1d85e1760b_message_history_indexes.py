@@ -0,0 +1,49 @@
+"""message history indexes
+
+Revision ID: bd1d85e1760b
+Revises: 4aead418881e
+Create Date: 2026-10-17 11:40:12.318204
+
+На Postgres индексы строятся CREATE INDEX CONCURRENTLY вне транзакции
+миграции — messages не блокируется на запись; на SQLite — обычным CREATE INDEX.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'bd1d85e1760b'
+down_revision: Union[str, Sequence[str], None] = '4aead418881e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Keyset-пагинация истории чата: WHERE sender_id/receiver_id = ? ORDER BY created_at, id
+INDEXES = [
+    ('ix_messages_sender_id_created_at', 'messages', ['sender_id', 'created_at']),
+    ('ix_messages_receiver_id_created_at', 'messages', ['receiver_id', 'created_at']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY нельзя внутри транзакции
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+        return
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+        return
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
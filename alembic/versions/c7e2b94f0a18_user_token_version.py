@@ -0,0 +1,29 @@
+"""user token version
+
+Revision ID: c7e2b94f0a18
+Revises: a51c0e9b7d13
+Create Date: 2026-10-17 13:41:52.880164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'c7e2b94f0a18'
+down_revision: Union[str, Sequence[str], None] = 'a51c0e9b7d13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Отзыв токенов: в claims кладётся версия, увеличение версии делает старые токены недействительными
+    op.add_column('users', sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('token_version')
@@ -0,0 +1,71 @@
+"""query indexes and settings table
+
+Revision ID: e3d5a8c91f20
+Revises: c7e2b94f0a18
+Create Date: 2026-10-17 12:40:05.512830
+
+Индексы под запросы админки, проектов и чата. На Postgres они строятся
+CREATE INDEX CONCURRENTLY вне транзакции миграции — таблицы не блокируются
+на запись; на SQLite — обычным CREATE INDEX.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'e3d5a8c91f20'
+down_revision: Union[str, Sequence[str], None] = 'c7e2b94f0a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UNREAD = sa.text('unread_for_admin > 0')
+
+# (имя, таблица, колонки, доп. параметры)
+INDEXES = [
+    ('ix_users_created_at', 'users', ['created_at'], {}),
+    ('ix_projects_user_id', 'projects', ['user_id'], {}),
+    ('ix_projects_created_at', 'projects', ['created_at'], {}),
+    ('ix_messages_created_at', 'messages', ['created_at'], {}),
+    ('ix_transactions_created_at', 'transactions', ['created_at'], {}),
+    ('ix_conversations_unread_last_message_at', 'conversations', ['last_message_at', 'user_id'],
+     {'sqlite_where': UNREAD, 'postgresql_where': UNREAD}),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if 'settings' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'settings',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('key', sa.String(length=100), nullable=False),
+            sa.Column('value', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('key'),
+        )
+        op.create_index('ix_settings_id', 'settings', ['id'])
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY нельзя внутри транзакции
+        with op.get_context().autocommit_block():
+            for name, table, columns, kwargs in INDEXES:
+                op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kwargs)
+        return
+    for name, table, columns, kwargs in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True, **kwargs)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, _, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
+    op.drop_index('ix_settings_id', table_name='settings')
+    op.drop_table('settings')
@@ -0,0 +1,75 @@
+"""listing indexes
+
+Revision ID: f2a7c4e91b36
+Revises: 9d4c6a1f8e25
+Create Date: 2026-10-17 19:12:37.604118
+
+Индексы под списки админки с keyset-курсором: фильтр (услуга, is_admin) плюс
+сортировка по created_at, порядок услуг. Индексы (status, created_at) созданы
+ещё в 5b8e2f07c3a9. На Postgres индексы строятся CONCURRENTLY.
+
+На SQLite created_at, заполненный server_default (CURRENT_TIMESTAMP), хранится
+как 'YYYY-MM-DD HH:MM:SS', а SQLAlchemy пишет и сравнивает
+'YYYY-MM-DD HH:MM:SS.ffffff'. Курсор такой строки оказывался строго больше её
+самой, и страницы повторялись бесконечно. Миграция дописывает к старым
+значениям '.000000'; новые строки получают время от приложения.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'f2a7c4e91b36'
+down_revision: Union[str, Sequence[str], None] = '9d4c6a1f8e25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (имя, таблица, колонки)
+INDEXES = [
+    ('ix_users_is_admin_created_at', 'users', ['is_admin', 'created_at']),
+    ('ix_services_order_index', 'services', ['order_index', 'id']),
+    ('ix_projects_service_id_created_at', 'projects', ['service_id', 'created_at']),
+]
+
+# Таблицы, где created_at заполнял server_default и по нему листают курсором
+TIMESTAMP_TABLES = ['users', 'projects', 'messages', 'transactions']
+
+
+def normalize_sqlite_timestamps(bind) -> None:
+    """Привести created_at на SQLite к формату SQLAlchemy (с микросекундами)"""
+    for table in TIMESTAMP_TABLES:
+        bind.execute(sa.text(
+            f"UPDATE {table} SET created_at = created_at || '.000000' "
+            "WHERE length(created_at) = 19"
+        ))
+
+
+def _create(indexes, concurrently: bool):
+    for name, table, columns in indexes:
+        op.create_index(name, table, columns, postgresql_concurrently=concurrently, if_not_exists=True)
+
+
+def _drop(indexes, concurrently: bool):
+    for name, table, _ in indexes:
+        op.drop_index(name, table_name=table, postgresql_concurrently=concurrently, if_exists=True)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY нельзя внутри транзакции
+        with op.get_context().autocommit_block():
+            _create(INDEXES, concurrently=True)
+        return
+    _create(INDEXES, concurrently=False)
+    normalize_sqlite_timestamps(op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            _drop(reversed(INDEXES), concurrently=True)
+        return
+    _drop(reversed(INDEXES), concurrently=False)
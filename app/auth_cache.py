@@ -0,0 +1,199 @@
+"""
+Кэш аутентификации: проверенные claims токенов и найденные пользователи.
+
+Поиск пользователя по id из токена — самый частый запрос приложения. Здесь
+хранятся снимки пользователей (не ORM-объекты, они привязаны к сессии) и
+разобранные токены, с TTL и вытеснением по LRU. После изменения или удаления
+пользователя вызывайте invalidate_user(): в этом процессе запись пропадёт сразу,
+в остальных воркерах — не позже чем через AUTH_CACHE_TTL секунд.
+
+Для самодостаточных access-токенов (роль, имя и версия в claims) пользователь
+вообще не ищется; отзыв проверяется по текущей версии токенов пользователя
+(users.token_version, запрос по первичному ключу). Версия кэшируется на
+AUTH_TOKEN_VERSION_TTL секунд: отзыв на другом воркере (выход везде, смена
+роли, удаление) действует здесь не позже чем через это время, в своём
+воркере — сразу. Удалённый пользователь считается отозванным.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+import jwt
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Сколько секунд верить версии токенов без запроса к БД (задержка отзыва на других воркерах)
+AUTH_TOKEN_VERSION_TTL = float(os.getenv("AUTH_TOKEN_VERSION_TTL", "5"))
+# Версия удалённого пользователя: любые его токены отозваны
+DELETED = -1
+
+
+class TTLCache:
+    """Словарь с ограниченным размером (LRU) и временем жизни записей"""
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 4) if requests else 0,
+        }
+
+
+class AuthenticatedUser:
+    """Снимок пользователя для обработчиков: только чтение, без привязки к сессии БД"""
+
+    __slots__ = ("id", "email", "name", "is_admin", "created_at")
+
+    def __init__(self, id: int, email: str, name: str, is_admin: bool, created_at=None):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.is_admin = bool(is_admin)
+        self.created_at = created_at
+
+    @classmethod
+    def from_model(cls, user) -> "AuthenticatedUser":
+        return cls(user.id, user.email, user.name, user.is_admin, user.created_at)
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> "AuthenticatedUser":
+        return cls(int(claims["sub"]), claims.get("email"), claims.get("name"), claims.get("role") == "admin")
+
+    def __repr__(self):
+        return f"<AuthenticatedUser id={self.id} is_admin={self.is_admin}>"
+
+
+class AuthCache:
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.tokens = TTLCache(maxsize, ttl)
+        self.users = TTLCache(maxsize, ttl)
+        self.token_versions = TTLCache(maxsize, AUTH_TOKEN_VERSION_TTL)
+        # Растёт при каждой инвалидации: загрузка, начатая до неё, не попадёт в кэш
+        self._epoch = 0
+
+    def decode(self, token: str, secret_key: str, algorithm: str) -> dict:
+        """
+        Проверенные claims токена (jwt.InvalidTokenError — как у jwt.decode).
+
+        Ключ — весь токен целиком, а не только подпись: иначе подделанный payload
+        с чужой подписью нашёлся бы в кэше без проверки.
+        """
+        claims = self.tokens.get(token)
+        if claims is not None:
+            if "exp" in claims and claims["exp"] <= time.time():
+                self.tokens.pop(token)
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            return claims
+        claims = jwt.decode(token, secret_key, algorithms=[algorithm])
+        ttl = claims["exp"] - time.time() if "exp" in claims else None
+        self.tokens.set(token, claims, ttl)
+        return claims
+
+    async def get_user(
+        self,
+        user_id: int,
+        load: Callable[[int], Awaitable[Optional[Any]]],
+    ) -> Optional[AuthenticatedUser]:
+        """Пользователь из кэша или через load(user_id) (ORM-объект или None)"""
+        user = self.users.get(user_id)
+        if user is not None:
+            return user
+        epoch = self._epoch
+        model = await load(user_id)
+        if model is None:
+            return None
+        user = AuthenticatedUser.from_model(model)
+        if epoch == self._epoch:
+            self.users.set(user_id, user)
+        return user
+
+    def remember_token_version(self, user_id: int, version: int):
+        """Текущая версия токенов пользователя (после входа, отзыва или удаления — DELETED)"""
+        self._epoch += 1
+        self.token_versions.set(user_id, version)
+
+    async def is_revoked(
+        self,
+        user_id: int,
+        version: int,
+        load_version: Callable[[int], Awaitable[Optional[int]]],
+    ) -> bool:
+        """
+        Токен старее текущей версии или пользователь удалён — отозван. Версия
+        берётся из кэша или через load_version(user_id) (None — пользователя нет).
+        """
+        known = self.token_versions.get(user_id)
+        if known is None:
+            epoch = self._epoch
+            current = await load_version(user_id)
+            known = DELETED if current is None else current
+            if epoch == self._epoch:
+                self.token_versions.set(user_id, known)
+        return known == DELETED or version < known
+
+    def invalidate_user(self, user_id: int):
+        """Забыть пользователя (после изменения или удаления)"""
+        self._epoch += 1
+        self.users.pop(user_id)
+
+    def clear(self):
+        self._epoch += 1
+        self.tokens.clear()
+        self.users.clear()
+
+    def stats(self) -> dict:
+        return {
+            "users": self.users.stats(),
+            "tokens": self.tokens.stats(),
+            "token_versions": self.token_versions.stats(),
+        }
+
+
+auth_cache = AuthCache()
+
+
+def invalidate_user(user_id: int):
+    auth_cache.invalidate_user(user_id)
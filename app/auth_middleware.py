@@ -0,0 +1,74 @@
+"""
+Аутентификация один раз на запрос.
+
+ASGI-middleware достаёт токен (заголовок, cookie или ?token=), проверяет его и
+находит пользователя, а результат кладёт в request.state:
+
+    request.state.token       — токен или None
+    request.state.user        — AuthenticatedUser или None
+    request.state.auth_error  — HTTPException, если токен есть, но не годится
+    request.state.db          — сессия БД, общая для всех зависимостей запроса
+
+get_current_user и get_async_db берут готовое из request.state, страницы в
+main.py — тоже; поэтому на запрос приходится не больше одного поиска пользователя
+и одна сессия.
+"""
+from typing import Optional
+
+from fastapi import HTTPException
+from starlette.requests import HTTPConnection
+
+from app.database import AsyncSessionLocal, pin_to_primary
+from app.models import User
+
+# Методы без записи: после остальных пользователь какое-то время читает из основной БД
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Пути, которым пользователь не нужен: статика и проверка готовности не должны ходить в БД
+AUTH_SKIP_PREFIXES = ("/static", "/readyz")
+
+
+def extract_token(connection: HTTPConnection) -> Optional[str]:
+    """Токен из заголовка Authorization, cookie access_token или ?token= (для WebSocket)"""
+    auth_header = connection.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        return auth_header.replace("Bearer ", "")
+    return connection.cookies.get("access_token") or connection.query_params.get("token")
+
+
+class AuthMiddleware:
+    def __init__(self, app, skip_prefixes=AUTH_SKIP_PREFIXES):
+        self.app = app
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        # WebSocket живёт долго — держать для него сессию весь сеанс незачем
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        # Импорт здесь: app.dependencies при импорте заглядывает в app.main
+        from app.dependencies import load_token_version, resolve_user
+
+        state = scope.setdefault("state", {})
+        db = AsyncSessionLocal()
+        state["db"] = db
+        state["user"] = None
+        state["auth_error"] = None
+        try:
+            token = extract_token(HTTPConnection(scope))
+            state["token"] = token
+            if token:
+                try:
+                    state["user"] = await resolve_user(
+                        token,
+                        lambda user_id: db.get(User, user_id),
+                        lambda user_id: load_token_version(db, user_id)
+                    )
+                except HTTPException as e:
+                    state["auth_error"] = e
+            if state["user"] is not None and scope["method"] not in SAFE_METHODS:
+                pin_to_primary(state["user"].id)
+            await self.app(scope, receive, send)
+        finally:
+            await db.close()
@@ -0,0 +1,133 @@
+"""
+Шина доставки сообщений чата между воркерами.
+
+Любой воркер публикует конверт {"frame", "user_id", "admins"}, а каждый воркер,
+получив его, раздаёт кадр своим локальным подключениям. По умолчанию шина
+работает внутри процесса; для нескольких воркеров uvicorn/gunicorn задайте
+CHAT_BACKPLANE_URL=redis://host:6379/0 (или unix:///path/to/redis.sock).
+"""
+import asyncio
+import json
+import os
+from typing import Callable, Optional
+
+from app.redis_protocol import RespConnection
+
+CHAT_BACKPLANE_URL = os.getenv("CHAT_BACKPLANE_URL", "")
+CHAT_BACKPLANE_CHANNEL = os.getenv("CHAT_BACKPLANE_CHANNEL", "chat:deliver")
+# Сколько ждать брокер при публикации; дольше — кадр доставляется локально
+CHAT_BACKPLANE_TIMEOUT = float(os.getenv("CHAT_BACKPLANE_TIMEOUT", "1.0"))
+
+Handler = Callable[[dict], None]
+
+
+class InMemoryBackplane:
+    """Шина внутри одного процесса: публикация сразу же доставляется локально"""
+
+    name = "memory"
+
+    def __init__(self, handler: Optional[Handler] = None):
+        self._handler = handler
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+
+    async def publish(self, envelope: dict):
+        if self._handler is not None:
+            self._handler(envelope)
+
+    async def stop(self):
+        self._handler = None
+
+
+class RedisBackplane:
+    """
+    Шина поверх PUBLISH/SUBSCRIBE Redis (или любого брокера с протоколом RESP).
+
+    Публикующий воркер не доставляет кадр сам — он получит его из подписки,
+    как и все остальные, поэтому дубликатов нет. Если брокер недоступен,
+    кадр доставляется локально, чтобы не потерять хотя бы своих клиентов.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        url: str,
+        channel: str = CHAT_BACKPLANE_CHANNEL,
+        reconnect_delay: float = 1.0,
+        timeout: float = CHAT_BACKPLANE_TIMEOUT,
+    ):
+        self.url = url
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.timeout = timeout
+        self._handler: Optional[Handler] = None
+        self._publisher = RespConnection(url)
+        self._subscriber: Optional[RespConnection] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+        self._reader_task = asyncio.create_task(self._read_loop())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Шина чата: нет подписки на {self.url}, продолжаем с локальной доставкой")
+
+    async def publish(self, envelope: dict):
+        payload = json.dumps(envelope, ensure_ascii=False)
+        try:
+            await asyncio.wait_for(self._publisher.execute("PUBLISH", self.channel, payload), timeout=self.timeout)
+        except Exception as e:
+            # После таймаута ответ брокера может прийти позже — соединение сбрасываем
+            print(f"❌ Шина чата: ошибка публикации ({e}), доставляем локально")
+            await self._publisher.close()
+            if self._handler is not None:
+                self._handler(envelope)
+
+    async def _read_loop(self):
+        while True:
+            self._subscriber = RespConnection(self.url)
+            try:
+                await self._subscriber.connect()
+                await self._subscriber.send("SUBSCRIBE", self.channel)
+                while True:
+                    reply = await self._subscriber.read_reply()
+                    if not isinstance(reply, list) or len(reply) < 3:
+                        continue
+                    kind = reply[0]
+                    if kind == b"subscribe":
+                        self._subscribed.set()
+                    elif kind == b"message" and self._handler is not None:
+                        try:
+                            self._handler(json.loads(reply[2]))
+                        except Exception as e:
+                            print(f"❌ Шина чата: не удалось обработать конверт: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._subscribed.clear()
+                print(f"❌ Шина чата: подписка потеряна ({e}), переподключение через {self.reconnect_delay}с")
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                await self._subscriber.close()
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+        await self._publisher.close()
+        self._handler = None
+
+
+def create_backplane(url: str = CHAT_BACKPLANE_URL):
+    """Выбрать реализацию шины по адресу из CHAT_BACKPLANE_URL"""
+    if not url or url == "memory://":
+        return InMemoryBackplane()
+    return RedisBackplane(url)
@@ -0,0 +1,215 @@
+"""
+Горячий хвост истории чата в памяти.
+
+Почти все запросы истории — это последние несколько десятков сообщений диалога.
+Для каждого диалога храним непрерывный хвост (по seq) последних сообщений:
+он пополняется при записи (через шину доставки, поэтому одинаково на всех
+воркерах) и заполняется при первом чтении истории. Диалоги вытесняются по LRU,
+когда суммарный размер превышает CHAT_HISTORY_CACHE_BYTES.
+"""
+import os
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+# Общий лимит памяти под хвосты всех диалогов (приблизительно, в байтах)
+CHAT_HISTORY_CACHE_BYTES = int(os.getenv("CHAT_HISTORY_CACHE_BYTES", str(16 * 1024 * 1024)))
+# Сколько последних сообщений держим на один диалог
+CHAT_HISTORY_CACHE_PER_CONVERSATION = int(os.getenv("CHAT_HISTORY_CACHE_PER_CONVERSATION", "200"))
+
+# Оценка накладных расходов на одно сообщение (dict, строки, ключи)
+MESSAGE_OVERHEAD_BYTES = 400
+
+
+def message_size(message: dict) -> int:
+    return MESSAGE_OVERHEAD_BYTES + len(message.get("content") or "")
+
+
+class ConversationTail:
+    """
+    Последние сообщения одного диалога без пропусков по seq.
+
+    seq внутри диалога идут подряд с 1, поэтому по первому сообщению хвоста
+    видно, есть ли что-то раньше него.
+    """
+
+    def __init__(self, maxlen: int):
+        self.messages: deque = deque(maxlen=maxlen)
+        self.nbytes = 0
+
+    @property
+    def from_start(self) -> bool:
+        """Хвост начинается с первого сообщения диалога — раньше ничего нет"""
+        return bool(self.messages) and self.messages[0]["seq"] == 1
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        return self.messages[-1]["seq"] if self.messages else None
+
+    def append(self, message: dict) -> bool:
+        """Дописать сообщение; False — между хвостом и сообщением дыра"""
+        last_seq = self.last_seq
+        if last_seq is not None and message["seq"] <= last_seq:
+            return True  # уже есть (повторная доставка)
+        if last_seq is not None and message["seq"] != last_seq + 1:
+            return False
+        if len(self.messages) == self.messages.maxlen:
+            self.nbytes -= message_size(self.messages[0])
+        self.messages.append(message)
+        self.nbytes += message_size(message)
+        return True
+
+    def index_of(self, message_id: int) -> Optional[int]:
+        for i, message in enumerate(self.messages):
+            if message["id"] == message_id:
+                return i
+        return None
+
+
+class HotTailCache:
+    def __init__(
+        self,
+        max_bytes: int = CHAT_HISTORY_CACHE_BYTES,
+        per_conversation: int = CHAT_HISTORY_CACHE_PER_CONVERSATION,
+    ):
+        self.max_bytes = max_bytes
+        self.per_conversation = per_conversation
+        self.tails: "OrderedDict[int, ConversationTail]" = OrderedDict()
+        # Диалоги, которые сейчас читаются из БД: запись во время чтения делает результат устаревшим
+        self._loading: Dict[int, bool] = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.per_conversation > 0
+
+    # ---------- запись ----------
+
+    def append(self, message: dict):
+        """Новое сообщение (вызывается при доставке кадра из шины)"""
+        conversation_id = message.get("conversation_id")
+        if conversation_id is None or message.get("seq") is None:
+            return
+        if conversation_id in self._loading:
+            self._loading[conversation_id] = False
+        tail = self.tails.get(conversation_id)
+        if tail is None:
+            return
+        before = tail.nbytes
+        if not tail.append(message):
+            # Пропустили сообщения (например, при переподключении шины) — хвосту больше нельзя верить
+            self.drop(conversation_id)
+            return
+        self.nbytes += tail.nbytes - before
+        self.tails.move_to_end(conversation_id)
+        self._evict()
+
+    def begin_load(self, conversation_id: int):
+        """Отметить начало чтения хвоста из БД (до запроса)"""
+        if self.enabled and conversation_id not in self.tails:
+            self._loading[conversation_id] = True
+
+    def end_load(self, conversation_id: int):
+        """Снять отметку чтения (в finally: запрос к БД мог упасть до load)"""
+        self._loading.pop(conversation_id, None)
+
+    def load(self, conversation_id: int, messages: List[dict]):
+        """
+        Положить в кэш последнюю страницу диалога, прочитанную из БД.
+
+        Страница принимается, только если все сообщения из этого диалога, seq идут
+        подряд и за время чтения не было новых записей в диалог.
+        """
+        fresh = self._loading.pop(conversation_id, False)
+        if not fresh or not messages or conversation_id in self.tails:
+            return
+        seqs = [m.get("seq") for m in messages]
+        if any(m.get("conversation_id") != conversation_id for m in messages) or None in seqs:
+            return
+        if seqs != list(range(seqs[0], seqs[0] + len(seqs))):
+            return
+        tail = ConversationTail(self.per_conversation)
+        for message in messages:
+            tail.append(message)
+        self.tails[conversation_id] = tail
+        self.nbytes += tail.nbytes
+        self._evict()
+
+    def drop(self, conversation_id: int):
+        tail = self.tails.pop(conversation_id, None)
+        if tail is not None:
+            self.nbytes -= tail.nbytes
+
+    def clear(self):
+        self.tails.clear()
+        self._loading.clear()
+        self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self.tails:
+            _, tail = self.tails.popitem(last=False)
+            self.nbytes -= tail.nbytes
+            self.evictions += 1
+
+    # ---------- чтение ----------
+
+    def page(
+        self,
+        conversation_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> Optional[Tuple[List[dict], bool]]:
+        """
+        Страница истории (по возрастанию) и флаг "есть ещё" — или None, если
+        хвост её не покрывает и нужно идти в БД.
+        """
+        result = self._page(conversation_id, limit, before_id, after_id)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.tails.move_to_end(conversation_id)
+        return result
+
+    def _page(self, conversation_id, limit, before_id, after_id):
+        tail = self.tails.get(conversation_id)
+        if tail is None or not tail.messages:
+            return None
+        messages = tail.messages
+
+        if after_id is not None:
+            index = tail.index_of(after_id)
+            if index is None:
+                return None
+            newer = list(messages)[index + 1:]
+            return newer[:limit], len(newer) > limit
+
+        end = len(messages)
+        if before_id is not None:
+            end = tail.index_of(before_id)
+            if end is None:
+                return None
+        start = end - limit
+        if start >= 0:
+            return list(messages)[start:end], start > 0 or not tail.from_start
+        if not tail.from_start:
+            return None
+        return list(messages)[:end], False
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "conversations": len(self.tails),
+            "messages": sum(len(t.messages) for t in self.tails.values()),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "per_conversation": self.per_conversation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 4) if requests else 0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,272 @@
+"""
+Групповая запись сообщений чата (group commit).
+
+Обработчики WebSocket не коммитят каждое сообщение сами: они ставят его в очередь
+и ждут подтверждения. Фоновый писатель собирает сообщения за несколько
+миллисекунд (или до CHAT_WRITE_BATCH_SIZE штук) и пишет их одной транзакцией
+через асинхронный драйвер, поэтому fsync не блокирует цикл событий, а пропускная
+способность чата ограничена размером пачки, а не задержкой fsync.
+
+Там же каждому сообщению выдаётся seq — номер внутри диалога, по которому
+клиент после переподключения догружает только пропущенное, и обновляется
+сводка диалогов (conversations) для входящих админа, счётчики статистики и
+почасовые/подневные ряды сообщений.
+"""
+import asyncio
+import os
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal, pin_to_primary
+from app.models import Conversation, Message
+from app.stats_counters import increment, message_changes
+from app.timeseries import add_messages
+
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "200"))
+CHAT_WRITE_BATCH_INTERVAL_MS = float(os.getenv("CHAT_WRITE_BATCH_INTERVAL_MS", "5"))
+
+MESSAGE_FIELDS = ("content", "sender_id", "receiver_id", "is_owner", "created_at", "conversation_id", "seq")
+
+# Повторы пачки, если другой воркер успел занять те же seq
+SEQ_CONFLICT_RETRIES = 3
+
+# Как уникальный индекс (conversation_id, seq) называется в ошибках Postgres и SQLite
+SEQ_CONFLICT_MARKERS = ("ux_messages_conversation_id_seq", "messages.conversation_id, messages.seq")
+
+
+def is_seq_conflict(error: Exception) -> bool:
+    """Пачку опередили с теми же seq — её можно просто пронумеровать заново"""
+    return isinstance(error, IntegrityError) and any(marker in str(error.orig) for marker in SEQ_CONFLICT_MARKERS)
+
+
+class MessageWriter:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        batch_size: int = CHAT_WRITE_BATCH_SIZE,
+        batch_interval_ms: float = CHAT_WRITE_BATCH_INTERVAL_MS,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.batches = 0
+        self.messages = 0
+        self.failed = 0
+        self.last_batch_ms = 0.0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self.queue = asyncio.Queue()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, **fields) -> dict:
+        """
+        Поставить сообщение в очередь и дождаться фиксации транзакции.
+
+        Возвращает сохранённые поля вместе с id — это и есть подтверждение
+        долговечности для отправителя.
+        """
+        if self._stopping:
+            # Приложение останавливается: пишем сразу, без пачки
+            return (await self._write_batch([fields]))[0]
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fields, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Даём соседним сообщениям успеть в ту же транзакцию
+            if self.queue.qsize() < self.batch_size - 1 and self.batch_interval > 0:
+                await asyncio.sleep(self.batch_interval)
+            stop_after = False
+            while len(batch) < self.batch_size and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    stop_after = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stop_after:
+                await self._drain()
+                return
+
+    async def _drain(self):
+        """Дописать всё, что осталось в очереди"""
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is not None:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        started = time.perf_counter()
+        try:
+            saved = await self._write_batch([fields for fields, _ in batch])
+        except Exception as e:
+            if len(batch) > 1 and not is_seq_conflict(e):
+                # Виновата, скорее всего, одна строка: пишем по одной, чтобы ошибку получил только её отправитель
+                print(f"⚠️ Пачка из {len(batch)} сообщений не записалась ({e}), пишем по одному")
+                for item in batch:
+                    await self._flush([item])
+                return
+            self.failed += len(batch)
+            print(f"❌ Ошибка групповой записи сообщений ({len(batch)} шт.): {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.messages += len(batch)
+        self.last_batch_ms = (time.perf_counter() - started) * 1000
+        for (_, future), row in zip(batch, saved):
+            if not future.done():
+                future.set_result(row)
+
+    async def _write_batch(self, rows: List[dict]) -> List[dict]:
+        for attempt in range(SEQ_CONFLICT_RETRIES):
+            async with self.session_factory() as db:
+                try:
+                    numbered = await self._assign_seq(db, rows)
+                    messages = [Message(**{key: row.get(key) for key in MESSAGE_FIELDS}) for row in numbered]
+                    db.add_all(messages)
+                    await db.flush()
+                    saved = [dict(row, id=message.id) for row, message in zip(numbered, messages)]
+                    await self._update_conversations(db, saved)
+                    await increment(db, message_changes(saved))
+                    await add_messages(db, saved)
+                    await db.commit()
+                    # История диалога сразу после записи читается из основной БД, а не с реплики
+                    for conversation_id in {row["conversation_id"] for row in saved}:
+                        if conversation_id is not None:
+                            pin_to_primary(conversation_id)
+                    return saved
+                except IntegrityError as e:
+                    await db.rollback()
+                    if not is_seq_conflict(e) or attempt == SEQ_CONFLICT_RETRIES - 1:
+                        raise
+                except Exception:
+                    await db.rollback()
+                    raise
+
+    async def _assign_seq(self, db, rows: List[dict]) -> List[dict]:
+        """Выдать сообщениям пачки следующие номера в их диалогах (одним запросом)"""
+        conversation_ids = {row["conversation_id"] for row in rows if row.get("conversation_id") is not None}
+        last_seq = {}
+        if conversation_ids:
+            result = await db.execute(
+                select(Message.conversation_id, func.max(Message.seq))
+                .where(Message.conversation_id.in_(conversation_ids))
+                .group_by(Message.conversation_id)
+            )
+            last_seq = {conversation_id: seq or 0 for conversation_id, seq in result.all()}
+        numbered = []
+        for row in rows:
+            conversation_id = row.get("conversation_id")
+            if conversation_id is None:
+                numbered.append(dict(row, seq=None))
+                continue
+            last_seq[conversation_id] = last_seq.get(conversation_id, 0) + 1
+            numbered.append(dict(row, seq=last_seq[conversation_id]))
+        return numbered
+
+    async def _update_conversations(self, db, saved: List[dict]):
+        """Обновить сводки диалогов пачки: по одному upsert на диалог, в той же транзакции"""
+        summaries = {}
+        for row in saved:
+            conversation_id = row.get("conversation_id")
+            if conversation_id is None:
+                continue
+            summary = summaries.setdefault(conversation_id, {
+                "user_id": conversation_id,
+                "unread_for_admin": 0,
+                "unread_for_user": 0,
+                "message_count": 0,
+            })
+            summary["last_message_id"] = row["id"]
+            summary["last_message_at"] = row["created_at"]
+            summary["message_count"] += 1
+            # Сообщение пользователя ждёт админа, сообщение админа — пользователя
+            summary["unread_for_admin" if row.get("is_owner") else "unread_for_user"] += 1
+        if not summaries:
+            return
+
+        dialect = db.bind.dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            statement = insert(Conversation)
+            statement = statement.on_conflict_do_update(
+                index_elements=[Conversation.user_id],
+                set_={
+                    "last_message_id": statement.excluded.last_message_id,
+                    "last_message_at": statement.excluded.last_message_at,
+                    "unread_for_admin": Conversation.unread_for_admin + statement.excluded.unread_for_admin,
+                    "unread_for_user": Conversation.unread_for_user + statement.excluded.unread_for_user,
+                    "message_count": Conversation.message_count + statement.excluded.message_count,
+                },
+            )
+            await db.execute(statement, list(summaries.values()))
+            return
+
+        # Прочие СУБД: прочитать и обновить (строки блокируются той же транзакцией)
+        for summary in summaries.values():
+            conversation = await db.get(Conversation, summary["user_id"], with_for_update=True)
+            if conversation is None:
+                db.add(Conversation(**summary))
+                continue
+            conversation.last_message_id = summary["last_message_id"]
+            conversation.last_message_at = summary["last_message_at"]
+            conversation.unread_for_admin += summary["unread_for_admin"]
+            conversation.unread_for_user += summary["unread_for_user"]
+            conversation.message_count += summary["message_count"]
+        await db.flush()
+
+    async def stop(self):
+        """Сбросить очередь на диск и остановить писателя (при остановке приложения)"""
+        self._stopping = True
+        if self._task is None or self._task.done():
+            return
+        self.queue.put_nowait(None)
+        await self._task
+        print(f"✅ Очередь сообщений сброшена: {self.messages} сообщений, {self.batches} транзакций")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "messages": self.messages,
+            "batches": self.batches,
+            "failed": self.failed,
+            "avg_batch_size": round(self.messages / self.batches, 2) if self.batches else 0,
+            "last_batch_ms": round(self.last_batch_ms, 2),
+            "batch_size": self.batch_size,
+            "batch_interval_ms": self.batch_interval * 1000,
+        }
+
+
+async def mark_conversation_read(db, user_id: int, by_admin: bool):
+    """Обнулить счётчик непрочитанных диалога для админа или для пользователя"""
+    column = "unread_for_admin" if by_admin else "unread_for_user"
+    await db.execute(
+        update(Conversation)
+        .where(Conversation.user_id == user_id)
+        .values({column: 0})
+    )
+    await db.commit()
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,176 @@
+"""
+Полнотекстовый поиск по сообщениям чата.
+
+SQLite: внешняя FTS5-таблица messages_fts над messages (content='messages'),
+синхронизируется триггерами; ранжирование bm25, фрагменты snippet().
+Postgres: сгенерированная колонка content_tsv с GIN-индексом;
+ранжирование ts_rank_cd, фрагменты ts_headline.
+
+Индекс создаётся вместе с таблицей messages (событие after_create, т.е. и через
+create_tables.py) и миграцией Alembic для существующих баз.
+"""
+import html
+import re
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Float, Integer, column, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.pagination import decode_cursor, encode_cursor
+
+# Больше слов в запросе не берём: длинные запросы только замедляют поиск
+MAX_QUERY_TERMS = 16
+
+# Маркеры подсветки внутри фрагмента: управляющие символы не встречаются в тексте сообщений
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+
+POSTGRES_SEARCH_DDL = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING gin (content_tsv)",
+]
+
+SEARCH_DDL = {"sqlite": SQLITE_SEARCH_DDL, "postgresql": POSTGRES_SEARCH_DDL}
+
+# Курсор поиска: (ранг, id); меньший ранг — более релевантное сообщение
+SEARCH_ORDER = (column("rank", Float), column("id", Integer))
+
+SQLITE_SEARCH_SQL = """
+SELECT m.id, m.conversation_id, m.seq, m.sender_id, m.is_owner, m.created_at, hit.rank,
+       snippet(messages_fts, 0, :mark_start, :mark_end, '…', 12) AS snippet
+FROM (
+    SELECT rowid AS id, rank FROM messages_fts
+    WHERE messages_fts MATCH :query {conditions}
+    ORDER BY rank, rowid
+    LIMIT :limit
+) AS hit
+JOIN messages_fts ON messages_fts.rowid = hit.id AND messages_fts MATCH :query
+JOIN messages AS m ON m.id = hit.id
+ORDER BY hit.rank, hit.id
+"""
+
+POSTGRES_SEARCH_SQL = """
+SELECT m.id, m.conversation_id, m.seq, m.sender_id, m.is_owner, m.created_at, hit.rank,
+       ts_headline('simple', m.content, to_tsquery('simple', :query),
+                   'StartSel=' || :mark_start || ', StopSel=' || :mark_end || ', MaxWords=24, MinWords=8') AS snippet
+FROM (
+    SELECT id, -ts_rank_cd(content_tsv, to_tsquery('simple', :query)) AS rank FROM messages
+    WHERE content_tsv @@ to_tsquery('simple', :query) {conditions}
+    ORDER BY rank, id
+    LIMIT :limit
+) AS hit
+JOIN messages AS m ON m.id = hit.id
+ORDER BY hit.rank, hit.id
+"""
+
+
+def install_search_index(target, connection, **kw):
+    """Создать поисковый индекс сразу после таблицы messages (слушатель after_create)"""
+    for statement in SEARCH_DDL.get(connection.dialect.name, ()):
+        connection.execute(text(statement))
+
+
+def query_terms(query: str) -> List[str]:
+    return re.findall(r"\w+", query.lower())[:MAX_QUERY_TERMS]
+
+
+def build_match(dialect: str, terms: List[str]) -> str:
+    """
+    Запрос пользователя -> выражение MATCH/tsquery: все слова сразу.
+
+    Префиксом ищется только последнее слово (его, возможно, ещё допечатывают):
+    префиксы по всем словам раздувают выборку из индекса.
+    """
+    if dialect == "postgresql":
+        parts = list(terms[:-1]) + [f"{terms[-1]}:*"]
+        return " & ".join(parts)
+    parts = [f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*']
+    return " ".join(parts)
+
+
+def render_snippet(snippet: Optional[str]) -> str:
+    """Экранировать фрагмент и превратить маркеры в <mark> — результат можно вставлять как HTML"""
+    escaped = html.escape(snippet or "")
+    return escaped.replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+async def search_messages(
+    db: AsyncSession,
+    query: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+):
+    """
+    Найти сообщения по тексту: самые релевантные первыми, keyset-пагинация по (ранг, id).
+
+    Возвращает (результаты, курсор следующей страницы или None).
+    """
+    dialect = db.bind.dialect.name
+    if dialect not in SEARCH_DDL:
+        raise HTTPException(status_code=501, detail=f"Полнотекстовый поиск не поддерживается для {dialect}")
+    terms = query_terms(query)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Пустой поисковый запрос")
+
+    id_column = "rowid" if dialect == "sqlite" else "id"
+    rank_expr = "rank" if dialect == "sqlite" else "-ts_rank_cd(content_tsv, to_tsquery('simple', :query))"
+    conditions = []
+    params = {
+        "query": build_match(dialect, terms),
+        "limit": limit + 1,
+        "mark_start": MARK_START,
+        "mark_end": MARK_END,
+    }
+    if user_id is not None:
+        if dialect == "sqlite":
+            conditions.append("AND rowid IN (SELECT id FROM messages WHERE conversation_id = :user_id)")
+        else:
+            conditions.append("AND conversation_id = :user_id")
+        params["user_id"] = user_id
+    if cursor:
+        after_rank, after_id = decode_cursor(cursor, SEARCH_ORDER)
+        conditions.append(
+            f"AND ({rank_expr} > :after_rank OR ({rank_expr} = :after_rank AND {id_column} > :after_id))"
+        )
+        params.update(after_rank=after_rank, after_id=after_id)
+
+    sql = SQLITE_SEARCH_SQL if dialect == "sqlite" else POSTGRES_SEARCH_SQL
+    try:
+        rows = (await db.execute(text(sql.format(conditions=" ".join(conditions))), params)).mappings().all()
+    except (OperationalError, ProgrammingError) as e:
+        if "messages_fts" in str(e) or "content_tsv" in str(e):
+            raise HTTPException(status_code=503, detail="Поисковый индекс не создан: выполните alembic upgrade head")
+        raise
+
+    page = rows[:limit]
+    results = [
+        {
+            "id": row["id"],
+            "user_id": row["conversation_id"],
+            "seq": row["seq"],
+            "sender_id": row["sender_id"],
+            "is_from_admin": not row["is_owner"],
+            "created_at": row["created_at"].isoformat() if hasattr(row["created_at"], "isoformat") else row["created_at"],
+            "snippet": render_snippet(row["snippet"]),
+            "rank": row["rank"],
+        }
+        for row in page
+    ]
+    next_cursor = encode_cursor((page[-1]["rank"], page[-1]["id"])) if len(rows) > limit else None
+    return results, next_cursor
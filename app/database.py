@@ -1,72 +1,436 @@
-﻿from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+﻿"""
+Подключение к БД.
+
+Модуль ничего не делает при импорте: настройки читаются в DatabaseSettings,
+движки создаются при первом обращении (get_engine()/get_async_engine(), а также
+engine, async_engine, SessionLocal, AsyncSessionLocal) или при старте приложения
+в init_database(), которое заодно прогревает пул и отмечает готовность для /readyz.
+
+Реплики для чтения (DATABASE_REPLICA_URLS через запятую) подключаются к
+эндпоинтам явно — зависимостью get_read_db вместо get_async_db. Реплика
+выбирается по кругу среди тех, что отвечают и отстают не больше
+DB_REPLICA_MAX_LAG секунд; иначе чтение идёт в основную БД. Пользователь,
+который только что писал, DB_REPLICA_PIN_SECONDS читает из основной БД
+(pin_to_primary), чтобы увидеть свою запись.
+"""
+import asyncio
 import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.requests import HTTPConnection
+
+from app.query_stats import install_query_instrumentation
 
 load_dotenv()  # Загружаем переменные из .env
 
-print("\n" + "="*60)
-print("🔍 ДИАГНОСТИКА ПОДКЛЮЧЕНИЯ К БД")
-print("="*60)
+# Корень проекта: по умолчанию БД — app.db в нём
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# Текущая рабочая директория
-current_dir = os.getcwd()
-print(f"📁 Текущая рабочая директория: {current_dir}")
+# Асинхронные драйверы для тех же баз
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
 
-# Путь к этому файлу (database.py)
-current_file = os.path.abspath(__file__)
-print(f"📁 Этот файл: {current_file}")
+def default_database_url() -> str:
+    """Первый существующий app.db (корень проекта, затем рабочая директория) или новый в корне"""
+    possible_paths = [os.path.join(BASE_DIR, "app.db"), os.path.abspath("app.db")]
+    for path in possible_paths:
+        if os.path.exists(path):
+            return f"sqlite:///{path}"
+    return f"sqlite:///{possible_paths[0]}"
 
-# Определяем абсолютный путь к БД (ищем app.db в корне проекта)
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-print(f"📁 BASE_DIR (корень проекта): {BASE_DIR}")
-
-# Проверяем наличие app.db в разных местах
-possible_paths = [
-    os.path.join(BASE_DIR, "app.db"),
-    os.path.join(current_dir, "app.db"),
-    os.path.abspath("app.db")
-]
-
-for i, path in enumerate(possible_paths):
-    exists = os.path.exists(path)
-    print(f"📁 Вариант {i+1}: {path} - {'✅ СУЩЕСТВУЕТ' if exists else '❌ НЕТ'}")
-
-# Используем первый существующий путь
-DB_PATH = None
-for path in possible_paths:
-    if os.path.exists(path):
-        DB_PATH = path
-        print(f"✅ ВЫБРАН: {DB_PATH}")
-        break
-
-if not DB_PATH:
-    DB_PATH = possible_paths[0]  # По умолчанию первый вариант
-    print(f"⚠️ Ни один файл не найден, создадим: {DB_PATH}")
-
-# Получаем URL БД из переменных окружения или используем найденный путь
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-if not DATABASE_URL:
-    DATABASE_URL = f"sqlite:///{DB_PATH}"
-    print(f"📁 ИТОГОВЫЙ ПУТЬ К БД: {DB_PATH}")
-    print(f"📁 DATABASE_URL: {DATABASE_URL}")
-
-# Создаем движок SQLAlchemy
-engine = create_engine(
-    DATABASE_URL,
-    # Для SQLite нужно добавить connect_args
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-)
+def make_async_url(url: str) -> str:
+    """Подобрать асинхронный драйвер к синхронному DATABASE_URL"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if parsed.get_driver_name() in ("aiosqlite", "asyncpg", "psycopg"):
+        return url
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Нет асинхронного драйвера для {backend}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def is_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")
+
+def sqlite_pragmas_from_env() -> Dict[str, object]:
+    # PRAGMA для каждого нового подключения SQLite. WAL: читатели не ждут писателя чата,
+    # synchronous=NORMAL в режиме WAL не теряет целостность (fsync только на checkpoint)
+    return {
+        "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        # Отрицательное значение — размер в КиБ (64 МБ на подключение)
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+        "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    }
+
+@dataclass
+class DatabaseSettings:
+    url: str
+    async_url: str
+    # Пул: SQLite пишет один поток, поэтому пул небольшой; Postgres держит больше подключений
+    pool_size: int
+    max_overflow: int
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    # Сколько подключений открыть заранее при старте (не больше pool_size)
+    pool_prewarm: int = 0
+    sqlite_pragmas: Dict[str, object] = field(default_factory=dict)
+    replica_urls: List[str] = field(default_factory=list)
+    # Реплика, отстающая сильнее, из ротации выводится до следующей проверки
+    replica_max_lag: float = 5.0
+    replica_check_interval: float = 2.0
+    # Сколько секунд после записи пользователь читает только из основной БД
+    replica_pin_seconds: float = 10.0
+
+    @property
+    def is_sqlite(self) -> bool:
+        return make_url(self.url).get_backend_name() == "sqlite"
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        url = os.getenv("DATABASE_URL") or default_database_url()
+        sqlite = make_url(url).get_backend_name() == "sqlite"
+        pool_size = int(os.getenv("DB_POOL_SIZE", "5" if sqlite else "10"))
+        return cls(
+            url=url,
+            # ASYNC_DATABASE_URL можно задать явно, например postgresql+psycopg://... для async psycopg
+            async_url=os.getenv("ASYNC_DATABASE_URL") or make_async_url(url),
+            pool_size=pool_size,
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10" if sqlite else "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            pool_prewarm=int(os.getenv("DB_POOL_PREWARM", str(min(pool_size, 2)))),
+            sqlite_pragmas=sqlite_pragmas_from_env() if sqlite else {},
+            replica_urls=[url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()],
+            replica_max_lag=float(os.getenv("DB_REPLICA_MAX_LAG", "5")),
+            replica_check_interval=float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2")),
+            replica_pin_seconds=float(os.getenv("DB_REPLICA_PIN_SECONDS", "10")),
+        )
+
+    def engine_options(self, url: str, pool_class) -> dict:
+        """Параметры create_engine для SQLite или серверной СУБД"""
+        if make_url(url).get_backend_name() != "sqlite":
+            return {
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "pool_timeout": self.pool_timeout,
+                "pool_recycle": self.pool_recycle,
+                "pool_pre_ping": True,
+            }
+        options = {"connect_args": {"check_same_thread": False}}
+        if not is_memory_sqlite(url):
+            # aiosqlite по умолчанию открывает файл заново на каждую сессию (NullPool) —
+            # с пулом PRAGMA и mmap применяются один раз на подключение
+            options.update(
+                poolclass=pool_class,
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+            )
+        return options
+
+def install_engine_profile(sync_engine: Engine, pragmas: Dict[str, object]):
+    """Слушатель connect: настроить каждое свежее подключение SQLite"""
+    if sync_engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    event.listen(sync_engine, "connect", apply_sqlite_pragmas)
+
+_settings: Optional[DatabaseSettings] = None
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[sessionmaker] = None
+_async_session_factory: Optional[async_sessionmaker] = None
+# Пул прогрет и БД ответила — можно принимать трафик
+_ready = False
+_replicas: Optional["ReplicaSet"] = None
+
+def get_settings() -> DatabaseSettings:
+    global _settings
+    if _settings is None:
+        _settings = DatabaseSettings.from_env()
+    return _settings
+
+def get_engine() -> Engine:
+    """Синхронный движок — для скриптов и миграций"""
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        _engine = create_engine(settings.url, **settings.engine_options(settings.url, QueuePool))
+        install_engine_profile(_engine, settings.sqlite_pragmas)
+        install_query_instrumentation(_engine)
+    return _engine
+
+def get_async_engine() -> AsyncEngine:
+    """Асинхронный движок: запросы роутеров не блокируют цикл событий и WebSocket-ы"""
+    global _async_engine
+    if _async_engine is None:
+        settings = get_settings()
+        _async_engine = create_async_engine(
+            settings.async_url, **settings.engine_options(settings.async_url, AsyncAdaptedQueuePool)
+        )
+        install_engine_profile(_async_engine.sync_engine, settings.sqlite_pragmas)
+        install_query_instrumentation(_async_engine.sync_engine)
+    return _async_engine
+
+def get_session_factory() -> sessionmaker:
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    return _session_factory
+
+def get_async_session_factory() -> async_sessionmaker:
+    global _async_session_factory
+    if _async_session_factory is None:
+        # expire_on_commit=False: после commit объекты читаются без неявных запросов
+        _async_session_factory = async_sessionmaker(
+            get_async_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+    return _async_session_factory
+
+class LazySessionFactory:
+    """Фабрика сессий, которая создаёт движок только при первом вызове"""
+
+    def __init__(self, get_factory):
+        self._get_factory = get_factory
+
+    def __call__(self, **kwargs):
+        return self._get_factory()(**kwargs)
+
+# Фабрики сессий: синхронная — для скриптов, асинхронная — для приложения
+SessionLocal = LazySessionFactory(get_session_factory)
+AsyncSessionLocal = LazySessionFactory(get_async_session_factory)
 
-# Создаем фабрику сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# engine и async_engine остаются атрибутами модуля, но создаются при первом обращении
+def __getattr__(name):
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Базовый класс для моделей
 Base = declarative_base()
 
-print("="*60 + "\n")
+# Отставание реплики Postgres в секундах (0 — реплика догнала основную БД)
+POSTGRES_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+class ReplicaSet:
+    """Движки реплик, их состояние (доступность, отставание) и закрепления за основной БД"""
+
+    def __init__(self, settings: DatabaseSettings):
+        self.settings = settings
+        self.engines: List[AsyncEngine] = []
+        self.factories: List[async_sessionmaker] = []
+        for url in settings.replica_urls:
+            async_url = make_async_url(url)
+            engine = create_async_engine(async_url, **settings.engine_options(async_url, AsyncAdaptedQueuePool))
+            # На SQLite-реплике запись запрещена: случайный INSERT не разойдётся с основной БД
+            install_engine_profile(engine.sync_engine, {**settings.sqlite_pragmas, "query_only": "ON"})
+            install_query_instrumentation(engine.sync_engine)
+            self.engines.append(engine)
+            # info["replica"]: по этому признаку код отличает сессию реплики от основной
+            self.factories.append(async_sessionmaker(
+                engine, class_=AsyncSession, autoflush=False, expire_on_commit=False, info={"replica": True}
+            ))
+        count = len(self.engines)
+        # До первой проверки реплика считается недоступной
+        self.healthy = [False] * count
+        self.lag: List[Optional[float]] = [None] * count
+        self.reads = [0] * count
+        self.primary_reads = 0
+        self._next = 0
+        self._pins: Dict[object, float] = {}
+        self._monitor: Optional[asyncio.Task] = None
+
+    def choose(self) -> Optional[int]:
+        """Следующая годная реплика по кругу или None"""
+        count = len(self.engines)
+        for step in range(count):
+            index = (self._next + step) % count
+            lag = self.lag[index]
+            if self.healthy[index] and lag is not None and lag <= self.settings.replica_max_lag:
+                self._next = index + 1
+                self.reads[index] += 1
+                return index
+        self.primary_reads += 1
+        return None
+
+    async def check(self, index: int):
+        engine = self.engines[index]
+        try:
+            async with engine.connect() as conn:
+                if engine.dialect.name == "postgresql":
+                    lag = float((await conn.execute(text(POSTGRES_LAG_SQL))).scalar() or 0)
+                else:
+                    await conn.execute(text("SELECT 1"))
+                    lag = 0.0
+        except Exception as e:
+            if self.healthy[index]:
+                print(f"❌ Реплика {index} недоступна ({e}), чтение переходит на основную БД")
+            self.healthy[index] = False
+            return
+        if not self.healthy[index]:
+            print(f"✅ Реплика {index} доступна, отставание {lag:.2f}с")
+        self.healthy[index] = True
+        self.lag[index] = lag
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(index) for index in range(len(self.engines))))
+
+    async def _monitor_loop(self):
+        while True:
+            await asyncio.sleep(self.settings.replica_check_interval)
+            await self.check_all()
+
+    def start_monitor(self):
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.create_task(self._monitor_loop())
+
+    def pin(self, key):
+        now = time.monotonic()
+        self._pins[key] = now + self.settings.replica_pin_seconds
+        if len(self._pins) > 10000:
+            self._pins = {k: until for k, until in self._pins.items() if until > now}
+
+    def is_pinned(self, key) -> bool:
+        until = self._pins.get(key)
+        return until is not None and until > time.monotonic()
+
+    async def dispose(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._monitor = None
+        for engine in self.engines:
+            await engine.dispose()
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "url": engine.url.render_as_string(hide_password=True),
+                    "healthy": self.healthy[index],
+                    "lag": self.lag[index],
+                    "reads": self.reads[index],
+                }
+                for index, engine in enumerate(self.engines)
+            ],
+            "primary_reads": self.primary_reads,
+            "max_lag": self.settings.replica_max_lag,
+        }
+
+def get_replicas() -> Optional[ReplicaSet]:
+    """Реплики для чтения или None, если DATABASE_REPLICA_URLS не задан"""
+    global _replicas
+    if _replicas is None and get_settings().replica_urls:
+        _replicas = ReplicaSet(get_settings())
+    return _replicas
+
+def pin_to_primary(key):
+    """После записи: чтения по этому ключу (id пользователя) какое-то время идут в основную БД"""
+    replicas = get_replicas()
+    if replicas is not None:
+        replicas.pin(key)
+
+async def init_database(prewarm: Optional[int] = None):
+    """
+    Создать движок, прогреть пул и вывести фактические настройки (при старте приложения).
+
+    Прогрев открывает prewarm подключений одновременно, поэтому первые запросы
+    не платят за подключение и PRAGMA; ошибка здесь останавливает старт воркера.
+    """
+    global _ready
+    settings = get_settings()
+    async_engine = get_async_engine()
+    prewarm = settings.pool_prewarm if prewarm is None else prewarm
+    pool = async_engine.pool
+    if hasattr(pool, "size"):
+        prewarm = min(prewarm, pool.size())
+    else:
+        prewarm = min(prewarm, 1)
+
+    connections = [await async_engine.connect() for _ in range(max(prewarm, 1))]
+    try:
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in connections))
+        effective = {}
+        if async_engine.dialect.name == "sqlite":
+            for name in settings.sqlite_pragmas:
+                effective[name] = (await connections[0].execute(text(f"PRAGMA {name}"))).scalar()
+    finally:
+        for conn in connections:
+            await conn.close()
+
+    print(f"🗄️ БД: {async_engine.url.render_as_string(hide_password=True)}, пул {type(pool).__name__}"
+          + (f" (size={pool.size()}, overflow={settings.max_overflow}, прогрето {prewarm})" if hasattr(pool, "size") else ""))
+    if effective:
+        print("🗄️ SQLite: " + ", ".join(f"{name}={value}" for name, value in effective.items()))
+    replicas = get_replicas()
+    if replicas is not None:
+        await replicas.check_all()
+        replicas.start_monitor()
+        print(f"🗄️ Реплики для чтения: {sum(replicas.healthy)} из {len(replicas.engines)} доступны")
+    _ready = True
+
+async def check_database() -> dict:
+    """Проверка для /readyz: время запроса SELECT 1 и состояние пула"""
+    if not _ready:
+        return {"ready": False, "detail": "БД ещё не инициализирована"}
+    async_engine = get_async_engine()
+    started = time.perf_counter()
+    try:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    except Exception as e:
+        return {"ready": False, "detail": str(e)}
+    status = {
+        "ready": True,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        "pool": async_engine.pool.status(),
+    }
+    if _replicas is not None:
+        status["replicas"] = _replicas.stats()
+    return status
+
+async def dispose_database():
+    """Закрыть подключения (при остановке приложения)"""
+    global _ready, _replicas
+    _ready = False
+    if _replicas is not None:
+        await _replicas.dispose()
+        _replicas = None
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
 
 # Функция для получения сессии БД
 def get_db():
@@ -74,4 +438,42 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Асинхронная сессия БД для роутеров: одна на запрос (её открывает AuthMiddleware)
+async def get_async_db(connection: HTTPConnection):
+    db = connection.scope.get("state", {}).get("db")
+    if db is not None:
+        yield db
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Заголовок, которым клиент требует чтения из основной БД
+READ_PRIMARY_HEADER = "X-Read-Primary"
+
+def must_read_primary(connection: HTTPConnection, replicas: ReplicaSet) -> bool:
+    """Чтение должно видеть свежие записи: пользователь (или диалог из пути) недавно писал"""
+    if connection.headers.get(READ_PRIMARY_HEADER):
+        return True
+    user = connection.scope.get("state", {}).get("user")
+    if user is not None and replicas.is_pinned(user.id):
+        return True
+    user_id = str(connection.path_params.get("user_id", ""))
+    return user_id.isdigit() and replicas.is_pinned(int(user_id))
+
+# Сессия только для чтения: эндпоинт подключает её явно вместо get_async_db
+async def get_read_db(connection: HTTPConnection):
+    replicas = get_replicas()
+    index = None
+    if replicas is not None:
+        if must_read_primary(connection, replicas):
+            replicas.primary_reads += 1
+        else:
+            index = replicas.choose()
+    if index is None:
+        async for db in get_async_db(connection):
+            yield db
+        return
+    async with replicas.factories[index]() as db:
+        yield db
@@ -1,11 +1,14 @@
 ﻿from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import jwt
 from datetime import datetime
 from typing import Optional
-from app.database import get_db
+from app.database import AsyncSessionLocal, get_async_db
 from app.models import User
+from app.auth_cache import AuthenticatedUser, auth_cache
+from app.auth_middleware import extract_token
 
 # Импортируем секретный ключ из main с обработкой ошибки
 try:
@@ -21,28 +24,23 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=Fals
 async def get_current_user(
     request: Request = None,
     token: Optional[str] = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получить текущего пользователя из токена"""
     
-    # 1. Пробуем взять токен из Depends (OAuth2PasswordBearer)
-    access_token = token
+    # 1. Обычно AuthMiddleware уже разобрал токен и нашёл пользователя
+    state = request.state if request is not None else None
+    if state is not None and hasattr(state, "auth_error"):
+        if state.user is not None:
+            return state.user
+        if state.auth_error is not None:
+            raise state.auth_error
+        access_token = None
+    else:
+        # 2. Без middleware: токен из Depends (OAuth2PasswordBearer), заголовка, cookie или query string
+        access_token = token or (extract_token(request) if request else None)
     
-    # 2. Если нет, пробуем из заголовка Authorization
-    if not access_token and request:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            access_token = auth_header.replace("Bearer ", "")
-    
-    # 3. Если нет, пробуем из cookies
-    if not access_token and request:
-        access_token = request.cookies.get("access_token")
-    
-    # 4. Если нет, пробуем из query string (для WebSocket)
-    if not access_token and request:
-        access_token = request.query_params.get("token")
-    
-    # 5. Если нет токена - ошибка
+    # 3. Если нет токена - ошибка
     if not access_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -50,9 +48,39 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # 6. Декодируем токен
+    # 4. Токен и пользователь (через кэш аутентификации)
+    return await resolve_user(
+        access_token,
+        lambda user_id: db.get(User, user_id),
+        lambda user_id: load_token_version(db, user_id)
+    )
+
+async def load_user_in_new_session(user_id: int):
+    """Загрузка пользователя там, где нет сессии из Depends (страницы в main.py)"""
+    async with AsyncSessionLocal() as db:
+        return await db.get(User, user_id)
+
+async def load_token_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    """Текущая версия токенов (по первичному ключу); None — пользователя нет"""
+    row = (await db.execute(select(User.token_version).where(User.id == user_id))).first()
+    return None if row is None else (row[0] or 0)
+
+async def load_token_version_in_new_session(user_id: int) -> Optional[int]:
+    async with AsyncSessionLocal() as db:
+        return await load_token_version(db, user_id)
+
+async def resolve_user(access_token: str, load_user=None, load_version=None):
+    """
+    Проверить токен и найти пользователя.
+
+    Access-токен с ролью и версией (см. app.routers.auth) самодостаточен:
+    пользователь берётся из claims, отзыв проверяется по версии токенов
+    (кэш на несколько секунд, при промахе — load_version(user_id)).
+    Для старых токенов (только sub) пользователь ищется через кэш, а при
+    промахе — load_user(user_id).
+    """
     try:
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = auth_cache.decode(access_token, SECRET_KEY, ALGORITHM)
         user_id = payload.get("sub")
         
         if user_id is None:
@@ -75,7 +103,6 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # 7. Получаем пользователя из БД по ID
     try:
         user_id_int = int(user_id)
     except ValueError:
@@ -85,7 +112,23 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = db.query(User).filter(User.id == user_id_int).first()
+    if payload.get("type") == "refresh":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Недействительный токен: refresh-токен не подходит для доступа",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    if "ver" in payload and "role" in payload:
+        if await auth_cache.is_revoked(user_id_int, payload["ver"], load_version or load_token_version_in_new_session):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Токен отозван",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return AuthenticatedUser.from_claims(payload)
+    
+    user = await auth_cache.get_user(user_id_int, load_user or load_user_in_new_session)
     
     if user is None:
         raise HTTPException(
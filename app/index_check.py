@@ -0,0 +1,184 @@
+"""
+Проверка индексов: каждая колонка модели из WHERE/ORDER BY/GROUP BY должна
+быть покрыта индексом.
+
+Код приложения разбирается через ast: берутся ссылки вида Model.column (или
+models.Model.column) внутри вызовов .where()/.filter()/.order_by()/.group_by(),
+а также кортежи *_ORDER, по которым строится keyset-пагинация, и каждая
+сортировка и каждый фильтр из Listing(sorts=..., filters=...). Колонка покрыта,
+если она первая в индексе (первичном ключе, уникальном ограничении) или все
+колонки индекса перед ней фильтруются в том же вызове. Булевы колонки не
+проверяются: индекс по ним почти никогда не выбирается. Колонки из условия
+частичного индекса (WHERE ... в индексе) тоже считаются покрытыми.
+
+Запуск: python -m app.index_check — код возврата 1, если есть непокрытые колонки.
+"""
+import ast
+import os
+import re
+import sys
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import Boolean
+
+from app.database import Base
+import app.models  # noqa: F401 — регистрирует модели в Base.metadata
+
+QUERY_METHODS = {"where", "filter", "order_by", "group_by"}
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (файл, строка, таблица, колонки одного вызова)
+Usage = Tuple[str, int, str, Tuple[str, ...]]
+
+
+def model_tables() -> Dict[str, object]:
+    """Имя класса модели -> таблица"""
+    return {mapper.class_.__name__: mapper.local_table for mapper in Base.registry.mappers}
+
+
+def column_refs(node: ast.AST, tables: Dict[str, object]) -> List[Tuple[str, str]]:
+    """Все ссылки Model.column (и models.Model.column) внутри узла"""
+    refs = []
+    for child in ast.walk(node):
+        if not isinstance(child, ast.Attribute):
+            continue
+        owner = child.value
+        if isinstance(owner, ast.Attribute):
+            owner_name = owner.attr
+        elif isinstance(owner, ast.Name):
+            owner_name = owner.id
+        else:
+            continue
+        table = tables.get(owner_name)
+        if table is not None and child.attr in table.c:
+            refs.append((table.name, child.attr))
+    return refs
+
+
+def is_query_call(node: ast.AST) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in QUERY_METHODS
+
+
+def is_listing_call(node: ast.AST) -> bool:
+    func = getattr(node, "func", None)
+    return isinstance(node, ast.Call) and (
+        isinstance(func, ast.Name) and func.id == "Listing"
+        or isinstance(func, ast.Attribute) and func.attr == "Listing"
+    )
+
+
+def listing_groups(node: ast.Call, tables: Dict[str, object]) -> List[List[Tuple[str, str]]]:
+    """Сортировки и фильтры Listing — каждая(ый) отдельным запросом"""
+    groups = []
+    for keyword in node.keywords:
+        if keyword.arg in ("sorts", "filters") and isinstance(keyword.value, ast.Dict):
+            groups.extend(column_refs(value, tables) for value in keyword.value.values)
+    return groups
+
+
+def find_usages(paths: Iterable[str], tables: Dict[str, object]) -> List[Usage]:
+    usages = []
+    for path in paths:
+        with open(path, encoding="utf-8-sig") as f:
+            tree = ast.parse(f.read(), filename=path)
+        # Цепочка select(...).where(...).order_by(...) — один запрос: проверяем её целиком по внешнему вызову
+        chained = {
+            id(node.func.value) for node in ast.walk(tree)
+            if is_query_call(node) and is_query_call(node.func.value)
+        }
+        for node in ast.walk(tree):
+            if is_query_call(node):
+                if id(node) in chained:
+                    continue
+                refs = []
+                groups = [refs]
+                call = node
+                while is_query_call(call):
+                    args = call.args + [keyword.value for keyword in call.keywords]
+                    refs.extend(ref for arg in args for ref in column_refs(arg, tables))
+                    call = call.func.value
+            elif isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id.endswith("_ORDER") for target in node.targets
+            ):
+                groups = [column_refs(node.value, tables)]
+            elif is_listing_call(node):
+                groups = listing_groups(node, tables)
+            else:
+                continue
+            for refs in groups:
+                for table in {table for table, _ in refs}:
+                    columns = tuple(dict.fromkeys(column for t, column in refs if t == table))
+                    usages.append((os.path.relpath(path), node.lineno, table, columns))
+    return usages
+
+
+def index_column_lists(table) -> List[List[str]]:
+    """Списки колонок всех индексов таблицы, включая первичный ключ и уникальные ограничения"""
+    lists = [[column.name for column in table.primary_key.columns]]
+    for constraint in table.constraints:
+        columns = getattr(constraint, "columns", None)
+        if columns is not None and len(columns):
+            lists.append([column.name for column in columns])
+    for column in table.columns:
+        if column.index or column.unique:
+            lists.append([column.name])
+    for index in table.indexes:
+        lists.append([column.name for column in index.columns])
+    return lists
+
+
+def partial_index_columns(table) -> Set[str]:
+    """Колонки из условий частичных индексов"""
+    names = set()
+    for index in table.indexes:
+        for dialect in ("sqlite", "postgresql"):
+            where = index.dialect_options[dialect].get("where")
+            if where is None:
+                continue
+            names.update(column.name for column in table.columns if re.search(rf"\b{column.name}\b", str(where)))
+    return names
+
+
+def is_covered(table, column: str, used: Set[str]) -> bool:
+    if isinstance(table.c[column].type, Boolean):
+        return True
+    if column in partial_index_columns(table):
+        return True
+    for columns in index_column_lists(table):
+        if column in columns and set(columns[:columns.index(column)]) <= used:
+            return True
+    return False
+
+
+def check(paths: Iterable[str]) -> List[str]:
+    """Сообщения о непокрытых колонках (пустой список — всё в порядке)"""
+    tables = model_tables()
+    by_name = {table.name: table for table in tables.values()}
+    problems = []
+    for path, line, table_name, columns in find_usages(paths, tables):
+        table = by_name[table_name]
+        for column in columns:
+            if not is_covered(table, column, set(columns)):
+                problems.append(f"{path}:{line}: {table_name}.{column} без подходящего индекса")
+    return sorted(set(problems))
+
+
+def app_sources(root: str = APP_DIR) -> List[str]:
+    sources = []
+    for directory, _, files in os.walk(root):
+        sources.extend(os.path.join(directory, name) for name in files if name.endswith(".py"))
+    return sorted(sources)
+
+
+def main(argv: List[str]) -> int:
+    problems = check(argv or app_sources())
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        return 1
+    print("✅ Все колонки из фильтров и сортировок покрыты индексами")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,16 +1,31 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 import jwt
 from datetime import datetime, timedelta
-from app.database import get_db
-from app.models import User
+from app.database import check_database, dispose_database, init_database
+from app.models import Service, Setting, User
 from app.routers import auth, chat, projects, admin, services, stats
 from app.dependencies import get_current_user
+from app.auth_middleware import AuthMiddleware
+from app.query_stats import QueryStatsMiddleware
+from app.chat_backplane import create_backplane
+from app.websocket_manager import manager as chat_manager
+from app.chat_persistence import message_writer
+from app.passwords import password_hasher
+from app.rate_limit import create_backend as create_rate_limit_backend, limiter
+from app.stats_counters import stats_reconciler
+from app.response_cache import response_cache
+from app.schema import schema_registry
 
 app = FastAPI(title="AI Developer Portal", version="1.0")
 
+# Токен, пользователь и сессия БД разбираются один раз на запрос (request.state)
+app.add_middleware(AuthMiddleware)
+# Учёт SQL-запросов по HTTP-запросам; снаружи AuthMiddleware, чтобы учитывать и поиск пользователя
+app.add_middleware(QueryStatsMiddleware)
+
 # ========== CORS для WebSocket ==========
 from fastapi.middleware.cors import CORSMiddleware
 app.add_middleware(
@@ -43,6 +58,36 @@ app.include_router(services.router)   # /api/services/*
 app.include_router(stats.router)      # /api/stats/*
 # ==========================================
 
+# ========== ЖИЗНЕННЫЙ ЦИКЛ ==========
+@app.on_event("startup")
+async def on_startup():
+    # Движок создаётся здесь, а не при импорте; пул прогревается до приёма трафика
+    await init_database()
+    # Схема читается один раз (обработчики админки проверяют таблицы без запросов к БД);
+    # таблицы, которые админка раньше создавала на лету, создаются здесь, а не в запросах
+    await schema_registry.refresh()
+    await schema_registry.ensure_tables([Service.__table__, Setting.__table__])
+    # Шина чата: в памяти процесса или Redis при нескольких воркерах
+    await chat_manager.start_backplane(create_backplane())
+    # Фоновый писатель сообщений чата (групповой коммит)
+    message_writer.start()
+    # Счётчики лимитов: в памяти процесса или общие в Redis (RATE_LIMIT_URL)
+    await limiter.set_backend(create_rate_limit_backend())
+    # Сверка счётчиков статистики с таблицами (при пустой stats_counters — сразу)
+    stats_reconciler.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stats_reconciler.stop()
+    await response_cache.close()
+    # Сначала дописываем очередь сообщений, потом гасим шину
+    await message_writer.stop()
+    await chat_manager.stop_backplane()
+    password_hasher.shutdown()
+    await limiter.backend.close()
+    await dispose_database()
+# ====================================
+
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
@@ -116,109 +161,50 @@ async def login_page(request: Request):
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request):
-    try:
-        # ========== ИСПРАВЛЕНИЕ: Проверяем cookie ==========
-        token = request.cookies.get("access_token")
-        if not token:
-            # Если нет cookie, пробуем заголовок Authorization
-            auth_header = request.headers.get("Authorization")
-            if auth_header and auth_header.startswith("Bearer "):
-                token = auth_header.replace("Bearer ", "")
-        
-        if not token:
-            # Нет токена - редирект на логин
-            return RedirectResponse(url="/login")
-        
-        # Декодируем токен вручную
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id = payload.get("sub")
-            
-            if not user_id:
-                return RedirectResponse(url="/login")
-            
-            # Получаем пользователя из БД
-            db = next(get_db())
-            user = db.query(User).filter(User.id == int(user_id)).first()
-            db.close()
-            
-            if not user:
-                return RedirectResponse(url="/login")
-            
-            # Всё хорошо - показываем личный кабинет
-            return templates.TemplateResponse("dashboard.html", {
-                "request": request,
-                "user": {
-                    "id": user.id,
-                    "email": user.email,
-                    "name": user.name,
-                    "is_admin": user.is_admin
-                }
-            })
-            
-        except jwt.InvalidTokenError:
-            return RedirectResponse(url="/login")
-        except Exception as e:
-            print(f"Ошибка в dashboard: {e}")
-            return RedirectResponse(url="/login")
-            
-    except Exception as e:
-        print(f"Критическая ошибка в dashboard: {e}")
-        return RedirectResponse(url="/login")
+    # Токен и пользователя уже разобрал AuthMiddleware (из claims токена, без БД)
+    user = request.state.user
+    if user is None:
+        # Access-токен истёк — пробуем продлить сессию по refresh-токену
+        return RedirectResponse(url="/api/auth/refresh?next=/dashboard")
+    
+    # Всё хорошо - показываем личный кабинет
+    return templates.TemplateResponse("dashboard.html", {
+        "request": request,
+        "user": {
+            "id": user.id,
+            "email": user.email,
+            "name": user.name,
+            "is_admin": user.is_admin
+        }
+    })
 
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_page(request: Request):
-    try:
-        # ========== ИСПРАВЛЕНИЕ: Проверяем cookie ==========
-        token = request.cookies.get("access_token")
-        if not token:
-            # Если нет cookie, пробуем получить из заголовка Authorization
-            auth_header = request.headers.get("Authorization")
-            if auth_header and auth_header.startswith("Bearer "):
-                token = auth_header.replace("Bearer ", "")
-        
-        if not token:
-            # Нет токена - редирект на логин
-            return RedirectResponse(url="/login")
-        
-        # Декодируем токен вручную
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id = payload.get("sub")
-            
-            if not user_id:
-                return RedirectResponse(url="/login")
-            
-            # Получаем пользователя из БД
-            db = next(get_db())
-            user = db.query(User).filter(User.id == int(user_id)).first()
-            db.close()
-            
-            if not user:
-                return RedirectResponse(url="/login")
-            
-            if not user.is_admin:
-                return RedirectResponse(url="/dashboard")
-            
-            # Всё хорошо - показываем админку
-            return templates.TemplateResponse("admin.html", {
-                "request": request,
-                "user": {
-                    "id": user.id,
-                    "email": user.email,
-                    "name": user.name,
-                    "is_admin": user.is_admin
-                }
-            })
-        except jwt.InvalidTokenError:
-            return RedirectResponse(url="/login")
-        except Exception as e:
-            print(f"Ошибка в admin_page: {e}")
-            return RedirectResponse(url="/login")
-            
-    except Exception as e:
-        print(f"Критическая ошибка в admin_page: {e}")
-        return RedirectResponse(url="/login")
+    # Токен и пользователя уже разобрал AuthMiddleware (из claims токена, без БД)
+    user = request.state.user
+    if user is None:
+        # Access-токен истёк — пробуем продлить сессию по refresh-токену
+        return RedirectResponse(url="/api/auth/refresh?next=/admin")
+    
+    if not user.is_admin:
+        return RedirectResponse(url="/dashboard")
+    
+    # Всё хорошо - показываем админку
+    return templates.TemplateResponse("admin.html", {
+        "request": request,
+        "user": {
+            "id": user.id,
+            "email": user.email,
+            "name": user.name,
+            "is_admin": user.is_admin
+        }
+    })
+
+@app.get("/readyz")
+async def readyz():
+    """Готовность воркера: БД доступна, в ответе — время запроса к ней"""
+    status = await check_database()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 @app.get("/test-api")
 async def test_api():
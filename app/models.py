@@ -1,8 +1,9 @@
-﻿from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON
+﻿from sqlalchemy import BigInteger, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON, Index, event, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
+from .chat_search import install_search_index
 
 class User(Base):
     __tablename__ = "users"
@@ -12,7 +13,17 @@ class User(Base):
     hashed_password = Column(String)
     salt = Column(String, nullable=True)
     is_admin = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Время ставит приложение: CURRENT_TIMESTAMP в SQLite пишет его без долей
+    # секунды, и такие строки не совпадают с курсором пагинации (см. f2a7c4e91b36)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    # Версия токенов: увеличение отзывает все выданные токены пользователя
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
+
+    # Новые пользователи за период (статистика админки); список админки с фильтром is_admin
+    __table_args__ = (
+        Index("ix_users_created_at", "created_at"),
+        Index("ix_users_is_admin_created_at", "is_admin", "created_at"),
+    )
 
 class Service(Base):
     __tablename__ = "services"
@@ -32,6 +43,11 @@ class Service(Base):
     
     projects = relationship("Project", back_populates="service")
 
+    # Список услуг в админке (ORDER BY order_index, id)
+    __table_args__ = (
+        Index("ix_services_order_index", "order_index", "id"),
+    )
+
 class Project(Base):
     __tablename__ = "projects"
     id = Column(Integer, primary_key=True, index=True)
@@ -40,11 +56,20 @@ class Project(Base):
     status = Column(String, default="pending")
     user_id = Column(Integer, ForeignKey("users.id"))
     service_id = Column(Integer, ForeignKey("services.id"), nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     
     user = relationship("User")
     service = relationship("Service", back_populates="projects")
 
+    # Проекты пользователя; новые проекты за период; сверка счётчиков по статусам;
+    # список админки с фильтром по статусу или услуге (ORDER BY created_at)
+    __table_args__ = (
+        Index("ix_projects_user_id", "user_id"),
+        Index("ix_projects_created_at", "created_at"),
+        Index("ix_projects_status_created_at", "status", "created_at"),
+        Index("ix_projects_service_id_created_at", "service_id", "created_at"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True, index=True)
@@ -52,12 +77,52 @@ class Message(Base):
     sender_id = Column(Integer, ForeignKey("users.id"))
     receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # <--- ДОБАВЛЕНО
     is_owner = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    # Диалог = id пользователя (не админа); seq растёт монотонно внутри диалога
+    conversation_id = Column(Integer, nullable=True)
+    seq = Column(Integer, nullable=True)
     
     # Связи
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
 
+    # Индексы под постраничную историю диалога (keyset по created_at, id)
+    __table_args__ = (
+        Index("ix_messages_sender_id_created_at", "sender_id", "created_at"),
+        Index("ix_messages_receiver_id_created_at", "receiver_id", "created_at"),
+        # Догрузка пропущенного при переподключении: WHERE conversation_id = ? AND seq > ?
+        Index("ux_messages_conversation_id_seq", "conversation_id", "seq", unique=True),
+        # Сообщения за период (статистика чата по дням, активные пользователи)
+        Index("ix_messages_created_at", "created_at"),
+    )
+
+# Полнотекстовый индекс (FTS5 / tsvector) создаётся сразу вместе с таблицей
+event.listen(Message.__table__, "after_create", install_search_index)
+
+class Conversation(Base):
+    """Сводка диалога пользователя с поддержкой; обновляется в той же транзакции, что и запись сообщений"""
+    __tablename__ = "conversations"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_message_id = Column(Integer, nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    unread_for_admin = Column(Integer, default=0, nullable=False)
+    unread_for_user = Column(Integer, default=0, nullable=False)
+    message_count = Column(Integer, default=0, nullable=False)
+    
+    user = relationship("User")
+
+    # Входящие админа: ORDER BY last_message_at DESC, user_id DESC (keyset)
+    __table_args__ = (
+        Index("ix_conversations_last_message_at_user_id", "last_message_at", "user_id"),
+        # Только непрочитанные (unread_only=true): частичный индекс, в нём лишь ждущие ответа диалоги
+        Index(
+            "ix_conversations_unread_last_message_at",
+            "last_message_at", "user_id",
+            sqlite_where=text("unread_for_admin > 0"),
+            postgresql_where=text("unread_for_admin > 0"),
+        ),
+    )
+
 class Transaction(Base):
     __tablename__ = "transactions"
     id = Column(Integer, primary_key=True, index=True)
@@ -65,5 +130,48 @@ class Transaction(Base):
     amount = Column(Integer)
     currency = Column(String, default="RUB")
     status = Column(String, default="pending")
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    project = relationship("Project")
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    project = relationship("Project")
+
+    # Список транзакций (ORDER BY created_at DESC, в том числе с фильтром по статусу)
+    # и выручка за период; сверка счётчиков по статусам
+    __table_args__ = (
+        Index("ix_transactions_created_at", "created_at"),
+        Index("ix_transactions_status_created_at", "status", "created_at"),
+    )
+
+class Setting(Base):
+    """Настройки сайта из админки: ключ — значение (строкой)"""
+    __tablename__ = "settings"
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(100), unique=True, nullable=False)
+    value = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class StatCounter(Base):
+    """Счётчик статистики: итог (bucket="") или значение за день (bucket="YYYY-MM-DD"), см. app.stats_counters"""
+    __tablename__ = "stats_counters"
+    # bucket первым: статистика читает итоги и сегодняшний день одним WHERE bucket IN (...)
+    bucket = Column(String(10), primary_key=True, default="")
+    name = Column(String(64), primary_key=True)
+    value = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MessageRollup(Base):
+    """Число сообщений за час или день по направлению (см. app.timeseries)"""
+    __tablename__ = "message_rollups"
+    granularity = Column(String(5), primary_key=True)  # hour | day
+    bucket_start = Column(DateTime, primary_key=True)
+    direction = Column(String(10), primary_key=True)  # from_users | from_admin
+    count = Column(BigInteger, default=0, nullable=False)
+
+class TransactionRollup(Base):
+    """Число и сумма транзакций за час или день по статусу и валюте (см. app.timeseries)"""
+    __tablename__ = "transaction_rollups"
+    granularity = Column(String(5), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    status = Column(String(32), primary_key=True)
+    currency = Column(String(8), primary_key=True)
+    count = Column(BigInteger, default=0, nullable=False)
+    amount = Column(BigInteger, default=0, nullable=False)
@@ -0,0 +1,216 @@
+"""
+Keyset-пагинация (по курсору) вместо OFFSET.
+
+Курсор — это значения колонок сортировки последней отданной строки,
+упакованные в base64url. Следующая страница начинается строго после них,
+поэтому стоимость запроса не зависит от того, насколько далеко листают.
+Сортируйте через keyset_order(): NULL в колонках, где он возможен, идёт после
+всех значений (по убыванию — перед ними), и keyset_condition() это учитывает.
+
+Listing — готовый список для админки поверх этого: сортировки и фильтры
+только из белого списка (под каждую есть индекс), курсор помнит сортировку,
+общее число строк — по запросу и приблизительное (счётчик или кэшированный count).
+"""
+import base64
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import String, and_, column, false, func, or_, select
+
+from app.auth_cache import TTLCache
+
+LISTING_DEFAULT_LIMIT = 50
+LISTING_MAX_LIMIT = 200
+# Сколько секунд помнить посчитанное count() для фильтров без счётчика
+LISTING_TOTAL_TTL = float(os.getenv("LISTING_TOTAL_TTL", "60"))
+
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Нельзя упаковать в курсор: {type(value).__name__}")
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), default=_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> List[Any]:
+    """Распаковать курсор и привести значения к типам колонок"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("длина курсора не совпадает с сортировкой")
+        result = []
+        for value, column in zip(values, columns):
+            python_type = column.type.python_type
+            if value is not None and python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif value is not None and python_type is date:
+                value = date.fromisoformat(value)
+            result.append(value)
+        return result
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации")
+
+
+def is_nullable(column) -> bool:
+    return bool(getattr(column, "nullable", False)) and not getattr(column, "primary_key", False)
+
+
+def keyset_order(columns: Sequence, descending: bool) -> list:
+    """
+    ORDER BY для keyset-пагинации. NULL считается больше любого значения:
+    NULLS LAST по возрастанию, NULLS FIRST по убыванию (так же по умолчанию
+    сортирует Postgres, поэтому индекс подходит без изменений).
+    """
+    order = []
+    for column in columns:
+        if descending:
+            order.append(column.desc().nulls_first() if is_nullable(column) else column.desc())
+        else:
+            order.append(column.asc().nulls_last() if is_nullable(column) else column.asc())
+    return order
+
+
+def keyset_condition(columns: Sequence, values: Sequence[Any], descending: bool):
+    """
+    Условие "строго после курсора" для сортировки по нескольким колонкам
+    (в порядке keyset_order).
+
+    (a, b) < (x, y) раскрывается в a <= x AND (a < x OR (a = x AND b < y)):
+    первая часть даёт индексу диапазон, вторая — точную границу. NULL в
+    курсоре и в колонках сравнивается явно (IS NULL), иначе такие строки
+    выпадали бы со следующих страниц.
+    """
+    def equal(column, value):
+        return column.is_(None) if value is None else column == value
+
+    def beyond(column, value):
+        if descending:
+            if value is None:
+                return column.is_not(None)
+            return column < value
+        if value is None:
+            return false()
+        return or_(column > value, column.is_(None)) if is_nullable(column) else column > value
+
+    def index_range(column, value):
+        """Простой диапазон по первой колонке (None — без него)"""
+        if value is None:
+            return None if descending else column.is_(None)
+        if descending:
+            return column <= value
+        return None if is_nullable(column) else column >= value
+
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equal_prefix = [equal(columns[j], values[j]) for j in range(i)]
+        clauses.append(and_(*equal_prefix, beyond(column, value)))
+    condition = or_(*clauses)
+    leading = index_range(columns[0], values[0])
+    return condition if leading is None else and_(leading, condition)
+
+
+# Первое значение курсора списка — его сортировка: курсор от другой сортировки не подойдёт
+SORT_KEY = column("sort", String)
+
+
+class Listing:
+    """
+    Список модели с keyset-курсором, сортировками и фильтрами из белого списка.
+
+    sorts — {имя: колонки}; последняя колонка уникальна (обычно id). В запросе
+    сортировка — "created_at" или "-created_at" (по убыванию). filters —
+    {параметр: функция значение -> условие}. counter — функция фильтры -> имя
+    счётчика stats_counters (или None), по которому отдаётся total без count().
+    """
+
+    def __init__(
+        self,
+        model,
+        sorts: Dict[str, Sequence],
+        default_sort: str,
+        filters: Optional[Dict[str, Callable[[Any], Any]]] = None,
+        counter: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+    ):
+        self.model = model
+        self.sorts = sorts
+        self.default_sort = default_sort
+        self.filters = filters or {}
+        self.counter = counter
+        self._totals = TTLCache(maxsize=1000, ttl=LISTING_TOTAL_TTL)
+
+    def parse_sort(self, sort: Optional[str]):
+        sort = sort or self.default_sort
+        name = sort.lstrip("-")
+        if name not in self.sorts:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Сортировка {name!r} недоступна, можно: {', '.join(sorted(self.sorts))}"
+            )
+        return sort, self.sorts[name], sort.startswith("-")
+
+    def conditions(self, filters: Dict[str, Any]) -> list:
+        """Условия фильтров (None — фильтр не задан)"""
+        return [self.filters[name](value) for name, value in filters.items() if value is not None]
+
+    async def page(
+        self,
+        db,
+        cursor: Optional[str] = None,
+        limit: int = LISTING_DEFAULT_LIMIT,
+        sort: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        with_total: bool = False,
+    ) -> dict:
+        """{"items", "has_more", "cursor"[, "total"]} — items ещё нужно превратить в JSON"""
+        sort, columns, descending = self.parse_sort(sort)
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        conditions = self.conditions(filters)
+        query = select(self.model).where(*conditions)
+        if cursor:
+            cursor_sort, *values = decode_cursor(cursor, (SORT_KEY, *columns))
+            if cursor_sort != sort:
+                raise HTTPException(status_code=400, detail="Курсор от другой сортировки")
+            query = query.where(keyset_condition(columns, values, descending))
+        rows = (await db.scalars(query.order_by(*keyset_order(columns, descending)).limit(limit + 1))).all()
+
+        items = rows[:limit]
+        has_more = len(rows) > limit
+        last = items[-1] if items else None
+        page = {
+            "items": items,
+            "has_more": has_more,
+            "cursor": encode_cursor([sort, *[getattr(last, c.key) for c in columns]]) if has_more else None,
+        }
+        if with_total:
+            page["total"] = await self.total(db, filters, conditions)
+        return page
+
+    async def total(self, db, filters: Dict[str, Any], conditions: list) -> int:
+        """Счётчик stats_counters, если он есть для этих фильтров, иначе count() из кэша"""
+        name = self.counter(filters) if self.counter is not None else None
+        if name is not None:
+            # Импорт здесь: stats_counters тянет модели, а пагинация от них не зависит
+            from app.stats_counters import read_counter
+            return await read_counter(db, name)
+        key = tuple(sorted((name, str(value)) for name, value in filters.items()))
+        total = self._totals.get(key)
+        if total is None:
+            total = await db.scalar(select(func.count()).select_from(self.model).where(*conditions))
+            self._totals.set(key, total)
+        return total
+
+
+def date_range_filters(created_at) -> Dict[str, Callable[[Any], Any]]:
+    """Фильтры created_from / created_to (включительно / не включительно) по колонке даты"""
+    return {
+        "created_from": lambda value: created_at >= value,
+        "created_to": lambda value: created_at < value,
+    }
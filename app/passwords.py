@@ -0,0 +1,122 @@
+"""
+Хэширование паролей: стойкий KDF в отдельном пуле потоков.
+
+bcrypt/argon2 специально медленные (десятки миллисекунд CPU на пароль), поэтому
+считаются не в цикле событий, а в пуле потоков: реализации passlib для bcrypt,
+argon2 и pbkdf2 отпускают GIL, так что вход масштабируется по ядрам, а чат
+в это время не тормозит. Семафор ограничивает число одновременных вычислений:
+всплеск входов ждёт своей очереди, а не забивает пул.
+
+Старые хэши (один раунд SHA-256 с солью в users.salt) при успешном входе
+прозрачно заменяются на хэш текущей схемы — как и хэши с устаревшей стоимостью.
+"""
+import asyncio
+import hashlib
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+# Схема passlib: bcrypt (по умолчанию), argon2 (нужен пакет argon2-cffi) или pbkdf2_sha256
+PASSWORD_HASH_SCHEME = os.getenv("PASSWORD_HASH_SCHEME", "bcrypt")
+# Стоимость: для bcrypt — log2 числа раундов, для argon2 — time_cost; пусто — по умолчанию passlib
+PASSWORD_HASH_ROUNDS = os.getenv("PASSWORD_HASH_ROUNDS")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Сколько хэшей считается одновременно; остальные ждут, не занимая потоки
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+
+
+def build_context(scheme: str = PASSWORD_HASH_SCHEME, rounds: Optional[str] = PASSWORD_HASH_ROUNDS) -> CryptContext:
+    settings = {}
+    if rounds:
+        settings[f"{scheme}__rounds"] = int(rounds)
+    # deprecated="auto": хэши с другой стоимостью needs_update() считает устаревшими
+    return CryptContext(schemes=[scheme], deprecated="auto", **settings)
+
+
+def legacy_sha256(password: str, salt: str) -> str:
+    """Старая схема: один раунд SHA-256 от пароля с солью"""
+    return hashlib.sha256(f"{password}{salt}".encode("utf-8")).hexdigest()
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        context: Optional[CryptContext] = None,
+        workers: int = PASSWORD_HASH_WORKERS,
+        concurrency: int = PASSWORD_HASH_CONCURRENCY,
+    ):
+        self.context = context or build_context()
+        self.workers = max(workers, 1)
+        self.concurrency = max(concurrency, 1)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.hashed = 0
+        self.verified = 0
+        self.upgraded = 0
+
+    def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _call(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await self._run(func, *args)
+
+    async def hash(self, password: str) -> str:
+        """Хэш пароля по текущей схеме (соль внутри хэша)"""
+        self.hashed += 1
+        return await self._call(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: Optional[str], salt: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+        """
+        Проверить пароль. Возвращает (верен ли, новый хэш или None).
+
+        Новый хэш появляется, если пароль верен, а сохранённый хэш старой схемы
+        или стоимости — его нужно записать вместо прежнего (и очистить salt).
+        """
+        if not hashed_password:
+            return False, None
+        self.verified += 1
+        if self.context.identify(hashed_password) is None:
+            # Не хэш passlib — значит, старый SHA-256 (он дешёвый, пул не нужен)
+            if not salt or not secrets.compare_digest(legacy_sha256(password, salt), hashed_password):
+                return False, None
+            self.upgraded += 1
+            return True, await self.hash(password)
+        valid, new_hash = await self._call(self.context.verify_and_update, password, hashed_password)
+        if valid and new_hash:
+            self.upgraded += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._semaphore = None
+
+    def stats(self) -> dict:
+        return {
+            "scheme": self.context.default_scheme(),
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "hashed": self.hashed,
+            "verified": self.verified,
+            "upgraded": self.upgraded,
+        }
+
+
+password_hasher = PasswordHasher()
+
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
+
+
+async def verify_password(password: str, hashed_password: Optional[str], salt: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+    return await password_hasher.verify(password, hashed_password, salt)
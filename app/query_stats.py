@@ -0,0 +1,187 @@
+"""
+Учёт SQL-запросов по HTTP-запросам.
+
+Слушатели before/after_cursor_execute на движках считают запросы и их время
+и приписывают их текущему HTTP-запросу (contextvar, его выставляет
+QueryStatsMiddleware). Запросы дольше SQL_SLOW_QUERY_MS пишутся в лог вместе
+с параметрами; одинаковый текст запроса, повторённый за один HTTP-запрос
+SQL_N_PLUS_ONE_THRESHOLD раз и больше, помечается как вероятный N+1.
+
+Последние запросы, медленные запросы и подозрения на N+1 отдаёт
+/api/admin/debug/queries; с SQL_DEBUG_HEADERS=1 число запросов и их время
+добавляются в заголовки ответа (X-DB-Queries, X-DB-Time-Ms).
+"""
+import os
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "1") not in ("0", "false", "no")
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+SQL_DEBUG_HEADERS = os.getenv("SQL_DEBUG_HEADERS", "0") in ("1", "true", "yes")
+# Сколько последних HTTP-запросов и медленных SQL держать для эндпоинта отладки
+SQL_STATS_HISTORY = int(os.getenv("SQL_STATS_HISTORY", "200"))
+
+# Длина текста запроса и параметров в логе и в ответе отладки
+STATEMENT_PREVIEW = 500
+PARAMS_PREVIEW = 300
+
+SKIP_PREFIXES = ("/static", "/readyz", "/api/admin/debug/queries")
+
+
+class RequestQueries:
+    """SQL-запросы одного HTTP-запроса"""
+
+    __slots__ = ("method", "path", "started", "count", "time_ms", "statements", "duration_ms")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.count = 0
+        self.time_ms = 0.0
+        self.statements: Counter = Counter()
+        self.duration_ms = 0.0
+
+    def repeated(self, threshold: int = SQL_N_PLUS_ONE_THRESHOLD):
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "started": self.started,
+            "queries": self.count,
+            "db_time_ms": round(self.time_ms, 2),
+            "duration_ms": round(self.duration_ms, 2),
+            "n_plus_one": [
+                {"statement": statement[:STATEMENT_PREVIEW], "count": count}
+                for statement, count in self.repeated()
+            ],
+        }
+
+
+current_request: ContextVar[Optional[RequestQueries]] = ContextVar("current_request_queries", default=None)
+
+
+class QueryStats:
+    def __init__(self, history: int = SQL_STATS_HISTORY):
+        self.requests = deque(maxlen=history)
+        self.slow = deque(maxlen=history)
+        self.n_plus_one = deque(maxlen=history)
+        self.queries = 0
+        self.time_ms = 0.0
+        # Запросы вне HTTP (WebSocket, писатель чата, фоновые задачи)
+        self.background_queries = 0
+
+    def record_query(self, statement: str, parameters, elapsed_ms: float, executemany: bool):
+        self.queries += 1
+        self.time_ms += elapsed_ms
+        request = current_request.get()
+        if request is not None:
+            request.count += 1
+            request.time_ms += elapsed_ms
+            request.statements[statement] += 1
+        else:
+            self.background_queries += 1
+        if elapsed_ms >= SQL_SLOW_QUERY_MS:
+            params = repr(parameters)[:PARAMS_PREVIEW]
+            where = f"{request.method} {request.path}" if request is not None else "вне HTTP-запроса"
+            print(f"🐢 Медленный SQL ({elapsed_ms:.1f} мс, {where}): {statement[:STATEMENT_PREVIEW]} | {params}")
+            self.slow.append({
+                "statement": statement[:STATEMENT_PREVIEW],
+                "parameters": params,
+                "executemany": executemany,
+                "time_ms": round(elapsed_ms, 2),
+                "request": where,
+                "at": time.time(),
+            })
+
+    def finish_request(self, request: RequestQueries):
+        request.duration_ms = (time.time() - request.started) * 1000
+        self.requests.append(request)
+        repeated = request.repeated()
+        if repeated:
+            statement, count = repeated[0]
+            print(f"⚠️ Возможный N+1 в {request.method} {request.path}: {count} одинаковых запросов: {statement[:200]}")
+            self.n_plus_one.append(request)
+
+    def snapshot(self, limit: int = 50) -> dict:
+        recent = list(self.requests)[-limit:]
+        return {
+            "enabled": SQL_INSTRUMENTATION,
+            "slow_query_ms": SQL_SLOW_QUERY_MS,
+            "n_plus_one_threshold": SQL_N_PLUS_ONE_THRESHOLD,
+            "totals": {
+                "queries": self.queries,
+                "db_time_ms": round(self.time_ms, 2),
+                "background_queries": self.background_queries,
+            },
+            "recent": [request.to_dict() for request in reversed(recent)],
+            "heaviest": [request.to_dict() for request in sorted(recent, key=lambda r: r.count, reverse=True)[:10]],
+            "slow": list(self.slow)[-limit:][::-1],
+            "n_plus_one": [request.to_dict() for request in list(self.n_plus_one)[-limit:][::-1]],
+        }
+
+
+query_stats = QueryStats()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    query_stats.record_query(statement, parameters, (time.perf_counter() - started) * 1000, executemany)
+
+
+def _handle_error(exception_context):
+    # Запрос упал: снять отметку начала, иначе стек времени разъедется
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def install_query_instrumentation(sync_engine):
+    """Подключить учёт запросов к движку (для async — к engine.sync_engine)"""
+    if not SQL_INSTRUMENTATION:
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+class QueryStatsMiddleware:
+    """Открывает учёт SQL на время HTTP-запроса; в режиме отладки добавляет заголовки"""
+
+    def __init__(self, app, skip_prefixes=SKIP_PREFIXES, debug_headers: bool = SQL_DEBUG_HEADERS):
+        self.app = app
+        self.skip_prefixes = skip_prefixes
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if not SQL_INSTRUMENTATION or scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestQueries(scope["method"], scope["path"])
+        token = current_request.set(request)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and self.debug_headers:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(request.count).encode()))
+                headers.append((b"x-db-time-ms", f"{request.time_ms:.2f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_request.reset(token)
+            query_stats.finish_request(request)
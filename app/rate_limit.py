@@ -0,0 +1,275 @@
+"""
+Ограничение частоты запросов.
+
+HTTP-маршруты объявляют лимит зависимостью прямо в роутере:
+
+    @router.post("/login", dependencies=[Depends(rate_limit(RATE_LIMIT_LOGIN))])
+    router = APIRouter(..., dependencies=[Depends(rate_limit("600/minute", by="user"))])
+
+Счётчик ведётся на пару (маршрут, IP) или (маршрут, пользователь); при
+превышении — 429 с заголовком Retry-After. По умолчанию счётчики живут в
+памяти процесса (token bucket); с RATE_LIMIT_URL=redis://... они общие для всех
+воркеров (скользящее окно на INCR/PEXPIRE). Если Redis недоступен, лимит
+временно считается локально, а не отключается.
+
+Для WebSocket-чата — MessageBudget: token bucket на одно подключение, без
+обращения к общему хранилищу (подключение и так живёт в одном воркере).
+"""
+import asyncio
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from app.redis_protocol import RespConnection
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") not in ("0", "false", "no")
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "")
+RATE_LIMIT_PREFIX = os.getenv("RATE_LIMIT_PREFIX", "ratelimit")
+# Сколько ждать Redis на один запрос; дольше — лимит считается локально
+RATE_LIMIT_TIMEOUT = float(os.getenv("RATE_LIMIT_TIMEOUT", "0.5"))
+# Сколько ключей держать в памяти; вытесняется давно не использованный (он же почти полный)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Брать IP клиента из X-Forwarded-For (только за доверенным прокси)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0") in ("1", "true", "yes")
+
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/minute")
+RATE_LIMIT_REGISTER = os.getenv("RATE_LIMIT_REGISTER", "5/minute")
+RATE_LIMIT_REFRESH = os.getenv("RATE_LIMIT_REFRESH", "30/minute")
+RATE_LIMIT_CHAT_HISTORY = os.getenv("RATE_LIMIT_CHAT_HISTORY", "120/minute")
+# Бюджет сообщений одного WebSocket-подключения
+RATE_LIMIT_WS_MESSAGES = os.getenv("RATE_LIMIT_WS_MESSAGES", "20/10second")
+RATE_LIMIT_WS_ADMIN_MESSAGES = os.getenv("RATE_LIMIT_WS_ADMIN_MESSAGES", "60/10second")
+# Столько отклонённых сообщений подряд — и подключение закрывается
+RATE_LIMIT_WS_MAX_VIOLATIONS = int(os.getenv("RATE_LIMIT_WS_MAX_VIOLATIONS", "20"))
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+RATE_RE = re.compile(r"^\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*$")
+
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """"10/minute" или "20/10second" -> (число запросов, период в секундах)"""
+    match = RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f"Неверный формат лимита: {rate!r} (ожидается, например, 10/minute)")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+class TokenBucket:
+    """Ведро на limit токенов, пополняется равномерно за period секунд"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, capacity: int, period: float, now: float) -> float:
+        """Взять токен. Возвращает 0, если можно, иначе — сколько секунд ждать"""
+        rate = capacity / period
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class MemoryRateLimitBackend:
+    name = "memory"
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    async def hit(self, key: str, limit: int, period: float) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(limit, period, now)
+
+    async def close(self):
+        self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "max_keys": self.max_keys}
+
+
+class RedisRateLimitBackend:
+    """
+    Скользящее окно в Redis: счётчики текущего и прошлого окна, вклад прошлого
+    окна убывает пропорционально прошедшему времени. Одна пачка команд на запрос.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        url: str,
+        prefix: str = RATE_LIMIT_PREFIX,
+        fallback_for: float = 5.0,
+        timeout: float = RATE_LIMIT_TIMEOUT,
+    ):
+        self.url = url
+        self.prefix = prefix
+        self.fallback_for = fallback_for
+        self.timeout = timeout
+        self._connection = RespConnection(url)
+        self._fallback = MemoryRateLimitBackend()
+        self._down_until = 0.0
+        self.errors = 0
+
+    async def hit(self, key: str, limit: int, period: float) -> float:
+        now = time.time()
+        if now < self._down_until:
+            return await self._fallback.hit(key, limit, period)
+        window = int(now // period)
+        current_key = f"{self.prefix}:{key}:{window}"
+        previous_key = f"{self.prefix}:{key}:{window - 1}"
+        try:
+            current, _, previous = await asyncio.wait_for(
+                self._connection.pipeline(
+                    ("INCR", current_key),
+                    ("PEXPIRE", current_key, int(period * 2000)),
+                    ("GET", previous_key),
+                ),
+                timeout=self.timeout,
+            )
+        except Exception as e:
+            self.errors += 1
+            self._down_until = now + self.fallback_for
+            print(f"❌ Лимиты: Redis недоступен ({e}), {self.fallback_for:.0f}с считаем локально")
+            await self._connection.close()
+            return await self._fallback.hit(key, limit, period)
+        previous = int(previous or 0)
+        elapsed = now / period - window
+        if previous * (1 - elapsed) + current <= limit:
+            return 0.0
+        if current > limit:
+            # Текущее окно уже переполнено — ждать его конца
+            return (1 - elapsed) * period
+        # Ждать, пока вклад прошлого окна не опустится до лимита
+        return max(1 - (limit - current) / previous - elapsed, 0.001) * period
+
+    async def close(self):
+        await self._connection.close()
+
+    def stats(self) -> dict:
+        return {"url": self.url, "errors": self.errors, "fallback": self._fallback.stats()}
+
+
+def create_backend(url: str = RATE_LIMIT_URL):
+    if not url or url == "memory://":
+        return MemoryRateLimitBackend()
+    return RedisRateLimitBackend(url)
+
+
+class RateLimiter:
+    def __init__(self, backend=None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend or MemoryRateLimitBackend()
+        self.enabled = enabled
+        self.allowed = 0
+        self.blocked = 0
+
+    async def set_backend(self, backend):
+        await self.backend.close()
+        self.backend = backend
+
+    async def hit(self, key: str, limit: int, period: float) -> float:
+        """0 — запрос разрешён, иначе — через сколько секунд повторить"""
+        if not self.enabled:
+            return 0.0
+        retry_after = await self.backend.hit(key, limit, period)
+        if retry_after:
+            self.blocked += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "allowed": self.allowed,
+            "blocked": self.blocked,
+            **self.backend.stats(),
+        }
+
+
+limiter = RateLimiter()
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class rate_limit:
+    """
+    Зависимость FastAPI с лимитом на маршрут.
+
+    by="ip" — счётчик на IP; by="user" — на пользователя из request.state.user
+    (для анонимных — на IP). name — общий счётчик для нескольких маршрутов,
+    по умолчанию у каждого маршрута свой.
+    """
+
+    def __init__(self, rate: str, by: str = "ip", name: Optional[str] = None):
+        if by not in ("ip", "user"):
+            raise ValueError(f"Неизвестный ключ лимита: {by}")
+        self.rate = rate
+        self.limit, self.period = parse_rate(rate)
+        self.by = by
+        self.name = name
+
+    async def __call__(self, request: Request):
+        route = request.scope.get("route")
+        name = self.name or (route.path if route is not None else request.url.path)
+        user = getattr(request.state, "user", None)
+        subject = f"user:{user.id}" if self.by == "user" and user is not None else f"ip:{client_ip(request)}"
+        retry_after = await limiter.hit(f"{name}:{subject}", self.limit, self.period)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много запросов, попробуйте позже",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+class MessageBudget:
+    """Бюджет сообщений одного WebSocket-подключения (token bucket в памяти)"""
+
+    def __init__(self, rate: str = RATE_LIMIT_WS_MESSAGES, max_violations: int = RATE_LIMIT_WS_MAX_VIOLATIONS):
+        self.limit, self.period = parse_rate(rate)
+        self.max_violations = max_violations
+        self.violations = 0
+        self._bucket = TokenBucket(self.limit, time.monotonic())
+
+    def take(self) -> float:
+        """0 — сообщение можно обработать, иначе — через сколько секунд будет можно"""
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        retry_after = self._bucket.take(self.limit, self.period, time.monotonic())
+        if retry_after:
+            self.violations += 1
+            limiter.blocked += 1
+        else:
+            self.violations = 0
+        return retry_after
+
+    @property
+    def exhausted(self) -> bool:
+        """Клиент игнорирует отказы — подключение пора закрыть"""
+        return self.violations >= self.max_violations
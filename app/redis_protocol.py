@@ -0,0 +1,143 @@
+"""
+Минимальный асинхронный клиент протокола Redis (RESP2) без внешних зависимостей.
+
+Нужен только для шины чата и общих счётчиков: команды вида PUBLISH/SUBSCRIBE/INCR.
+Поддерживаются адреса redis://[:password@]host[:port][/db], rediss://... (TLS) и
+unix:///path/to/redis.sock. Для rediss сертификат сервера проверяется по
+системным корневым сертификатам; ?ssl_ca_certs=/path/ca.pem задаёт свои,
+?ssl_cert_reqs=none отключает проверку (только для отладки).
+"""
+import asyncio
+import ssl
+from typing import Any, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class RedisProtocolError(Exception):
+    pass
+
+
+def parse_redis_url(url: str) -> Tuple[Optional[str], Optional[int], Optional[str], Optional[str], int]:
+    """Разобрать адрес брокера: (host, port, unix_path, password, db)"""
+    parsed = urlparse(url)
+    password = unquote(parsed.password) if parsed.password else None
+    if parsed.scheme in ("unix", "redis+unix"):
+        return None, None, parsed.path, password, 0
+    if parsed.scheme not in ("redis", "rediss"):
+        raise ValueError(f"Неподдерживаемая схема адреса Redis: {parsed.scheme}")
+    db = int(parsed.path.lstrip("/") or 0)
+    return parsed.hostname or "localhost", parsed.port or 6379, None, password, db
+
+
+def ssl_context_for(url: str) -> Optional[ssl.SSLContext]:
+    """TLS-контекст для rediss://, None — соединение без TLS"""
+    parsed = urlparse(url)
+    if parsed.scheme != "rediss":
+        return None
+    params = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+    context = ssl.create_default_context(cafile=params.get("ssl_ca_certs"))
+    cert_reqs = params.get("ssl_cert_reqs", "required").lower()
+    if cert_reqs not in ("required", "none"):
+        raise ValueError(f"Неподдерживаемое значение ssl_cert_reqs: {cert_reqs}")
+    if cert_reqs == "none":
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def encode_command(*args: Any) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        else:
+            data = str(arg).encode("utf-8")
+        parts.append(f"${len(data)}\r\n".encode())
+        parts.append(data)
+        parts.append(b"\r\n")
+    return b"".join(parts)
+
+
+class RespConnection:
+    """Одно соединение с брокером. Не потокобезопасно: команды сериализуются через lock"""
+
+    def __init__(self, url: str, connect_timeout: float = 5.0):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        host, port, unix_path, password, db = parse_redis_url(self.url)
+        if unix_path:
+            opener = asyncio.open_unix_connection(unix_path)
+        else:
+            context = ssl_context_for(self.url)
+            opener = asyncio.open_connection(host, port, ssl=context, server_hostname=host if context else None)
+        self.reader, self.writer = await asyncio.wait_for(opener, timeout=self.connect_timeout)
+        # connect() вызывается из execute()/pipeline() под self._lock — поэтому
+        # AUTH/SELECT идут напрямую, а не через execute()
+        if password:
+            await self.send("AUTH", password)
+            await self.read_reply()
+        if db:
+            await self.send("SELECT", db)
+            await self.read_reply()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.reader = self.writer = None
+
+    async def send(self, *args: Any):
+        self.writer.write(encode_command(*args))
+        await self.writer.drain()
+
+    async def execute(self, *args: Any) -> Any:
+        async with self._lock:
+            if not self.connected:
+                await self.connect()
+            await self.send(*args)
+            return await self.read_reply()
+
+    async def pipeline(self, *commands: Tuple[Any, ...]) -> List[Any]:
+        """Отправить несколько команд одним пакетом и прочитать все ответы"""
+        async with self._lock:
+            if not self.connected:
+                await self.connect()
+            self.writer.write(b"".join(encode_command(*cmd) for cmd in commands))
+            await self.writer.drain()
+            return [await self.read_reply() for _ in commands]
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Соединение с Redis закрыто")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RedisProtocolError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+        raise RedisProtocolError(f"Неизвестный ответ Redis: {line!r}")
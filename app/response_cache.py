@@ -0,0 +1,237 @@
+"""
+Кэш ответов JSON-эндпоинтов, которым не страшна устарелость в несколько секунд.
+
+    @router.get("/")
+    @cached_response(ttl=5, stale=60, tags=("stats",))
+    async def get_statistics(db: AsyncSession = Depends(get_read_db)): ...
+
+Ответ кодируется в JSON один раз и дальше отдаётся готовыми байтами. Первые
+ttl секунд он свежий; ещё stale секунд он отдаётся как есть, а пересчёт идёт в
+фоне со своей сессией БД (stale-while-revalidate). Одновременные промахи по
+одному ключу ждут одного пересчёта (single-flight): всплеск обновлений
+дашборда — один запрос к БД.
+
+Ключ — эндпоинт и его простые параметры (строки, числа, даты из пути и query).
+Сессии БД и пользователи в ключ не входят, поэтому права проверяйте
+зависимостью: тело обработчика при попадании в кэш не выполняется.
+
+Write-эндпоинты сбрасывают связанные ответы через invalidate("тег"): в этом
+процессе сразу, в остальных воркерах — не позже чем через ttl секунд.
+В ответе заголовок X-Cache: hit, stale или miss.
+"""
+import asyncio
+import functools
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") not in ("0", "false", "no")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+
+# Параметры этих типов входят в ключ кэша (date покрывает и datetime)
+KEY_TYPES = (str, int, float, bool, date, type(None))
+
+
+class CachedBody:
+    __slots__ = ("body", "fresh_until", "stale_until", "tags")
+
+    def __init__(self, body: bytes, ttl: float, stale: float, tags: Tuple[str, ...]):
+        now = time.monotonic()
+        self.body = body
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale
+        self.tags = tags
+
+
+def encode(result) -> bytes:
+    """Тело ответа так же, как его отдал бы JSONResponse"""
+    return json.dumps(
+        jsonable_encoder(result),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[tuple, CachedBody]" = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._refreshing: Dict[tuple, asyncio.Task] = {}
+        # Растёт при каждом сбросе: пересчёт, начатый до него, не попадёт в кэш
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    async def fetch(
+        self,
+        key: tuple,
+        ttl: float,
+        stale: float,
+        tags: Tuple[str, ...],
+        compute: Callable[[], Awaitable[bytes]],
+        refresh: Callable[[], Awaitable[bytes]],
+    ) -> Tuple[bytes, str]:
+        """Тело ответа и откуда оно: hit, stale или miss"""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry.fresh_until:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.body, "hit"
+        if entry is not None and now < entry.stale_until:
+            self._entries.move_to_end(key)
+            self.stale_hits += 1
+            if key not in self._inflight and key not in self._refreshing:
+                self._refreshing[key] = asyncio.create_task(self._refresh(key, ttl, stale, tags, refresh))
+            return entry.body, "stale"
+
+        self.misses += 1
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                return await self._compute(key, ttl, stale, tags, compute), "miss"
+            # Тот же ответ уже считается — ждём его, а не идём в БД второй раз
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future), "miss"
+            except asyncio.CancelledError:
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # Отменили запрос, который считал ответ (клиент отключился), —
+                # он не упал, поэтому ждущие считают заново, а не получают его отмену.
+                # Первый из них мог уже успеть положить ответ в кэш
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() < entry.fresh_until:
+                    return entry.body, "miss"
+
+    async def _compute(self, key, ttl, stale, tags, compute) -> bytes:
+        future = asyncio.get_running_loop().create_future()
+        # Исключение получат ждущие; если их нет, asyncio не должен ругаться на непрочитанное
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            body = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        if generation == self._generation:
+            self._store(key, CachedBody(body, ttl, stale, tags))
+        future.set_result(body)
+        return body
+
+    async def _refresh(self, key, ttl, stale, tags, refresh):
+        try:
+            await self._compute(key, ttl, stale, tags, refresh)
+            self.refreshes += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Кэш ответов: фоновый пересчёт {key[0]} не удался: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def _store(self, key: tuple, entry: CachedBody):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *tags: str):
+        """Сбросить ответы с любым из тегов (без тегов — все)"""
+        self._generation += 1
+        if not tags:
+            self._entries.clear()
+            return
+        for key in [key for key, entry in self._entries.items() if set(entry.tags) & set(tags)]:
+            del self._entries[key]
+
+    async def close(self):
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.stale_hits + self.misses
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.stale_hits) / requests, 4) if requests else 0,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def invalidate(*tags: str):
+    response_cache.invalidate(*tags)
+
+
+def cached_response(ttl: float, stale: float = 0, tags: Iterable[str] = (), cache: Optional[ResponseCache] = None):
+    """
+    Кэшировать ответ эндпоинта (декоратор ставится под @router.get).
+
+    Обработчик должен возвращать данные уже в итоговом виде: ответ отдаётся
+    мимо response_model.
+    """
+    tags = tuple(tags)
+
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            target = cache or response_cache
+            if not RESPONSE_CACHE_ENABLED:
+                return await func(*args, **kwargs)
+            key = (name, *sorted(
+                ((param, value) for param, value in kwargs.items() if isinstance(value, KEY_TYPES)),
+                key=lambda item: item[0],
+            ))
+
+            async def compute() -> bytes:
+                return encode(await func(*args, **kwargs))
+
+            async def refresh() -> bytes:
+                # Сессия запроса к этому времени закрыта — пересчитываем со своей
+                async with AsyncSessionLocal() as db:
+                    fresh = {param: db if isinstance(value, AsyncSession) else value for param, value in kwargs.items()}
+                    return encode(await func(*args, **fresh))
+
+            body, status = await target.fetch(key, ttl, stale, tags, compute, refresh)
+            return Response(content=body, media_type="application/json", headers={"X-Cache": status})
+
+        return wrapper
+
+    return decorator
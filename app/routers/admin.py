@@ -1,72 +1,217 @@
-﻿from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+﻿from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Literal, Optional
 import app.database as database
 import app.models as models
 import app.schemas as schemas
 from app.dependencies import get_current_user
+from app.chat_search import search_messages
+from app.auth_cache import auth_cache
+from app.passwords import password_hasher
+from app.rate_limit import limiter
+from app.query_stats import query_stats
+from app.chat_persistence import mark_conversation_read
+from app.pagination import (
+    LISTING_DEFAULT_LIMIT,
+    LISTING_MAX_LIMIT,
+    Listing,
+    date_range_filters,
+    decode_cursor,
+    encode_cursor,
+    keyset_condition,
+    keyset_order,
+)
+from app.stats_counters import by_status, increment, read_counters, service_changes, stats_reconciler, status_counter
+from app import timeseries
+from app.response_cache import cached_response, invalidate, response_cache
+from app.schema import schema_registry
 
 router = APIRouter(
     prefix="/api/admin",
     tags=["admin"]
 )
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def check_admin(user: models.User):
     if not user.is_admin:
         raise HTTPException(status_code=403, detail="Требуются права администратора")
     return user
 
+async def require_admin(current_user: models.User = Depends(get_current_user)):
+    """Проверка прав зависимостью — для кэшируемых эндпоинтов, где тело может не выполниться"""
+    return check_admin(current_user)
+
+# ================ СПИСКИ ================
+# Сортировки и фильтры — только из белого списка, под каждую есть индекс
+# (python -m app.index_check). total отдаётся по запросу: счётчик или count() из кэша.
+
+def users_counter(filters: dict) -> Optional[str]:
+    if not filters:
+        return "users"
+    if filters == {"is_admin": True}:
+        return "users.admins"
+    return None
+
+def status_counter_for(prefix: str):
+    """Счётчик для списка без фильтров или только со статусом"""
+    def counter(filters: dict) -> Optional[str]:
+        if not filters:
+            return prefix
+        if set(filters) == {"status"}:
+            return status_counter(prefix, filters["status"])
+        return None
+    return counter
+
+USERS_LISTING = Listing(
+    models.User,
+    sorts={
+        "created_at": (models.User.created_at, models.User.id),
+        "id": (models.User.id,),
+        "email": (models.User.email,),
+    },
+    default_sort="-created_at",
+    filters={
+        "is_admin": lambda value: models.User.is_admin == value,
+        **date_range_filters(models.User.created_at),
+    },
+    counter=users_counter,
+)
+
+PROJECTS_LISTING = Listing(
+    models.Project,
+    sorts={
+        "created_at": (models.Project.created_at, models.Project.id),
+        "id": (models.Project.id,),
+    },
+    default_sort="-created_at",
+    filters={
+        "status": lambda value: models.Project.status == value,
+        "service_id": lambda value: models.Project.service_id == value,
+        **date_range_filters(models.Project.created_at),
+    },
+    counter=status_counter_for("projects"),
+)
+
+SERVICES_LISTING = Listing(
+    models.Service,
+    sorts={
+        "order_index": (models.Service.order_index, models.Service.id),
+        "id": (models.Service.id,),
+    },
+    default_sort="order_index",
+    filters={
+        "is_active": lambda value: models.Service.is_active == value,
+    },
+    counter=lambda filters: None if filters else "services",
+)
+
+TRANSACTIONS_LISTING = Listing(
+    models.Transaction,
+    sorts={
+        "created_at": (models.Transaction.created_at, models.Transaction.id),
+        "id": (models.Transaction.id,),
+    },
+    default_sort="-created_at",
+    filters={
+        "status": lambda value: models.Transaction.status == value,
+        **date_range_filters(models.Transaction.created_at),
+    },
+    counter=status_counter_for("transactions"),
+)
+
+def listing_response(name: str, items: list, page: dict) -> dict:
+    response = {
+        "status": "success",
+        "count": len(items),
+        name: items,
+        "has_more": page["has_more"],
+        "cursor": page["cursor"]
+    }
+    if "total" in page:
+        response["total"] = page["total"]
+    return response
+
 # ================ ПОЛЬЗОВАТЕЛИ ================
 @router.get("/users")
 async def get_all_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(LISTING_DEFAULT_LIMIT, ge=1, le=LISTING_MAX_LIMIT),
+    sort: Optional[str] = None,
+    is_admin: Optional[bool] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    with_total: bool = False,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    """Получить всех пользователей"""
+    """
+    Пользователи постранично (keyset). Сортировки: created_at (по умолчанию
+    -created_at), id, email; фильтры: is_admin, created_from, created_to.
+    """
     check_admin(current_user)
-    users = db.query(models.User).all()
-    return {
-        "status": "success",
-        "count": len(users),
-        "users": users
-    }
+    page = await USERS_LISTING.page(
+        db, cursor, limit, sort,
+        {"is_admin": is_admin, "created_from": created_from, "created_to": created_to},
+        with_total
+    )
+    users = [
+        {
+            "id": user.id,
+            "email": user.email,
+            "name": user.name,
+            "is_admin": user.is_admin,
+            "created_at": user.created_at
+        }
+        for user in page["items"]
+    ]
+    return listing_response("users", users, page)
 
 # ================ ПРОЕКТЫ ================
 @router.get("/projects")
 async def get_all_projects(
+    cursor: Optional[str] = None,
+    limit: int = Query(LISTING_DEFAULT_LIMIT, ge=1, le=LISTING_MAX_LIMIT),
+    sort: Optional[str] = None,
+    status: Optional[str] = None,
+    service_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    with_total: bool = False,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    """Получить все проекты"""
+    """
+    Проекты постранично (keyset). Сортировки: created_at (по умолчанию
+    -created_at), id; фильтры: status, service_id, created_from, created_to.
+    """
     check_admin(current_user)
-    projects = db.query(models.Project).all()
-    return {
-        "status": "success",
-        "count": len(projects),
-        "projects": projects
-    }
+    page = await PROJECTS_LISTING.page(
+        db, cursor, limit, sort,
+        {"status": status, "service_id": service_id, "created_from": created_from, "created_to": created_to},
+        with_total
+    )
+    return listing_response("projects", page["items"], page)
 
 # ================ УСЛУГИ (SERVICES) - ИСПРАВЛЕНО ПОД РЕАЛЬНУЮ БД ================
 @router.get("/services")
 async def get_all_services(
+    cursor: Optional[str] = None,
+    limit: int = Query(LISTING_DEFAULT_LIMIT, ge=1, le=LISTING_MAX_LIMIT),
+    sort: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    with_total: bool = False,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    """Получить все услуги"""
+    """
+    Услуги постранично (keyset). Сортировки: order_index (по умолчанию), id;
+    фильтр: is_active.
+    """
     check_admin(current_user)
     
     # Проверяем существование таблицы
-    from sqlalchemy import inspect
-    inspector = inspect(db.bind)
-    if 'services' not in inspector.get_table_names():
+    if not schema_registry.has_table('services'):
         return {
             "status": "success",
             "count": 0,
@@ -74,11 +219,11 @@ async def get_all_services(
             "message": "Таблица услуг не создана"
         }
     
-    services = db.query(models.Service).all()
+    page = await SERVICES_LISTING.page(db, cursor, limit, sort, {"is_active": is_active}, with_total)
     
     # Преобразуем поля для совместимости с фронтендом
     services_list = []
-    for service in services:
+    for service in page["items"]:
         service_dict = {
             "id": service.id,
             "name": service.title,  # title → name для совместимости
@@ -100,28 +245,17 @@ async def get_all_services(
         }
         services_list.append(service_dict)
     
-    return {
-        "status": "success",
-        "count": len(services_list),
-        "services": services_list
-    }
+    return listing_response("services", services_list, page)
 
 @router.post("/services")
 async def create_service(
     service_data: dict,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Создать новую услугу"""
     check_admin(current_user)
     
-    # Проверяем существование таблицы
-    from sqlalchemy import inspect
-    inspector = inspect(db.bind)
-    if 'services' not in inspector.get_table_names():
-        from app.database import Base
-        Base.metadata.create_all(bind=db.bind, tables=[models.Service.__table__])
-    
     # Маппинг полей из запроса в модель БД
     new_service = models.Service(
         title=service_data.get("name") or service_data.get("title", "Новая услуга"),
@@ -139,8 +273,10 @@ async def create_service(
     )
     
     db.add(new_service)
-    db.commit()
-    db.refresh(new_service)
+    await increment(db, service_changes())
+    await db.commit()
+    invalidate("services", "stats")
+    await db.refresh(new_service)
     
     # Возвращаем в формате, понятном фронтенду
     return {
@@ -162,12 +298,12 @@ async def update_service(
     service_id: int,
     service_data: dict,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Обновить услугу"""
     check_admin(current_user)
     
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
+    service = await db.get(models.Service, service_id)
     if not service:
         raise HTTPException(status_code=404, detail="Услуга не найдена")
     
@@ -194,8 +330,9 @@ async def update_service(
         service.is_active = service_data["is_active"]
     
     service.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(service)
+    await db.commit()
+    invalidate("services")
+    await db.refresh(service)
     
     return {
         "status": "success",
@@ -215,17 +352,19 @@ async def update_service(
 async def delete_service(
     service_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Удалить услугу"""
     check_admin(current_user)
     
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
+    service = await db.get(models.Service, service_id)
     if not service:
         raise HTTPException(status_code=404, detail="Услуга не найдена")
     
-    db.delete(service)
-    db.commit()
+    await increment(db, service_changes(-1))
+    await db.delete(service)
+    await db.commit()
+    invalidate("services", "stats")
     
     return {
         "status": "success",
@@ -235,18 +374,24 @@ async def delete_service(
 # ================ ТРАНЗАКЦИИ ================
 @router.get("/transactions")
 async def get_all_transactions(
+    cursor: Optional[str] = None,
+    limit: int = Query(LISTING_DEFAULT_LIMIT, ge=1, le=LISTING_MAX_LIMIT),
+    sort: Optional[str] = None,
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    with_total: bool = False,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db),
-    limit: int = 100,
-    offset: int = 0
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    """Получить все транзакции"""
+    """
+    Транзакции постранично (keyset вместо OFFSET). Сортировки: created_at (по
+    умолчанию -created_at), id; фильтры: status, created_from, created_to.
+    """
     check_admin(current_user)
     
     # Проверяем существует ли таблица transactions
-    from sqlalchemy import inspect
-    inspector = inspect(db.bind)
-    if 'transactions' not in inspector.get_table_names():
+    if not schema_registry.has_table('transactions'):
         return {
             "status": "success",
             "count": 0,
@@ -254,31 +399,23 @@ async def get_all_transactions(
             "message": "Таблица транзакций не создана"
         }
     
-    transactions = db.query(models.Transaction).order_by(
-        models.Transaction.created_at.desc()
-    ).offset(offset).limit(limit).all()
-    
-    total = db.query(models.Transaction).count()
-    
-    return {
-        "status": "success",
-        "count": len(transactions),
-        "total": total,
-        "transactions": transactions
-    }
+    page = await TRANSACTIONS_LISTING.page(
+        db, cursor, limit, sort,
+        {"status": status, "created_from": created_from, "created_to": created_to},
+        with_total
+    )
+    return listing_response("transactions", page["items"], page)
 
 @router.get("/transactions/stats")
+@cached_response(ttl=30, stale=300, tags=("transactions",))
 async def get_transactions_stats(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(require_admin),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
     """Статистика по транзакциям"""
-    check_admin(current_user)
     
     # Проверяем существует ли таблица
-    from sqlalchemy import inspect, func
-    inspector = inspect(db.bind)
-    if 'transactions' not in inspector.get_table_names():
+    if not schema_registry.has_table('transactions'):
         return {
             "status": "success",
             "stats": {
@@ -289,19 +426,22 @@ async def get_transactions_stats(
             }
         }
     
-    total_transactions = db.query(models.Transaction).count()
-    
-    # Общая сумма
-    total_revenue = db.query(func.sum(models.Transaction.amount)).scalar() or 0
+    # Число и суммы — из подневного ряда транзакций (app.timeseries), а не по сырым строкам
+    total_transactions, total_revenue = (await db.execute(select(
+        func.sum(models.TransactionRollup.count), func.sum(models.TransactionRollup.amount)
+    ).where(models.TransactionRollup.granularity == "day"))).one()
+    total_transactions = total_transactions or 0
+    total_revenue = total_revenue or 0
     
     # Средний чек
     average_amount = total_revenue / total_transactions if total_transactions > 0 else 0
     
-    # За последние 30 дней
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    last_month_revenue = db.query(func.sum(models.Transaction.amount)).filter(
-        models.Transaction.created_at >= thirty_days_ago
-    ).scalar() or 0
+    # За последние 30 дней (целыми днями)
+    thirty_days_ago = timeseries.truncate(datetime.utcnow() - timedelta(days=30), "day")
+    last_month_revenue = await db.scalar(select(func.sum(models.TransactionRollup.amount)).where(
+        models.TransactionRollup.granularity == "day",
+        models.TransactionRollup.bucket_start >= thirty_days_ago
+    )) or 0
     
     return {
         "status": "success",
@@ -314,38 +454,39 @@ async def get_transactions_stats(
     }
 
 # ================ НАСТРОЙКИ (SETTINGS) ================
+# Значения по умолчанию: сохранённые в таблице settings перекрывают их
+DEFAULT_SETTINGS = {
+    "site_name": "Front end & Back end 3",
+    "site_description": "Платформа для управления проектами",
+    "admin_email": "admin@example.com",
+    "maintenance_mode": False,
+    "registration_enabled": True,
+    "default_user_role": "user",
+    "chat_enabled": True,
+    "max_file_size": 10485760,  # 10 MB
+    "allowed_file_types": [".jpg", ".png", ".pdf", ".docx"],
+    "timezone": "UTC",
+    "language": "ru"
+}
+
 @router.get("/settings")
 async def get_settings(
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Получить настройки системы"""
     check_admin(current_user)
     
     # Проверяем существует ли таблица settings
-    from sqlalchemy import inspect
-    inspector = inspect(db.bind)
-    if 'settings' not in inspector.get_table_names():
+    if not schema_registry.has_table('settings'):
         # Возвращаем настройки по умолчанию
         return {
             "status": "success",
-            "settings": {
-                "site_name": "Front end & Back end 3",
-                "site_description": "Платформа для управления проектами",
-                "admin_email": "admin@example.com",
-                "maintenance_mode": False,
-                "registration_enabled": True,
-                "default_user_role": "user",
-                "chat_enabled": True,
-                "max_file_size": 10485760,  # 10 MB
-                "allowed_file_types": [".jpg", ".png", ".pdf", ".docx"],
-                "timezone": "UTC",
-                "language": "ru"
-            }
+            "settings": dict(DEFAULT_SETTINGS)
         }
     
-    settings = db.query(models.Setting).all()
-    settings_dict = {s.key: s.value for s in settings}
+    settings = (await db.scalars(select(models.Setting))).all()
+    settings_dict = {**DEFAULT_SETTINGS, **{s.key: s.value for s in settings}}
     
     return {
         "status": "success",
@@ -356,22 +497,14 @@ async def get_settings(
 async def update_settings(
     settings_data: dict,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Обновить настройки системы"""
     check_admin(current_user)
     
-    # Проверяем существует ли таблица settings
-    from sqlalchemy import inspect
-    inspector = inspect(db.bind)
-    if 'settings' not in inspector.get_table_names():
-        # Создаём таблицу settings
-        from app.database import Base
-        Base.metadata.create_all(bind=db.bind, tables=[models.Setting.__table__])
-    
     updated_settings = []
     for key, value in settings_data.items():
-        setting = db.query(models.Setting).filter(models.Setting.key == key).first()
+        setting = await db.scalar(select(models.Setting).where(models.Setting.key == key))
         if setting:
             setting.value = str(value)
             setting.updated_at = datetime.utcnow()
@@ -384,7 +517,7 @@ async def update_settings(
             db.add(setting)
         updated_settings.append({key: value})
     
-    db.commit()
+    await db.commit()
     
     return {
         "status": "success",
@@ -396,40 +529,28 @@ async def update_settings(
 @router.get("/statistics")
 async def get_detailed_statistics(
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_read_db)
 ):
     """Детальная статистика для админ-панели"""
     check_admin(current_user)
     
-    # Основные счетчики
-    total_users = db.query(models.User).count()
-    total_projects = db.query(models.Project).count()
-    total_services = db.query(models.Service).count()
-    total_messages = db.query(models.Message).count()
-    
-    # Новые пользователи за сегодня
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    new_users_today = db.query(models.User).filter(
-        models.User.created_at >= today_start
-    ).count()
+    # Все счётчики одним запросом: их ведут write-пути и сверяет фоновая задача (app.stats_counters)
+    totals, today = await read_counters(db)
+    total_users = totals.get("users", 0)
+    total_projects = totals.get("projects", 0)
+    total_services = totals.get("services", 0)
+    total_messages = totals.get("messages", 0)
     
-    # Новые проекты за сегодня
-    new_projects_today = db.query(models.Project).filter(
-        models.Project.created_at >= today_start
-    ).count()
+    # Новые пользователи и проекты за сегодня
+    new_users_today = today.get("users.new", 0)
+    new_projects_today = today.get("projects.new", 0)
     
     # Статистика по сообщениям
-    from sqlalchemy import func
-    messages_stats = db.query(
-        func.count(models.Message.id).label('total'),
-        func.sum(models.Message.is_owner.cast(models.Integer)).label('user_messages')
-    ).first()
-    
-    user_messages = messages_stats.user_messages or 0
-    admin_messages = (messages_stats.total or 0) - user_messages
+    user_messages = totals.get("messages.from_users", 0)
+    admin_messages = total_messages - user_messages
     
     # Статистика по ролям
-    admins_count = db.query(models.User).filter(models.User.is_admin == True).count()
+    admins_count = totals.get("users.admins", 0)
     regular_users = total_users - admins_count
     
     return {
@@ -446,10 +567,18 @@ async def get_detailed_statistics(
                 "new_projects": new_projects_today
             },
             "messages": {
-                "total": messages_stats.total or 0,
+                "total": total_messages,
                 "from_users": user_messages,
                 "from_admin": admin_messages,
-                "user_percentage": round((user_messages / messages_stats.total * 100), 2) if messages_stats.total else 0
+                "user_percentage": round((user_messages / total_messages * 100), 2) if total_messages else 0
+            },
+            "projects": {
+                "total": total_projects,
+                "by_status": by_status(totals, "projects")
+            },
+            "transactions": {
+                "total": totals.get("transactions", 0),
+                "by_status": by_status(totals, "transactions")
             },
             "users": {
                 "total": total_users,
@@ -460,36 +589,50 @@ async def get_detailed_statistics(
         }
     }
 
+@router.post("/statistics/reconcile")
+async def reconcile_statistics(
+    current_user: models.User = Depends(get_current_user)
+):
+    """Сверить счётчики статистики с таблицами сейчас, не дожидаясь фоновой задачи"""
+    check_admin(current_user)
+    drift = await stats_reconciler.run_once()
+    invalidate("stats", "messages", "transactions")
+    return {"status": "success", "corrected": drift, "reconciler": stats_reconciler.stats()}
+
+# ================ СХЕМА БД ================
+@router.post("/schema/refresh")
+async def refresh_schema(
+    current_user: models.User = Depends(get_current_user)
+):
+    """Перечитать схему БД после миграции, не перезапуская воркер"""
+    check_admin(current_user)
+    await schema_registry.refresh()
+    return {"status": "success", "schema": schema_registry.stats()}
+
 # ================ СТАТИСТИКА ПО ЧАТУ (ДОПОЛНИТЕЛЬНО) ================
 @router.get("/stats/chat")
 async def get_chat_statistics(
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_read_db)
 ):
     """Статистика по чату для админ-панели"""
     check_admin(current_user)
     
-    from sqlalchemy import func
-    
-    # Общее количество сообщений
-    total_messages = db.query(models.Message).count()
+    # Общее количество сообщений (счётчик stats_counters)
+    totals, _ = await read_counters(db)
+    total_messages = totals.get("messages", 0)
     
-    # Сообщения по дням за последние 7 дней
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    messages_by_day = db.query(
-        func.date(models.Message.created_at).label('date'),
-        func.count(models.Message.id).label('count')
-    ).filter(
-        models.Message.created_at >= seven_days_ago
-    ).group_by(
-        func.date(models.Message.created_at)
-    ).all()
+    # Сообщения по дням за последние 7 дней (подневной ряд app.timeseries)
+    today = timeseries.truncate(datetime.utcnow(), "day")
+    messages_by_day = await timeseries.series(db, "messages", "day", today - timedelta(days=6), today + timedelta(days=1))
     
     # Активные пользователи (те, кто писал за последние 24 часа)
     day_ago = datetime.utcnow() - timedelta(days=1)
-    active_users = db.query(models.Message.user_id).filter(
+    # У Message нет user_id: считаем различных авторов пользовательских сообщений
+    active_users = await db.scalar(select(func.count(func.distinct(models.Message.sender_id))).where(
+        models.Message.is_owner == True,
         models.Message.created_at >= day_ago
-    ).distinct().count()
+    ))
     
     return {
         "status": "success",
@@ -497,8 +640,190 @@ async def get_chat_statistics(
             "total_messages": total_messages,
             "active_users_24h": active_users,
             "messages_last_7_days": [
-                {"date": str(day.date), "count": day.count} 
-                for day in messages_by_day
+                {"date": day["t"][:10], "count": day["total"]}
+                for day in messages_by_day if day["total"]
             ]
         }
-    }
\ No newline at end of file
+    }
+
+# ================ ВРЕМЕННЫЕ РЯДЫ ================
+@router.get("/timeseries")
+async def get_timeseries(
+    metric: Literal["messages", "transactions"],
+    date_from: datetime = Query(..., alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    bucket: Literal["hour", "day", "week", "month"] = "day",
+    status: Optional[str] = None,
+    currency: Optional[str] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    """
+    Ряд сообщений (по направлению) или транзакций (число и сумма по статусу и
+    валюте) за [from, to) с шагом bucket. Читает только почасовые/подневные итоги.
+    """
+    check_admin(current_user)
+    
+    # Границы в наивном UTC: from может прийти с часовым поясом, а to по умолчанию — без
+    date_from = timeseries.to_naive_utc(date_from)
+    date_to = timeseries.to_naive_utc(date_to) if date_to else datetime.utcnow()
+    if date_from >= date_to:
+        raise HTTPException(status_code=400, detail="from должен быть раньше to")
+    if bucket == "hour" and date_to - date_from > timedelta(days=timeseries.TIMESERIES_MAX_HOURLY_DAYS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"С шагом hour — не больше {timeseries.TIMESERIES_MAX_HOURLY_DAYS} дней, возьмите bucket=day"
+        )
+    if timeseries.count_points(bucket, date_from, date_to) > timeseries.TIMESERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail="Слишком много точек, возьмите шаг крупнее")
+    
+    points = await timeseries.series(db, metric, bucket, date_from, date_to, status=status, currency=currency)
+    return {
+        "status": "success",
+        "metric": metric,
+        "bucket": bucket,
+        "from": points[0]["t"] if points else None,
+        "to": date_to.isoformat(),
+        "points": points
+    }
+
+# ================ КЭШ ОТВЕТОВ ================
+@router.get("/stats/response-cache")
+async def get_response_cache_stats(
+    current_user: models.User = Depends(require_admin)
+):
+    """Попадания, устаревшие ответы и объединённые промахи кэша ответов"""
+    return {"status": "success", "response_cache": response_cache.stats()}
+
+# ================ КЭШ АУТЕНТИФИКАЦИИ ================
+@router.get("/stats/auth-cache")
+async def get_auth_cache_stats(
+    current_user: models.User = Depends(get_current_user)
+):
+    """Попадания/промахи кэша пользователей и токенов"""
+    check_admin(current_user)
+    return {"status": "success", "stats": auth_cache.stats()}
+
+@router.get("/stats/passwords")
+async def get_password_hasher_stats(
+    current_user: models.User = Depends(get_current_user)
+):
+    """Схема хэширования паролей, размер пула и число обновлённых старых хэшей"""
+    check_admin(current_user)
+    return {"status": "success", "stats": password_hasher.stats()}
+
+@router.get("/stats/rate-limit")
+async def get_rate_limit_stats(
+    current_user: models.User = Depends(get_current_user)
+):
+    """Сколько запросов и сообщений пропущено и отклонено лимитами"""
+    check_admin(current_user)
+    return {"status": "success", "stats": limiter.stats()}
+
+@router.get("/debug/queries")
+async def get_query_debug(
+    limit: int = Query(50, ge=1, le=200),
+    current_user: models.User = Depends(get_current_user)
+):
+    """SQL по последним запросам: число и время, медленные запросы, подозрения на N+1"""
+    check_admin(current_user)
+    return {"status": "success", "stats": query_stats.snapshot(limit)}
+
+# ================ ПОИСК ПО СООБЩЕНИЯМ ЧАТА ================
+@router.get("/messages/search")
+async def search_chat_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    user_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    Полнотекстовый поиск по сообщениям (все слова запроса, по префиксу).
+
+    Самые релевантные — первыми; snippet — экранированный фрагмент с <mark>.
+    user_id ограничивает поиск одним диалогом, cursor — следующая страница.
+    """
+    check_admin(current_user)
+    results, next_cursor = await search_messages(db, q, limit, cursor=cursor, user_id=user_id)
+    return {
+        "status": "success",
+        "count": len(results),
+        "results": results,
+        "cursor": next_cursor,
+        "has_more": next_cursor is not None
+    }
+
+# ================ ВХОДЯЩИЕ ЧАТА (СВОДКИ ДИАЛОГОВ) ================
+# Порядок входящих: свежие диалоги первыми; по нему же строятся курсоры
+INBOX_ORDER = (models.Conversation.last_message_at, models.Conversation.user_id)
+
+@router.get("/conversations")
+async def get_inbox(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    unread_only: bool = False,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    Диалоги с пользователями, самые свежие первыми (keyset по last_message_at, user_id).
+
+    Одна выборка по индексу сводок: имя пользователя и текст последнего
+    сообщения подтягиваются соединением по первичным ключам.
+    """
+    check_admin(current_user)
+    query = (
+        select(
+            models.Conversation,
+            models.User.name,
+            models.User.email,
+            models.Message.content,
+            models.Message.is_owner
+        )
+        .join(models.User, models.User.id == models.Conversation.user_id)
+        .outerjoin(models.Message, models.Message.id == models.Conversation.last_message_id)
+    )
+    if unread_only:
+        query = query.where(models.Conversation.unread_for_admin > 0)
+    if cursor:
+        query = query.where(keyset_condition(INBOX_ORDER, decode_cursor(cursor, INBOX_ORDER), descending=True))
+    rows = (await db.execute(query.order_by(*keyset_order(INBOX_ORDER, descending=True)).limit(limit + 1))).all()
+    
+    page = rows[:limit]
+    conversations = [
+        {
+            "user_id": conversation.user_id,
+            "name": name,
+            "email": email,
+            "last_message_id": conversation.last_message_id,
+            "last_message_at": conversation.last_message_at.isoformat() if conversation.last_message_at else None,
+            "last_message": content,
+            "last_is_from_admin": is_owner is not None and not is_owner,
+            "unread_for_admin": conversation.unread_for_admin,
+            "unread_for_user": conversation.unread_for_user,
+            "message_count": conversation.message_count
+        }
+        for conversation, name, email, content, is_owner in page
+    ]
+    has_more = len(rows) > limit
+    last = page[-1][0] if page else None
+    return {
+        "status": "success",
+        "count": len(conversations),
+        "conversations": conversations,
+        "has_more": has_more,
+        "cursor": encode_cursor((last.last_message_at, last.user_id)) if has_more else None
+    }
+
+@router.post("/conversations/{user_id}/read")
+async def mark_inbox_read(
+    user_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Отметить диалог прочитанным админом"""
+    check_admin(current_user)
+    await mark_conversation_read(db, user_id, by_admin=True)
+    return {"status": "success"}
@@ -1,19 +1,29 @@
 ﻿from fastapi import APIRouter, HTTPException, Depends, Response, Request
+from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models import User
 import jwt
 from datetime import datetime, timedelta
-import hashlib
+import os
 import secrets
 from typing import Optional
+from app.auth_cache import auth_cache
+from app.passwords import hash_password, verify_password
+from app.rate_limit import RATE_LIMIT_LOGIN, RATE_LIMIT_REFRESH, RATE_LIMIT_REGISTER, rate_limit
+from app.stats_counters import increment, user_changes
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 SECRET_KEY = "your-super-secret-jwt-key-change-this-in-production"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Access-токен короткий: в нём роль и имя, и он проверяется без БД; продлевается через /refresh
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+# Refresh-токен нужен только эндпоинтам /api/auth — в остальные запросы cookie не уходит
+REFRESH_COOKIE_PATH = "/api/auth"
 
 class LoginRequest(BaseModel):
     email: str
@@ -24,47 +34,113 @@ class RegisterRequest(BaseModel):
     password: str
     name: str
 
-def hash_password(password: str, salt: str = None) -> tuple:
-    if salt is None:
-        salt = secrets.token_hex(16)
-    hash_obj = hashlib.sha256()
-    hash_obj.update(f"{password}{salt}".encode('utf-8'))
-    hashed_password = hash_obj.hexdigest()
-    return hashed_password, salt
+class RefreshRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
-def verify_password(password: str, hashed_password: str, salt: str) -> bool:
-    test_hash, _ = hash_password(password, salt)
-    return test_hash == hashed_password
-
-def create_access_token(user_id: int):
+def create_access_token(user: User):
+    """Самодостаточный токен: по нему страницы и API узнают пользователя без запроса к БД"""
+    now = datetime.utcnow()
     payload = {
-        "sub": str(user_id),  # ID пользователя, а не email
-        "exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        "sub": str(user.id),  # ID пользователя, а не email
+        "type": "access",
+        "name": user.name,
+        "email": user.email,
+        "role": "admin" if user.is_admin else "user",
+        "ver": user.token_version or 0,
+        "iat": now,
+        "exp": now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     }
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
     return token
 
-@router.post("/register")
+def create_refresh_token(user: User):
+    payload = {
+        "sub": str(user.id),
+        "type": "refresh",
+        "ver": user.token_version or 0,
+        "jti": secrets.token_hex(8),
+        "exp": datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+def issue_tokens(response: Response, user: User) -> str:
+    """Выдать пару токенов в cookies и вернуть access-токен"""
+    access_token = create_access_token(user)
+    refresh_token = create_refresh_token(user)
+    auth_cache.remember_token_version(user.id, user.token_version or 0)
+    
+    # Устанавливаем cookie (httponly=False для доступа из JS)
+    response.set_cookie(
+        key="access_token",
+        value=access_token,
+        httponly=False,
+        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        expires=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        samesite="lax",
+        path="/"
+    )
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,
+        max_age=REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600,
+        expires=REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600,
+        samesite="lax",
+        path=REFRESH_COOKIE_PATH
+    )
+    return access_token
+
+def clear_tokens(response: Response):
+    response.delete_cookie("access_token", path="/")
+    response.delete_cookie("refresh_token", path=REFRESH_COOKIE_PATH)
+
+def user_payload(user: User) -> dict:
+    return {
+        "id": user.id,
+        "email": user.email,
+        "name": user.name,
+        "is_admin": user.is_admin
+    }
+
+async def user_from_refresh_token(refresh_token: Optional[str], db: AsyncSession) -> User:
+    """Проверить refresh-токен: подпись, тип и версию токенов пользователя в БД"""
+    if not refresh_token:
+        raise HTTPException(status_code=401, detail="Нет refresh-токена")
+    try:
+        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Недействительный refresh-токен")
+    if payload.get("type") != "refresh":
+        raise HTTPException(status_code=401, detail="Недействительный refresh-токен")
+    
+    user = await db.get(User, int(payload["sub"]))
+    if user is None or payload.get("ver") != (user.token_version or 0):
+        raise HTTPException(status_code=401, detail="Токен отозван")
+    return user
+
+@router.post("/register", dependencies=[Depends(rate_limit(RATE_LIMIT_REGISTER))])
 async def register(
     register_data: RegisterRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    existing_user = db.query(User).filter(User.email == register_data.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == register_data.email))
     if existing_user:
         raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
     
-    hashed_password, salt = hash_password(register_data.password)
+    # Хэш считается в пуле потоков (app.passwords), соль хранится внутри хэша
+    hashed_password = await hash_password(register_data.password)
     new_user = User(
         email=register_data.email,
         name=register_data.name,
         hashed_password=hashed_password,
-        salt=salt,
+        salt=None,
         is_admin=False,
         created_at=datetime.utcnow()
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await increment(db, user_changes(new_user))
+    await db.commit()
+    await db.refresh(new_user)
     
     return {
         "id": new_user.id,
@@ -73,55 +149,103 @@ async def register(
         "is_admin": new_user.is_admin
     }
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(rate_limit(RATE_LIMIT_LOGIN))])
 async def login(
     login_data: LoginRequest,
     response: Response,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_user = db.query(User).filter(User.email == login_data.email).first()
+    db_user = await db.scalar(select(User).where(User.email == login_data.email))
     
     if not db_user:
         raise HTTPException(status_code=401, detail="Неверный email или пароль")
     
-    if not verify_password(login_data.password, db_user.hashed_password, db_user.salt):
+    valid, new_hash = await verify_password(login_data.password, db_user.hashed_password, db_user.salt)
+    if not valid:
         raise HTTPException(status_code=401, detail="Неверный email или пароль")
+    if new_hash:
+        # Старый SHA-256 или устаревшая стоимость — сохраняем хэш текущей схемы
+        db_user.hashed_password = new_hash
+        db_user.salt = None
+        await db.commit()
     
-    # Создаём токен с ID пользователя
-    access_token = create_access_token(db_user.id)
-    
-    # Устанавливаем cookie (httponly=False для доступа из JS)
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=False,
-        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        expires=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        samesite="lax",
-        path="/"
-    )
+    # Создаём пару токенов: короткий access и долгий refresh
+    access_token = issue_tokens(response, db_user)
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "user": {
-            "id": db_user.id,
-            "email": db_user.email,
-            "name": db_user.name,
-            "is_admin": db_user.is_admin
-        }
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "user": user_payload(db_user)
     }
 
+@router.post("/refresh", dependencies=[Depends(rate_limit(RATE_LIMIT_REFRESH, name="refresh"))])
+async def refresh(
+    request: Request,
+    response: Response,
+    refresh_data: Optional[RefreshRequest] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Новый access-токен (и новый refresh-токен) по refresh-токену из тела или cookie"""
+    refresh_token = (refresh_data.refresh_token if refresh_data else None) or request.cookies.get("refresh_token")
+    user = await user_from_refresh_token(refresh_token, db)
+    access_token = issue_tokens(response, user)
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "user": user_payload(user)
+    }
+
+@router.get("/refresh", dependencies=[Depends(rate_limit(RATE_LIMIT_REFRESH, name="refresh"))])
+async def refresh_and_redirect(
+    request: Request,
+    next: str = "/dashboard",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Продлить сессию при переходе на страницу (access-токен истёк) и вернуть на неё"""
+    if not next.startswith("/") or next.startswith("//"):
+        next = "/dashboard"
+    try:
+        user = await user_from_refresh_token(request.cookies.get("refresh_token"), db)
+    except HTTPException:
+        return RedirectResponse(url="/login")
+    redirect = RedirectResponse(url=next)
+    issue_tokens(redirect, user)
+    return redirect
+
+@router.post("/logout")
+async def logout(
+    request: Request,
+    response: Response,
+    everywhere: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Выйти; everywhere=true — отозвать все токены пользователя на всех устройствах"""
+    clear_tokens(response)
+    if everywhere:
+        user = await user_from_refresh_token(request.cookies.get("refresh_token"), db)
+        user.token_version = (user.token_version or 0) + 1
+        await db.commit()
+        auth_cache.remember_token_version(user.id, user.token_version)
+        auth_cache.invalidate_user(user.id)
+    return {"status": "success"}
+
 from app.dependencies import get_current_user
 
 @router.get("/me")
 async def read_users_me(
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    # Профиль целиком (дата регистрации не входит в токен)
+    user = await db.get(User, current_user.id)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Пользователь не найден")
     return {
-        "id": current_user.id,
-        "email": current_user.email,
-        "name": current_user.name,
-        "is_admin": current_user.is_admin,
-        "created_at": current_user.created_at
+        "id": user.id,
+        "email": user.email,
+        "name": user.name,
+        "is_admin": user.is_admin,
+        "created_at": user.created_at
     }
\ No newline at end of file
@@ -1,45 +1,35 @@
-﻿from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends
-from typing import List
+﻿from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query
+from typing import List, Optional
 import json
+import os
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import SessionLocal, get_db
+from app.auth_middleware import extract_token
+from app.database import AsyncSessionLocal, get_async_db, get_read_db
+from app.dependencies import get_current_user, resolve_user
+from app.pagination import decode_cursor, encode_cursor, keyset_condition, keyset_order
 from app.models import Message, User
+from app.websocket_manager import manager
+from app.chat_persistence import mark_conversation_read, message_writer
+from app.response_cache import cached_response
+from app.rate_limit import (
+    RATE_LIMIT_CHAT_HISTORY, RATE_LIMIT_WS_ADMIN_MESSAGES, MessageBudget, rate_limit,
+)
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-    
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-    
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
-    
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
-
-manager = ConnectionManager()
-
 # ========== ЭНДПОИНТ ДЛЯ ПРОВЕРКИ БД ==========
 @router.get("/check-db")
-async def check_db(db: Session = Depends(get_db)):
+async def check_db(db: AsyncSession = Depends(get_async_db)):
     """
     Проверить, какая БД реально используется
     """
     try:
         db_url = str(db.bind.url)
-        user_count = db.query(User).count()
-        users = db.query(User).all()
+        user_count = await db.scalar(select(func.count(User.id)))
+        users = (await db.scalars(select(User))).all()
         
         return {
             "db_url": db_url,
@@ -61,13 +51,13 @@ async def check_db(db: Session = Depends(get_db)):
 
 # ========== ТЕСТОВЫЙ ЭНДПОИНТ ДЛЯ ПРОВЕРКИ ПОЛЬЗОВАТЕЛЕЙ ==========
 @router.get("/test-users")
-async def test_users(db: Session = Depends(get_db)):
+async def test_users(db: AsyncSession = Depends(get_async_db)):
     """
     Тестовый эндпоинт для проверки пользователей в БД
     """
     try:
         print("\n🔍 ТЕСТОВЫЙ ЗАПРОС: ПОЛУЧЕНИЕ ВСЕХ ПОЛЬЗОВАТЕЛЕЙ")
-        users = db.query(User).all()
+        users = (await db.scalars(select(User))).all()
         result = {
             "count": len(users),
             "users": [
@@ -85,49 +75,142 @@ async def test_users(db: Session = Depends(get_db)):
         print(f"❌ Ошибка в test-users: {str(e)}")
         return {"error": str(e)}
 
-@router.get("/history/{user_id}")
-async def get_chat_history(user_id: int, db: Session = Depends(get_db)):
+# Порядок истории: (created_at, id) — по нему же строятся курсоры
+HISTORY_ORDER = (Message.created_at, Message.id)
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+# Сколько пропущенных сообщений догружаем при переподключении; больше — клиент перечитывает историю
+CHAT_RESUME_MAX = int(os.getenv("CHAT_RESUME_MAX", "500"))
+
+def message_to_dict(msg: Message) -> dict:
+    return {
+        "id": msg.id,
+        "conversation_id": msg.conversation_id,
+        "seq": msg.seq,
+        "content": msg.content,
+        "sender_id": msg.sender_id,
+        "receiver_id": msg.receiver_id,
+        "is_from_admin": not msg.is_owner,
+        "created_at": msg.created_at.isoformat() if msg.created_at else None
+    }
+
+def saved_message_to_dict(saved: dict) -> dict:
+    """То же представление, что message_to_dict, для только что записанного сообщения"""
+    return {
+        "id": saved["id"],
+        "conversation_id": saved["conversation_id"],
+        "seq": saved["seq"],
+        "content": saved["content"],
+        "sender_id": saved["sender_id"],
+        "receiver_id": saved["receiver_id"],
+        "is_from_admin": not saved["is_owner"],
+        "created_at": saved["created_at"].isoformat()
+    }
+
+def message_cursor(msg: dict) -> str:
+    return encode_cursor((msg["created_at"], msg["id"]))
+
+def cached_history_page(user_id: int, limit: int, before: Optional[str], after: Optional[str]):
+    """Страница из горячего хвоста диалога или None, если нужна БД"""
+    cursor = before or after
+    cursor_id = decode_cursor(cursor, HISTORY_ORDER)[1] if cursor else None
+    return manager.history_cache.page(
+        user_id,
+        limit,
+        before_id=cursor_id if before else None,
+        after_id=cursor_id if after else None,
+    )
+
+async def fetch_history_page(
+    db: AsyncSession,
+    user_id: int,
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None
+):
     """
-    Получить историю сообщений для конкретного пользователя
+    Страница диалога пользователя в хронологическом порядке и флаг "есть ещё".
+
+    Входящие и исходящие читаются двумя запросами по индексам
+    (sender_id, created_at) и (receiver_id, created_at), каждый не больше
+    limit + 1 строк, и сливаются в памяти: OR по двум колонкам заставил бы
+    базу собрать и отсортировать весь диалог.
     """
-    print(f"\n{'='*50}")
-    print(f"🔥 ВЫЗВАНА get_chat_history ДЛЯ user_id={user_id}")
-    print(f"{'='*50}")
+    descending = after is None
+    cursor = before or after
+    cursor_values = decode_cursor(cursor, HISTORY_ORDER) if cursor else None
+    order_by = keyset_order(HISTORY_ORDER, descending)
+    
+    rows = {}
+    for column in (Message.sender_id, Message.receiver_id):
+        query = select(Message).where(column == user_id)
+        if cursor_values:
+            query = query.where(keyset_condition(HISTORY_ORDER, cursor_values, descending))
+        for msg in (await db.scalars(query.order_by(*order_by).limit(limit + 1))).all():
+            rows[msg.id] = msg
+    
+    # NULL — после всех дат, как в keyset_order
+    ordered = sorted(rows.values(), key=lambda m: (m.created_at or datetime.max, m.id), reverse=descending)
+    has_more = len(ordered) > limit
+    page = ordered[:limit]
+    if descending:
+        page.reverse()
+    return page, has_more
+
+@router.get("/history/{user_id}", dependencies=[Depends(rate_limit(RATE_LIMIT_CHAT_HISTORY, by="user"))])
+async def get_chat_history(
+    user_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Получить историю сообщений для конкретного пользователя (постранично).
+    Доступна самому пользователю и админу.
+
+    Без курсора — последние limit сообщений; before=<курсор> — более ранние,
+    after=<курсор> — более новые. В ответе сообщения идут по возрастанию времени,
+    has_more говорит, есть ли ещё сообщения в направлении запроса,
+    а курсоры before/after берутся из первого и последнего сообщения страницы.
+    """
+    if current_user.id != user_id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Нет доступа к этому диалогу")
+    if before and after:
+        raise HTTPException(status_code=400, detail="Укажите только before или только after")
     
     try:
-        print(f"🔍 Ищем пользователя с id={user_id}...")
-        user = db.query(User).filter(User.id == user_id).first()
-        
-        if not user:
-            print(f"❌ Пользователь с id={user_id} НЕ НАЙДЕН в БД!")
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-        
-        print(f"✅ Пользователь найден: {user.email} (админ: {user.is_admin})")
-        print(f"🔍 Ищем сообщения для user_id={user_id}...")
-        
-        messages = db.query(Message).filter(
-            (Message.sender_id == user_id) | (Message.receiver_id == user_id)
-        ).order_by(Message.created_at.asc()).all()
-        
-        print(f"📊 Найдено сообщений: {len(messages)}")
-        
-        result = []
-        for i, msg in enumerate(messages):
-            print(f"  📝 Сообщение {i+1}: id={msg.id}, sender={msg.sender_id}, receiver={msg.receiver_id}, owner={msg.is_owner}")
-            result.append({
-                "id": msg.id,
-                "content": msg.content,
-                "sender_id": msg.sender_id,
-                "receiver_id": msg.receiver_id,
-                "is_from_admin": not msg.is_owner,
-                "created_at": msg.created_at.isoformat() if msg.created_at else None
-            })
+        # Последние сообщения диалога обычно уже лежат в памяти — тогда в БД не ходим
+        cached = cached_history_page(user_id, limit, before, after)
+        if cached is not None:
+            page, has_more = cached
+        else:
+            user = await db.get(User, user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="Пользователь не найден")
+            
+            # Кэш заполняем только из основной БД: реплика может отставать
+            latest = not before and not after and not db.info.get("replica")
+            if latest:
+                manager.history_cache.begin_load(user_id)
+            try:
+                messages, has_more = await fetch_history_page(db, user_id, limit, before=before, after=after)
+                page = [message_to_dict(msg) for msg in messages]
+                if latest:
+                    manager.history_cache.load(user_id, page)
+            finally:
+                if latest:
+                    manager.history_cache.end_load(user_id)
         
-        print(f"✅ Возвращаем {len(result)} сообщений")
-        return result
+        return {
+            "messages": page,
+            "has_more": has_more,
+            "before": message_cursor(page[0]) if page else before,
+            "after": message_cursor(page[-1]) if page else after
+        }
         
     except HTTPException:
-        print(f"⚠️ HTTP исключение: пользователь не найден")
         raise
     except Exception as e:
         print(f"\n❌ КРИТИЧЕСКАЯ ОШИБКА в get_chat_history:")
@@ -139,34 +222,144 @@ async def get_chat_history(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Ошибка получения истории: {str(e)}")
 
 @router.get("/stats/total")
-async def get_total_messages(db: Session = Depends(get_db)):
+@cached_response(ttl=5, stale=60, tags=("messages",))
+async def get_total_messages(db: AsyncSession = Depends(get_async_db)):
     """
     Получить общее количество сообщений
     """
     try:
-        total = db.query(Message).count()
+        total = await db.scalar(select(func.count(Message.id)))
         return {"total": total}
     except Exception as e:
         print(f"❌ Ошибка stats/total: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения статистики: {str(e)}")
 
+@router.get("/stats/connections")
+async def get_connection_stats():
+    """
+    Состояние WebSocket-подключений: очереди, отброшенные кадры, отключённые медленные клиенты
+    """
+    return manager.stats()
+
+@router.get("/stats/history-cache")
+async def get_history_cache_stats():
+    """
+    Горячий хвост истории в памяти: попадания/промахи, занятая память, вытеснения
+    """
+    return manager.history_cache.stats()
+
+@router.get("/stats/persistence")
+async def get_persistence_stats():
+    """
+    Состояние групповой записи сообщений: очередь, размер пачек, время коммита
+    """
+    return message_writer.stats()
+
+def send_ack(websocket: WebSocket, request: dict, saved: dict):
+    """Подтвердить отправителю, что сообщение зафиксировано в БД"""
+    manager.send_personal_message({
+        "type": "message_ack",
+        "message_id": request.get("message_id"),
+        "id": saved["id"],
+        "seq": saved["seq"],
+        "created_at": saved["created_at"].isoformat()
+    }, websocket)
+
+def send_error(websocket: WebSocket, request: dict, error: Exception):
+    manager.send_personal_message({
+        "type": "message_error",
+        "message_id": request.get("message_id"),
+        "detail": str(error)
+    }, websocket)
+
+def over_budget(websocket: WebSocket, budget: MessageBudget, request: dict) -> bool:
+    """Сообщение сверх бюджета подключения: сообщаем клиенту и не обрабатываем"""
+    retry_after = budget.take()
+    if not retry_after:
+        return False
+    manager.send_personal_message({
+        "type": "rate_limited",
+        "message_id": request.get("message_id"),
+        "retry_after": round(retry_after, 2)
+    }, websocket)
+    return True
+
+def new_message_frame(msg: Message, replay: bool = False) -> dict:
+    """Кадр new_message из сохранённого сообщения (для догрузки после переподключения)"""
+    return {
+        "type": "new_message",
+        "id": msg.id,
+        "seq": msg.seq,
+        "user_id": msg.conversation_id,
+        "content": msg.content,
+        "sender_id": msg.sender_id,
+        "is_from_admin": not msg.is_owner,
+        "created_at": msg.created_at.isoformat() if msg.created_at else None,
+        "replay": replay
+    }
+
+async def replay_missed(connection, user_id: int, resume_from: int) -> Optional[int]:
+    """
+    Догрузить сообщения диалога с seq > resume_from по индексу (conversation_id, seq).
+
+    Возвращает число догруженных сообщений или None, если пропущено больше
+    CHAT_RESUME_MAX — тогда клиенту дешевле перечитать историю целиком.
+    """
+    async with AsyncSessionLocal() as db:
+        missed = (await db.scalars(
+            select(Message)
+            .where(Message.conversation_id == user_id, Message.seq > resume_from)
+            .order_by(Message.seq)
+            .limit(CHAT_RESUME_MAX + 1)
+        )).all()
+    if len(missed) > CHAT_RESUME_MAX:
+        return None
+    for msg in missed:
+        await connection.send_now(manager.serialize(new_message_frame(msg, replay=True)))
+    return len(missed)
+
+async def authenticate_websocket(websocket: WebSocket):
+    """
+    Пользователь по токену рукопожатия (cookie access_token, заголовок или
+    ?token=); None — токена нет или он не годится. AuthMiddleware WebSocket
+    пропускает, поэтому проверяем здесь, до регистрации подключения.
+    """
+    token = extract_token(websocket)
+    if not token:
+        return None
+    try:
+        return await resolve_user(token)
+    except HTTPException:
+        return None
+
 @router.websocket("/admin")
 async def websocket_admin_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    db = SessionLocal()
+    user = await authenticate_websocket(websocket)
+    if user is None or not user.is_admin:
+        # 1008 (policy violation): кадры админов — только админам
+        await websocket.close(code=1008)
+        return
+    await manager.connect(websocket, is_admin=True)
+    budget = MessageBudget(RATE_LIMIT_WS_ADMIN_MESSAGES)
     
     try:
-        await websocket.send_json({
+        manager.send_personal_message({
             "type": "connection_established",
             "status": "connected",
             "timestamp": datetime.now().isoformat()
-        })
+        }, websocket)
         
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
             message_type = message_data.get("type")
             
+            if over_budget(websocket, budget, message_data):
+                if budget.exhausted:
+                    await websocket.close(code=1008)
+                    break
+                continue
+            
             if message_type == "admin_message":
                 target_user_id = message_data.get("user_id")
                 content = message_data.get("content")
@@ -175,135 +368,147 @@ async def websocket_admin_endpoint(websocket: WebSocket):
                     continue
                 
                 try:
-                    # Сохраняем сообщение в БД
-                    db_message = Message(
+                    target_user_id = int(target_user_id)
+                except (TypeError, ValueError):
+                    continue
+                
+                try:
+                    # Сохраняем сообщение в БД (групповой коммит) и ждём подтверждения
+                    saved = await message_writer.submit(
                         content=content,
-                        sender_id=1,
+                        sender_id=user.id,
                         receiver_id=target_user_id,
                         is_owner=False,
-                        created_at=datetime.now()
+                        created_at=datetime.now(),
+                        conversation_id=target_user_id
                     )
-                    db.add(db_message)
-                    db.commit()
                     
                     print(f"✅ Сообщение от админа сохранено в БД для user_id={target_user_id}")
+                    send_ack(websocket, message_data, saved)
                     
-                    # Показываем сообщение в чате админа
-                    await websocket.send_json({
+                    # Один кадр для всех получателей: вкладки пользователя и админы
+                    record = saved_message_to_dict(saved)
+                    frame = manager.serialize({
                         "type": "new_message",
+                        "id": saved["id"],
+                        "seq": saved["seq"],
                         "user_id": target_user_id,
                         "content": content,
-                        "sender_id": 1,
+                        "sender_id": saved["sender_id"],
                         "is_from_admin": True,
-                        "created_at": datetime.now().isoformat()
+                        "created_at": saved["created_at"].isoformat()
                     })
-                    
-                    # Отправляем сообщение пользователю
-                    user_sent = False
-                    for connection in manager.active_connections:
-                        if connection != websocket:
-                            try:
-                                await connection.send_json({
-                                    "type": "new_message",
-                                    "user_id": target_user_id,
-                                    "content": content,
-                                    "sender_id": 1,
-                                    "is_from_admin": True,
-                                    "created_at": datetime.now().isoformat()
-                                })
-                                user_sent = True
-                                print(f"📨 Сообщение от админа отправлено пользователю {target_user_id}")
-                            except Exception as e:
-                                print(f"❌ Ошибка отправки пользователю: {e}")
-                    
-                    if not user_sent:
-                        print(f"⚠️ Пользователь {target_user_id} не в сети, сообщение сохранено в БД")
+                    await manager.publish(frame, user_id=target_user_id, admins=True, message=record)
+                    print(f"📨 Сообщение от админа отправлено пользователю {target_user_id}")
                     
                 except Exception as e:
-                    db.rollback()
                     print(f"❌ Ошибка БД: {e}")
+                    send_error(websocket, message_data, e)
                     
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print("🔌 Админ отключился")
     finally:
-        db.close()
+        manager.disconnect(websocket)
 
 @router.websocket("/ws/chat/{user_id}")
-async def websocket_user_endpoint(websocket: WebSocket, user_id: int):
-    await manager.connect(websocket)
-    db = SessionLocal()
+async def websocket_user_endpoint(websocket: WebSocket, user_id: int, resume_from: Optional[int] = None):
+    """
+    Чат пользователя. При переподключении клиент передаёт resume_from=<последний seq>
+    и получает только пропущенные сообщения вместо повторной загрузки истории.
+    Подключиться можно только к своему чату.
+    """
+    user = await authenticate_websocket(websocket)
+    if user is None or user.id != user_id:
+        await websocket.close(code=1008)
+        return
+    # Живые кадры придерживаем, пока не догрузим пропущенное: так не будет ни дыр, ни перестановок
+    connection = await manager.connect(websocket, user_id=user_id, hold=resume_from is not None)
+    # Каждое сообщение — запись в БД: флуд одного клиента не должен тормозить остальных
+    budget = MessageBudget()
     
     try:
-        await websocket.send_json({
+        replayed = 0
+        resync = False
+        if resume_from is not None:
+            try:
+                replayed = await replay_missed(connection, user_id, resume_from)
+                resync = replayed is None
+            except Exception as e:
+                print(f"❌ Ошибка догрузки пропущенных сообщений для {user_id}: {e}")
+                resync = True
+            finally:
+                connection.release()
+            resync = resync or connection.hold_overflow
+        
+        manager.send_personal_message({
             "type": "connected",
             "user_id": user_id,
+            "resume_from": resume_from,
+            "replayed": replayed or 0,
             "timestamp": datetime.now().isoformat()
-        })
+        }, websocket)
+        if resync:
+            # Пропущено слишком много (или часть живых кадров не поместилась) — пусть клиент перечитает историю
+            manager.send_personal_message({"type": "resync_required", "user_id": user_id}, websocket)
         
         while True:
             data = await websocket.receive_json()
             
+            if over_budget(websocket, budget, data):
+                if budget.exhausted:
+                    print(f"⚠️ Пользователь {user_id} превысил лимит сообщений, подключение закрыто")
+                    await websocket.close(code=1008)
+                    break
+                continue
+            
             if data.get("type") == "message":
                 content = data.get("content")
                 if not content:
                     continue
                 
                 try:
-                    # Сохраняем сообщение в БД
-                    message = Message(
+                    # Сохраняем сообщение в БД (групповой коммит) и ждём подтверждения
+                    saved = await message_writer.submit(
                         sender_id=user_id,
                         receiver_id=1,
                         content=content,
                         is_owner=True,
-                        created_at=datetime.now()
+                        created_at=datetime.now(),
+                        conversation_id=user_id
                     )
-                    db.add(message)
-                    db.commit()
                     
                     print(f"✅ Сообщение от пользователя {user_id} сохранено в БД: {content}")
+                    send_ack(websocket, data, saved)
                     
-                    # Показываем сообщение в чате пользователя
-                    await websocket.send_json({
+                    # Один кадр для всех получателей: вкладки пользователя и админы
+                    record = saved_message_to_dict(saved)
+                    frame = manager.serialize({
                         "type": "new_message",
+                        "id": saved["id"],
+                        "seq": saved["seq"],
                         "user_id": user_id,
                         "content": content,
                         "sender_id": user_id,
                         "is_from_admin": False,
-                        "created_at": datetime.now().isoformat()
+                        "created_at": saved["created_at"].isoformat()
                     })
-                    
-                    # Отправляем сообщение админу
-                    admin_sent = False
-                    for connection in manager.active_connections:
-                        if connection != websocket:
-                            try:
-                                await connection.send_json({
-                                    "type": "new_message",
-                                    "user_id": user_id,
-                                    "content": content,
-                                    "sender_id": user_id,
-                                    "is_from_admin": False,
-                                    "created_at": datetime.now().isoformat()
-                                })
-                                admin_sent = True
-                                print(f"📨 Сообщение от пользователя {user_id} отправлено админу")
-                            except Exception as e:
-                                print(f"❌ Ошибка отправки админу: {e}")
-                    
-                    if not admin_sent:
-                        print("⚠️ Админ не в сети, сообщение сохранено в БД")
+                    await manager.publish(frame, user_id=user_id, admins=True, message=record)
+                    print(f"📨 Сообщение от пользователя {user_id} отправлено админу")
                     
                 except Exception as e:
                     print(f"❌ Ошибка сохранения: {e}")
-                    db.rollback()
+                    send_error(websocket, data, e)
+            
+            elif data.get("type") == "read":
+                # Пользователь увидел ответы поддержки
+                async with AsyncSessionLocal() as db:
+                    await mark_conversation_read(db, user_id, by_admin=False)
                     
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print(f"🔌 Пользователь {user_id} отключился")
     except Exception as e:
         print(f"❌ Ошибка в websocket_user_endpoint: {e}")
         import traceback
         traceback.print_exc()
     finally:
-        db.close()
\ No newline at end of file
+        manager.disconnect(websocket)
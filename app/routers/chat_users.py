@@ -1,11 +1,12 @@
 ﻿from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models import User
 router = APIRouter()
 @router.get("/users")
-def get_chat_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+async def get_chat_users(db: AsyncSession = Depends(get_async_db)):
+    users = (await db.scalars(select(User))).all()
     return {
         "users": [
             {
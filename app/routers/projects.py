@@ -1,28 +1,24 @@
 ﻿from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from datetime import datetime
 import app.database as database
 import app.models as models
 from app.dependencies import get_current_user
+from app.stats_counters import increment, project_changes, status_changes
 router = APIRouter(
     prefix="/api/projects",
     tags=["projects"]
 )
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 @router.get("/")
 async def get_user_projects(
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    projects = db.query(models.Project).filter(
+    projects = (await db.scalars(select(models.Project).where(
         models.Project.user_id == current_user.id
-    ).all()
+    ))).all()
     return {
         "status": "success",
         "count": len(projects),
@@ -33,7 +29,7 @@ async def create_project(
     title: str,
     description: str = "",
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     if not title or len(title.strip()) == 0:
         raise HTTPException(status_code=400, detail="Название проекта обязательно")
@@ -45,8 +41,9 @@ async def create_project(
         created_at=datetime.now()
     )
     db.add(new_project)
-    db.commit()
-    db.refresh(new_project)
+    await increment(db, project_changes(new_project))
+    await db.commit()
+    await db.refresh(new_project)
     return {
         "status": "success",
         "message": "Проект создан",
@@ -56,12 +53,12 @@ async def create_project(
 async def get_project(
     project_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    project = db.query(models.Project).filter(
+    project = await db.scalar(select(models.Project).where(
         models.Project.id == project_id,
         models.Project.user_id == current_user.id
-    ).first()
+    ))
     if not project:
         raise HTTPException(status_code=404, detail="Проект не найден")
     return {
@@ -75,12 +72,12 @@ async def update_project(
     description: str = None,
     status: str = None,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    project = db.query(models.Project).filter(
+    project = await db.scalar(select(models.Project).where(
         models.Project.id == project_id,
         models.Project.user_id == current_user.id
-    ).first()
+    ))
     if not project:
         raise HTTPException(status_code=404, detail="Проект не найден")
     if title is not None:
@@ -88,9 +85,10 @@ async def update_project(
     if description is not None:
         project.description = description.strip()
     if status is not None:
+        await increment(db, status_changes("projects", project.status, status))
         project.status = status
-    db.commit()
-    db.refresh(project)
+    await db.commit()
+    await db.refresh(project)
     return {
         "status": "success",
         "message": "Проект обновлен",
@@ -100,16 +98,17 @@ async def update_project(
 async def delete_project(
     project_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    project = db.query(models.Project).filter(
+    project = await db.scalar(select(models.Project).where(
         models.Project.id == project_id,
         models.Project.user_id == current_user.id
-    ).first()
+    ))
     if not project:
         raise HTTPException(status_code=404, detail="Проект не найден")
-    db.delete(project)
-    db.commit()
+    await increment(db, project_changes(project, -1))
+    await db.delete(project)
+    await db.commit()
     return {
         "status": "success",
         "message": "Проект удален"
@@ -1,14 +1,18 @@
 ﻿from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models import Service
 from app.dependencies import get_current_user
+from app.response_cache import cached_response, invalidate
+from app.stats_counters import increment, service_changes
 router = APIRouter(prefix="/api/services", tags=["services"])
 # API для получения всех услуг
 @router.get("")
-async def get_services(db: Session = Depends(get_db)):
-    services = db.query(Service).filter(Service.is_active == True).all()
+@cached_response(ttl=30, stale=300, tags=("services",))
+async def get_services(db: AsyncSession = Depends(get_async_db)):
+    services = (await db.scalars(select(Service).where(Service.is_active == True))).all()
     return services
 # API для создания услуги (только для админа)
 @router.post("")
@@ -21,7 +25,7 @@ async def create_service(
     technologies: list = None,
     price_range: str = "от 10 000 руб.",
     duration: str = "1-2 недели",
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user)
 ):
     if not current_user.is_admin:
@@ -37,6 +41,8 @@ async def create_service(
         duration=duration
     )
     db.add(new_service)
-    db.commit()
-    db.refresh(new_service)
+    await increment(db, service_changes())
+    await db.commit()
+    invalidate("services", "stats")
+    await db.refresh(new_service)
     return {"status": "success", "service": new_service}
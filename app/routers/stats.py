@@ -1,27 +1,19 @@
 ﻿from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.database import SessionLocal
-from app.models import User, Service, Project, Message, Transaction
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_read_db
 from app.schemas import StatisticResponse
+from app.stats_counters import read_counters
+from app.response_cache import cached_response
 router = APIRouter(prefix="/api/stats", tags=["statistics"])
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 @router.get("/", response_model=StatisticResponse)
-def get_statistics(db: Session = Depends(get_db)):
-    total_users = db.query(func.count(User.id)).scalar()
-    total_services = db.query(func.count(Service.id)).scalar()
-    total_projects = db.query(func.count(Project.id)).scalar()
-    total_messages = db.query(func.count(Message.id)).scalar()
-    total_transactions = db.query(func.count(Transaction.id)).scalar()
+@cached_response(ttl=5, stale=60, tags=("stats",))
+async def get_statistics(db: AsyncSession = Depends(get_read_db)):
+    # Итоги из stats_counters одним запросом вместо count() по каждой таблице
+    totals, _ = await read_counters(db)
     return StatisticResponse(
-        total_users=total_users,
-        total_services=total_services,
-        total_projects=total_projects,
-        total_messages=total_messages,
-        total_transactions=total_transactions
+        total_users=totals.get("users", 0),
+        total_services=totals.get("services", 0),
+        total_projects=totals.get("projects", 0),
+        total_messages=totals.get("messages", 0),
+        total_transactions=totals.get("transactions", 0)
     )
@@ -1,41 +1,38 @@
 ﻿from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from app.database import SessionLocal
+from app.database import get_async_db
 from app.models import User
 from app.schemas import UserCreate, UserResponse
+from app.auth_cache import DELETED, auth_cache, invalidate_user
+from app.passwords import hash_password
+from app.stats_counters import admin_changes, increment, user_changes
 router = APIRouter(prefix="/api/users", tags=["users"])
-# Dependency для получения сессии БД
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 # GET /api/users - получить всех пользователей
 @router.get("/", response_model=List[UserResponse])
-def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+async def get_users(db: AsyncSession = Depends(get_async_db)):
+    users = (await db.scalars(select(User))).all()
     return users
 # GET /api/users/{user_id} - получить пользователя по ID
 @router.get("/{user_id}", response_model=UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return user
 # GET /api/users/email/{email} - найти пользователя по email
 @router.get("/email/{email}", response_model=UserResponse)
-def get_user_by_email(email: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def get_user_by_email(email: str, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.email == email))
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return user
 # POST /api/users - создать нового пользователя
 @router.post("/", response_model=UserResponse)
-def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Проверяем, нет ли пользователя с таким email
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == user_data.email))
     if existing_user:
         raise HTTPException(status_code=400, detail="Пользователь с таким email уже существует")
     # Создаем пользователя
@@ -43,39 +40,49 @@ def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
         email=user_data.email,
         name=user_data.name,
         is_admin=user_data.is_admin,
-        hashed_password=user_data.password if user_data.password else "",
-        salt=""
+        hashed_password=await hash_password(user_data.password) if user_data.password else "",
+        salt=None
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await increment(db, user_changes(db_user))
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 # PUT /api/users/{user_id} - обновить пользователя
 @router.put("/{user_id}", response_model=UserResponse)
-def update_user(user_id: int, user_data: UserCreate, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def update_user(user_id: int, user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     # Проверяем email на уникальность (если изменился)
     if user_data.email != user.email:
-        existing_user = db.query(User).filter(User.email == user_data.email).first()
+        existing_user = await db.scalar(select(User).where(User.email == user_data.email))
         if existing_user:
             raise HTTPException(status_code=400, detail="Пользователь с таким email уже существует")
     # Обновляем поля
+    await increment(db, admin_changes(user.is_admin, user_data.is_admin))
     user.email = user_data.email
     user.name = user_data.name
     user.is_admin = user_data.is_admin
     if user_data.password:
-        user.hashed_password = user_data.password
-    db.commit()
-    db.refresh(user)
+        user.hashed_password = await hash_password(user_data.password)
+        user.salt = None
+    # Роль и имя зашиты в токены — старые токены отзываем
+    user.token_version = (user.token_version or 0) + 1
+    await db.commit()
+    invalidate_user(user_id)
+    auth_cache.remember_token_version(user_id, user.token_version)
+    await db.refresh(user)
     return user
 # DELETE /api/users/{user_id} - удалить пользователя
 @router.delete("/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
-    db.delete(user)
-    db.commit()
+    await increment(db, user_changes(user, -1))
+    await db.delete(user)
+    await db.commit()
+    invalidate_user(user_id)
+    auth_cache.remember_token_version(user_id, DELETED)
     return {"message": "Пользователь удален", "user_id": user_id}
@@ -0,0 +1,70 @@
+"""
+Схема БД, прочитанная один раз.
+
+Админка раньше спрашивала у БД список таблиц (inspect().get_table_names()) на
+каждом запросе, а создание услуги и сохранение настроек ещё и выполняли
+create_all. Теперь схема читается при старте воркера (refresh() в startup) и
+по команде после миграций (POST /api/admin/schema/refresh или перезапуск), а
+обработчики проверяют has_table()/has_column() без запросов к БД.
+
+DDL в обработчиках нет: таблицы, которые админка раньше создавала на лету,
+создаются при старте (ensure_tables), всё остальное — миграциями alembic.
+"""
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from sqlalchemy import inspect
+
+from app.database import Base, get_async_engine
+
+
+def _read_schema(connection) -> Dict[str, FrozenSet[str]]:
+    inspector = inspect(connection)
+    return {
+        table: frozenset(column["name"] for column in inspector.get_columns(table))
+        for table in inspector.get_table_names()
+    }
+
+
+class SchemaRegistry:
+    """Таблицы и их колонки основной БД (реплики повторяют её схему)"""
+
+    def __init__(self):
+        self._columns: Dict[str, FrozenSet[str]] = {}
+        self.loaded_at: Optional[float] = None
+
+    async def refresh(self, engine=None) -> Dict[str, FrozenSet[str]]:
+        """Перечитать схему из БД"""
+        engine = engine or get_async_engine()
+        async with engine.connect() as conn:
+            self._columns = await conn.run_sync(_read_schema)
+        self.loaded_at = time.time()
+        return self._columns
+
+    async def ensure_tables(self, tables: Iterable, engine=None) -> List[str]:
+        """Создать недостающие таблицы из списка (при старте) и перечитать схему"""
+        engine = engine or get_async_engine()
+        missing = [table for table in tables if not self.has_table(table.name)]
+        if not missing:
+            return []
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: Base.metadata.create_all(bind=sync_conn, tables=missing))
+        await self.refresh(engine)
+        names = [table.name for table in missing]
+        print(f"🗄️ Созданы недостающие таблицы: {', '.join(names)}")
+        return names
+
+    def has_table(self, table: str) -> bool:
+        return table in self._columns
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in self._columns.get(table, ())
+
+    def stats(self) -> dict:
+        return {
+            "loaded_at": self.loaded_at,
+            "tables": {table: sorted(columns) for table, columns in sorted(self._columns.items())},
+        }
+
+
+schema_registry = SchemaRegistry()
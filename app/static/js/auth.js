@@ -0,0 +1,41 @@
+﻿// Продление сессии: access-токен короткий, новый берётся по refresh-токену (httponly cookie)
+function tokenExpiresAt(token) {
+    try {
+        const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+        return payload.exp ? payload.exp * 1000 : null;
+    } catch (e) {
+        return null;
+    }
+}
+
+function scheduleTokenRefresh() {
+    const token = localStorage.getItem('access_token');
+    const expiresAt = token ? tokenExpiresAt(token) : null;
+    // Обновляем за минуту до истечения (или сразу, если срок неизвестен или уже прошёл)
+    const delay = expiresAt ? Math.max(expiresAt - Date.now() - 60000, 0) : 0;
+    setTimeout(refreshAccessToken, delay);
+}
+
+function refreshAccessToken() {
+    fetch('/api/auth/refresh', { method: 'POST', credentials: 'same-origin' })
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(data => {
+            localStorage.setItem('access_token', data.access_token);
+            scheduleTokenRefresh();
+        })
+        .catch(error => {
+            console.error('Не удалось продлить сессию:', error);
+            window.location.href = '/login';
+        });
+}
+
+// Выход на сервере: удаляет refresh-токен, иначе сессия продлится сама
+function serverLogout() {
+    return fetch('/api/auth/logout', { method: 'POST', credentials: 'same-origin', keepalive: true })
+        .catch(() => {});
+}
+
+document.addEventListener('DOMContentLoaded', scheduleTokenRefresh);
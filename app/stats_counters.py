@@ -0,0 +1,338 @@
+"""
+Счётчики статистики (таблица stats_counters).
+
+Вместо count() по целым таблицам на каждый запрос статистики итоги ведутся
+инкрементально: write-пути (регистрация, создание и удаление пользователей,
+проектов, услуг, запись пачки сообщений) вызывают increment() в своей же
+транзакции — счётчик меняется ровно тогда, когда фиксируется сама запись.
+Итоги хранятся в bucket="" , значения за день — в bucket="YYYY-MM-DD".
+
+Часть данных меняется в обход write-путей (ручные правки в БД, транзакции,
+у которых пока нет API), поэтому фоновая задача StatsReconciler раз в
+STATS_RECONCILE_INTERVAL секунд пересчитывает итоги и последние
+STATS_RECONCILE_DAYS дней по самим таблицам и исправляет расхождения; заодно
+пересобирает последние дни временных рядов (app.timeseries), а пустые ряды при
+старте — целиком.
+"""
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Integer, String, cast, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.database import AsyncSessionLocal
+from app.models import Message, Project, Service, StatCounter, Transaction, User
+
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+# Сколько последних дней сверять (более старые дни не меняются write-путями)
+STATS_RECONCILE_DAYS = int(os.getenv("STATS_RECONCILE_DAYS", "7"))
+
+TOTAL = ""
+
+# (bucket, имя счётчика)
+Key = Tuple[str, str]
+
+
+def day_bucket(moment: Optional[datetime] = None) -> str:
+    return (moment or datetime.utcnow()).date().isoformat()
+
+
+def status_counter(prefix: str, status: Optional[str]) -> Optional[str]:
+    return f"{prefix}.status.{status}" if status is not None else None
+
+
+def user_changes(user, sign: int = 1) -> Dict[Key, int]:
+    """Изменения счётчиков при создании (sign=1) или удалении (sign=-1) пользователя"""
+    changes = {(TOTAL, "users"): sign, (day_bucket(user.created_at), "users.new"): sign}
+    if user.is_admin:
+        changes[(TOTAL, "users.admins")] = sign
+    return changes
+
+
+def admin_changes(was_admin: bool, is_admin: bool) -> Dict[Key, int]:
+    if bool(was_admin) == bool(is_admin):
+        return {}
+    return {(TOTAL, "users.admins"): 1 if is_admin else -1}
+
+
+def project_changes(project, sign: int = 1) -> Dict[Key, int]:
+    changes = {(TOTAL, "projects"): sign, (day_bucket(project.created_at), "projects.new"): sign}
+    status = status_counter("projects", project.status)
+    if status:
+        changes[(TOTAL, status)] = sign
+    return changes
+
+
+def status_changes(prefix: str, old: Optional[str], new: Optional[str]) -> Dict[Key, int]:
+    if old == new:
+        return {}
+    changes = {}
+    if status_counter(prefix, old):
+        changes[(TOTAL, status_counter(prefix, old))] = -1
+    if status_counter(prefix, new):
+        changes[(TOTAL, status_counter(prefix, new))] = 1
+    return changes
+
+
+def service_changes(sign: int = 1) -> Dict[Key, int]:
+    return {(TOTAL, "services"): sign}
+
+
+def message_changes(rows: List[dict]) -> Dict[Key, int]:
+    """Пачка сохранённых сообщений: всего и сколько из них от пользователей (is_owner)"""
+    return {
+        (TOTAL, "messages"): len(rows),
+        (TOTAL, "messages.from_users"): sum(1 for row in rows if row.get("is_owner")),
+    }
+
+
+async def upsert(db, model, key_columns: Sequence[str], rows: List[dict], add_columns: Sequence[str] = ()):
+    """
+    Вставить строки; если строка с таким ключом уже есть — прибавить к ней
+    значения колонок add_columns, остальные колонки заменить. key_columns —
+    колонки первичного ключа в его порядке.
+    """
+    if not rows:
+        return
+    # Строки всегда в одном порядке: параллельные транзакции блокируют их без взаимных блокировок
+    rows = sorted(rows, key=lambda row: tuple(row[name] for name in key_columns))
+    value_columns = [name for name in rows[0] if name not in key_columns]
+
+    dialect = db.bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        statement = insert(model)
+        statement = statement.on_conflict_do_update(
+            index_elements=[getattr(model, name) for name in key_columns],
+            set_={
+                name: getattr(model, name) + statement.excluded[name] if name in add_columns else statement.excluded[name]
+                for name in value_columns
+            },
+        )
+        await db.execute(statement, rows)
+        return
+
+    # Прочие СУБД: прочитать и обновить (строки блокируются той же транзакцией)
+    for row in rows:
+        existing = await db.get(model, tuple(row[name] for name in key_columns), with_for_update=True)
+        if existing is None:
+            db.add(model(**row))
+            continue
+        for name in value_columns:
+            setattr(existing, name, getattr(existing, name) + row[name] if name in add_columns else row[name])
+    await db.flush()
+
+
+async def _upsert(db, values: Dict[Key, int], add: bool):
+    """Записать значения счётчиков: прибавить (add=True) или заменить"""
+    now = datetime.utcnow()
+    rows = [
+        {"bucket": bucket, "name": name, "value": value, "updated_at": now}
+        for (bucket, name), value in values.items()
+    ]
+    await upsert(db, StatCounter, ("bucket", "name"), rows, add_columns=("value",) if add else ())
+
+
+async def increment(db, *changes: Dict[Key, int]):
+    """Применить изменения счётчиков в текущей транзакции (до commit)"""
+    merged: Dict[Key, int] = {}
+    for change in changes:
+        for key, delta in change.items():
+            merged[key] = merged.get(key, 0) + delta
+    await _upsert(db, {key: delta for key, delta in merged.items() if delta}, add=True)
+
+
+async def read_counters(db, day: Optional[str] = None) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Итоги и значения за день (по умолчанию — сегодня) одним запросом"""
+    day = day or day_bucket()
+    rows = (await db.execute(
+        select(StatCounter.bucket, StatCounter.name, StatCounter.value)
+        .where(StatCounter.bucket.in_([TOTAL, day]))
+    )).all()
+    totals = {name: value for bucket, name, value in rows if bucket == TOTAL}
+    daily = {name: value for bucket, name, value in rows if bucket == day}
+    return totals, daily
+
+
+async def read_counter(db, name: str, bucket: str = TOTAL) -> int:
+    """Один счётчик (по первичному ключу)"""
+    return await db.scalar(
+        select(StatCounter.value).where(StatCounter.bucket == bucket, StatCounter.name == name)
+    ) or 0
+
+
+def by_status(totals: Dict[str, int], prefix: str) -> Dict[str, int]:
+    """{"active": 3, "done": 1} из счётчиков вида projects.status.<статус>"""
+    start = f"{prefix}.status."
+    return {name[len(start):]: value for name, value in totals.items() if name.startswith(start) and value}
+
+
+async def count_actual(db, since: date) -> Dict[Key, int]:
+    """Настоящие значения счётчиков по самим таблицам (итоги и дни начиная с since)"""
+    actual: Dict[Key, int] = {}
+
+    users, admins = (await db.execute(select(
+        func.count(User.id), func.sum(cast(User.is_admin, Integer))
+    ))).one()
+    actual[(TOTAL, "users")] = users or 0
+    actual[(TOTAL, "users.admins")] = admins or 0
+
+    messages, from_users = (await db.execute(select(
+        func.count(Message.id), func.sum(cast(Message.is_owner, Integer))
+    ))).one()
+    actual[(TOTAL, "messages")] = messages or 0
+    actual[(TOTAL, "messages.from_users")] = from_users or 0
+
+    actual[(TOTAL, "services")] = await db.scalar(select(func.count(Service.id))) or 0
+
+    for prefix, model in (("projects", Project), ("transactions", Transaction)):
+        rows = (await db.execute(
+            select(model.status, func.count(model.id)).group_by(model.status)
+        )).all()
+        actual[(TOTAL, prefix)] = sum(count for _, count in rows)
+        for status, count in rows:
+            if status is not None:
+                actual[(TOTAL, status_counter(prefix, status))] = count
+
+    since_moment = datetime.combine(since, datetime.min.time())
+    for name, model in (("users.new", User), ("projects.new", Project)):
+        day = cast(func.date(model.created_at), String)
+        rows = (await db.execute(
+            select(day, func.count(model.id))
+            .where(model.created_at >= since_moment)
+            .group_by(day)
+        )).all()
+        for bucket, count in rows:
+            actual[(str(bucket), name)] = count
+    return actual
+
+
+async def reconcile(db, days: int = STATS_RECONCILE_DAYS) -> Dict[str, int]:
+    """
+    Сверить счётчики с таблицами и исправить расхождения. Возвращает исправленные
+    счётчики: {"bucket/name": разница}.
+
+    Сначала берутся блокировки на запись строк счётчиков (на SQLite — блокировка
+    базы): increment() из параллельных транзакций дождётся конца сверки, а её
+    подсчёт не потеряет строки, зафиксированные между count() и записью.
+    """
+    await db.execute(update(StatCounter).values(value=StatCounter.value, updated_at=StatCounter.updated_at))
+
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    buckets = [TOTAL] + [(since + timedelta(days=offset)).isoformat() for offset in range(days)]
+    actual = await count_actual(db, since)
+    stored = {
+        (bucket, name): value
+        for bucket, name, value in (await db.execute(
+            select(StatCounter.bucket, StatCounter.name, StatCounter.value)
+            .where(StatCounter.bucket.in_(buckets))
+        )).all()
+    }
+
+    fixed = {}
+    for key in set(stored) | set(actual):
+        if key not in stored or stored[key] != actual.get(key, 0):
+            fixed[key] = actual.get(key, 0)
+    await _upsert(db, fixed, add=False)
+    await db.commit()
+    return {
+        f"{bucket or 'total'}/{name}": fixed[(bucket, name)] - stored.get((bucket, name), 0)
+        for bucket, name in sorted(fixed)
+        if fixed[(bucket, name)] != stored.get((bucket, name), 0)
+    }
+
+
+class StatsReconciler:
+    """Фоновая сверка счётчиков: при старте (если таблица пуста) и раз в interval секунд"""
+
+    def __init__(self, session_factory=AsyncSessionLocal, interval: float = STATS_RECONCILE_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.corrected = 0
+        self.last_run: Optional[float] = None
+        self.last_drift: Dict[str, int] = {}
+
+    def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def run_once(self) -> Dict[str, int]:
+        # Временные ряды опираются на эти счётчики, но не наоборот — импорт здесь, без цикла
+        from app.timeseries import rebuild_recent
+
+        async with self.session_factory() as db:
+            try:
+                drift = await reconcile(db)
+                # Последние дни рядов: транзакции пишутся в обход приложения
+                await rebuild_recent(db, STATS_RECONCILE_DAYS)
+            except Exception:
+                await db.rollback()
+                raise
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_drift = drift
+        self.corrected += len(drift)
+        if drift:
+            print(f"📊 Счётчики статистики исправлены ({len(drift)}): {drift}")
+        return drift
+
+    async def _is_empty(self) -> bool:
+        async with self.session_factory() as db:
+            return await db.scalar(select(StatCounter.name).where(StatCounter.bucket == TOTAL).limit(1)) is None
+
+    async def fill_empty_series(self) -> Dict[str, int]:
+        from app.timeseries import fill_empty
+
+        async with self.session_factory() as db:
+            try:
+                filled = await fill_empty(db)
+            except Exception:
+                await db.rollback()
+                raise
+        if filled:
+            print(f"📈 Пустые временные ряды пересобраны: {filled}")
+        return filled
+
+    async def _run(self):
+        try:
+            if await self._is_empty():
+                await self.run_once()
+        except Exception as e:
+            print(f"❌ Начальный пересчёт счётчиков статистики не удался: {e}")
+        try:
+            await self.fill_empty_series()
+        except Exception as e:
+            print(f"❌ Начальная сборка временных рядов не удалась: {e}")
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"❌ Сверка счётчиков статистики не удалась: {e}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "corrected": self.corrected,
+            "last_run": self.last_run,
+            "last_drift": self.last_drift,
+        }
+
+
+stats_reconciler = StatsReconciler()
@@ -0,0 +1,341 @@
+"""
+Временные ряды сообщений и транзакций с шагом час и день.
+
+Запрос ряда не читает сырые messages/transactions: итоги за каждый час и день
+лежат в message_rollups (число сообщений по направлению) и transaction_rollups
+(число и сумма по статусу и валюте). Пачка сообщений добавляет себя в ряды в
+транзакции записи (add_messages в MessageWriter). Транзакции пишутся в обход
+приложения, поэтому их последние дни, как и дни сообщений, пересобирает сверка
+StatsReconciler; если ряд пуст, а исходная таблица нет (ряды добавлены к
+живой базе), сверка при старте пересобирает его целиком. Историю заново
+заполняет CLI:
+
+    python -m app.timeseries backfill [--from 2020-01-01] [--to 2026-10-17] [--metric messages]
+
+series() для bucket=hour читает почасовые строки, для day/week/month — подневные:
+ряд за несколько лет — это несколько тысяч строк по первичному ключу.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, func, select, text
+
+from app.database import AsyncSessionLocal, dispose_database
+from app.models import Message, MessageRollup, Transaction, TransactionRollup
+from app.stats_counters import upsert
+
+GRANULARITIES = ("hour", "day")
+BUCKETS = ("hour", "day", "week", "month")
+METRICS = ("messages", "transactions")
+# Самый длинный диапазон с шагом час (почасовых строк в 24 раза больше)
+TIMESERIES_MAX_HOURLY_DAYS = int(os.getenv("TIMESERIES_MAX_HOURLY_DAYS", "92"))
+TIMESERIES_MAX_POINTS = int(os.getenv("TIMESERIES_MAX_POINTS", "10000"))
+# Пересборка идёт кусками по столько дней, каждый — своей транзакцией
+BACKFILL_CHUNK_DAYS = 31
+
+
+class Rollup:
+    """Ряд: его таблица, исходная таблица, измерения и суммируемые колонки"""
+
+    def __init__(self, model, source, dimensions: Dict[str, object], sums: Dict[str, object]):
+        self.model = model
+        self.source = source
+        self.dimensions = dimensions
+        self.sums = sums
+        self.key_columns = ("granularity", "bucket_start", *dimensions)
+
+    def dimension_values(self, values: Sequence) -> tuple:
+        if self.source is Message:
+            return (direction(values[0]),)
+        # NULL статус или валюта хранятся пустой строкой: она входит в первичный ключ
+        return tuple(value or "" for value in values)
+
+
+def direction(is_owner) -> str:
+    return "from_users" if is_owner else "from_admin"
+
+
+ROLLUPS = {
+    "messages": Rollup(MessageRollup, Message, {"direction": Message.is_owner}, {}),
+    "transactions": Rollup(
+        TransactionRollup,
+        Transaction,
+        {"status": Transaction.status, "currency": Transaction.currency},
+        {"amount": Transaction.amount},
+    ),
+}
+
+
+def to_naive_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def truncate(moment: datetime, bucket: str) -> datetime:
+    """Начало часа, дня, недели (с понедельника) или месяца"""
+    moment = to_naive_utc(moment)
+    if bucket == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start: datetime, bucket: str) -> datetime:
+    if bucket == "hour":
+        return start + timedelta(hours=1)
+    if bucket == "week":
+        return start + timedelta(days=7)
+    if bucket == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+async def add_messages(db, rows: List[dict]):
+    """Добавить пачку сохранённых сообщений в почасовой и подневной ряды (до commit)"""
+    counts = defaultdict(int)
+    for row in rows:
+        created_at = row.get("created_at") or datetime.utcnow()
+        for granularity in GRANULARITIES:
+            counts[(granularity, truncate(created_at, granularity), direction(row.get("is_owner")))] += 1
+    await upsert(
+        db,
+        MessageRollup,
+        ROLLUPS["messages"].key_columns,
+        [
+            {"granularity": granularity, "bucket_start": bucket_start, "direction": name, "count": count}
+            for (granularity, bucket_start, name), count in counts.items()
+        ],
+        add_columns=("count",),
+    )
+
+
+def _bucket_expression(column, granularity: str, dialect: str):
+    """Начало часа или дня средствами СУБД; None — группируем в Python"""
+    if dialect == "postgresql":
+        return func.date_trunc(granularity, func.timezone("UTC", column))
+    if dialect == "sqlite":
+        return func.strftime("%Y-%m-%d %H:00:00" if granularity == "hour" else "%Y-%m-%d 00:00:00", column)
+    return None
+
+
+async def _collect(db, rollup: Rollup, granularity: str, start: datetime, end: datetime) -> List[dict]:
+    """Строки ряда за [start, end), посчитанные по исходной таблице"""
+    source = rollup.source
+    created_at = source.created_at
+    dimensions = list(rollup.dimensions.values())
+    bucket = _bucket_expression(created_at, granularity, db.bind.dialect.name)
+    totals = defaultdict(lambda: [0] * (1 + len(rollup.sums)))
+
+    if bucket is not None:
+        result = await db.execute(
+            select(bucket, *dimensions, func.count(source.id), *[func.sum(column) for column in rollup.sums.values()])
+            .where(created_at >= start, created_at < end)
+            .group_by(bucket, *dimensions)
+        )
+        for row in result.all():
+            bucket_start = row[0]
+            if isinstance(bucket_start, str):
+                bucket_start = datetime.fromisoformat(bucket_start)
+            key = (to_naive_utc(bucket_start), rollup.dimension_values(row[1:1 + len(dimensions)]))
+            values = row[1 + len(dimensions):]
+            for index, value in enumerate(values):
+                totals[key][index] += value or 0
+    else:
+        result = await db.execute(
+            select(created_at, *dimensions, *rollup.sums.values())
+            .where(created_at >= start, created_at < end)
+        )
+        for row in result.all():
+            key = (truncate(row[0], granularity), rollup.dimension_values(row[1:1 + len(dimensions)]))
+            totals[key][0] += 1
+            for index, value in enumerate(row[1 + len(dimensions):], start=1):
+                totals[key][index] += value or 0
+
+    return [
+        {
+            "granularity": granularity,
+            "bucket_start": bucket_start,
+            **dict(zip(rollup.dimensions, dimension_values)),
+            "count": values[0],
+            **dict(zip(rollup.sums, values[1:])),
+        }
+        for (bucket_start, dimension_values), values in totals.items()
+    ]
+
+
+async def rebuild(db, metric: str, start: datetime, end: datetime) -> int:
+    """
+    Пересобрать ряд metric за [start, end) (границы — начала дней) по исходной
+    таблице и зафиксировать. Возвращает число строк ряда.
+
+    На Postgres таблица ряда блокируется от записи до конца транзакции:
+    add_messages из параллельной пачки дождётся пересборки и добавит своё
+    поверх, а не потеряется. На SQLite запись и так одна — её блокировку
+    берёт первый же DELETE.
+    """
+    rollup = ROLLUPS[metric]
+    model = rollup.model
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(text(f"LOCK TABLE {model.__tablename__} IN EXCLUSIVE MODE"))
+    await db.execute(delete(model).where(
+        model.granularity.in_(GRANULARITIES),
+        model.bucket_start >= start,
+        model.bucket_start < end,
+    ))
+    rows = []
+    for granularity in GRANULARITIES:
+        rows.extend(await _collect(db, rollup, granularity, start, end))
+    await upsert(db, model, rollup.key_columns, rows)
+    await db.commit()
+    return len(rows)
+
+
+async def rebuild_recent(db, days: int) -> Dict[str, int]:
+    """Пересобрать последние days дней всех рядов (для периодической сверки)"""
+    end = datetime.combine(datetime.utcnow().date() + timedelta(days=1), time())
+    start = end - timedelta(days=days)
+    return {metric: await rebuild(db, metric, start, end) for metric in METRICS}
+
+
+def _empty_point(metric: str) -> dict:
+    if metric == "messages":
+        return {"total": 0, "from_users": 0, "from_admin": 0}
+    return {"count": 0, "amount": 0, "by_status": {}, "by_currency": {}}
+
+
+async def series(
+    db,
+    metric: str,
+    bucket: str,
+    start: datetime,
+    end: datetime,
+    status: Optional[str] = None,
+    currency: Optional[str] = None,
+) -> List[dict]:
+    """
+    Точки ряда за [start, end) с шагом bucket, включая пустые. Для транзакций
+    можно оставить один статус и/или валюту.
+    """
+    rollup = ROLLUPS[metric]
+    model = rollup.model
+    granularity = "hour" if bucket == "hour" else "day"
+    start = truncate(start, bucket)
+    end = to_naive_utc(end)
+
+    points = {}
+    moment = start
+    while moment < end:
+        points[moment] = _empty_point(metric)
+        moment = next_bucket(moment, bucket)
+
+    columns = [model.bucket_start, *[getattr(model, name) for name in rollup.dimensions], model.count]
+    columns.extend(getattr(model, name) for name in rollup.sums)
+    # Префикс первичного ключа (granularity, bucket_start[, status, currency])
+    conditions = [model.granularity == granularity, model.bucket_start >= start, model.bucket_start < end]
+    if metric == "transactions" and status is not None:
+        conditions.append(model.status == status)
+    if metric == "transactions" and currency is not None:
+        conditions.append(model.currency == currency)
+
+    for row in (await db.execute(select(*columns).where(*conditions))).all():
+        point = points.get(truncate(row[0], bucket))
+        if point is None:
+            continue
+        if metric == "messages":
+            _, name, count = row
+            point[name] += count
+            point["total"] += count
+            continue
+        _, row_status, row_currency, count, amount = row
+        point["count"] += count
+        point["amount"] += amount
+        point["by_status"][row_status] = point["by_status"].get(row_status, 0) + amount
+        point["by_currency"][row_currency] = point["by_currency"].get(row_currency, 0) + amount
+
+    return [{"t": moment.isoformat(), **point} for moment, point in points.items()]
+
+
+def count_points(bucket: str, start: datetime, end: datetime) -> int:
+    """Сколько точек будет в ряду (для проверки диапазона до запроса)"""
+    step = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(days=7), "month": timedelta(days=28)}
+    return int((end - start) / step[bucket]) + 1
+
+
+async def _first_day(db, metric: str) -> Optional[date]:
+    source = ROLLUPS[metric].source
+    first = await db.scalar(select(func.min(source.created_at)))
+    if isinstance(first, str):
+        first = datetime.fromisoformat(first)
+    return to_naive_utc(first).date() if first is not None else None
+
+
+async def rebuild_days(db, metric: str, start: Optional[date], end: date) -> Optional[int]:
+    """
+    Пересобрать ряд за дни [start, end) кусками по BACKFILL_CHUNK_DAYS дней
+    (start=None — с первой записи). None — в исходной таблице нет данных.
+    """
+    chunk_start = start or await _first_day(db, metric)
+    if chunk_start is None:
+        return None
+    total = 0
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=BACKFILL_CHUNK_DAYS), end)
+        rows = await rebuild(db, metric, datetime.combine(chunk_start, time()), datetime.combine(chunk_end, time()))
+        total += rows
+        print(f"📈 {metric}: {chunk_start} — {chunk_end - timedelta(days=1)}, строк ряда: {rows}")
+        chunk_start = chunk_end
+    return total
+
+
+async def fill_empty(db) -> Dict[str, int]:
+    """Пересобрать целиком ряды, в которых нет ни одной строки (при старте)"""
+    end = datetime.utcnow().date() + timedelta(days=1)
+    filled = {}
+    for metric in METRICS:
+        model = ROLLUPS[metric].model
+        if await db.scalar(select(model.granularity).limit(1)) is not None:
+            continue
+        rows = await rebuild_days(db, metric, None, end)
+        if rows is not None:
+            filled[metric] = rows
+    return filled
+
+
+async def backfill(metrics: Sequence[str], start: Optional[date], end: date):
+    """Пересобрать ряды за дни [start, end) (CLI)"""
+    async with AsyncSessionLocal() as db:
+        for metric in metrics:
+            total = await rebuild_days(db, metric, start, end)
+            if total is None:
+                print(f"📈 {metric}: нет данных")
+                continue
+            print(f"✅ {metric}: ряд пересобран, всего строк: {total}")
+    await dispose_database()
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.timeseries", description="Временные ряды сообщений и транзакций")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("backfill", help="пересобрать ряды по исходным таблицам")
+    fill.add_argument("--from", dest="start", type=date.fromisoformat, help="с этого дня (по умолчанию — с первой записи)")
+    fill.add_argument("--to", dest="end", type=date.fromisoformat, help="по этот день включительно (по умолчанию — сегодня)")
+    fill.add_argument("--metric", choices=METRICS, action="append", help="только этот ряд (можно несколько раз)")
+    args = parser.parse_args(argv)
+
+    end = (args.end or datetime.utcnow().date()) + timedelta(days=1)
+    asyncio.run(backfill(args.metric or METRICS, args.start, end))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
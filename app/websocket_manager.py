@@ -0,0 +1,323 @@
+import asyncio
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from app.chat_backplane import InMemoryBackplane
+from app.chat_cache import HotTailCache
+
+# Размер исходящей очереди на одно подключение (в кадрах)
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", "256"))
+# Сколько секунд ждём отправки одного кадра, прежде чем считать клиента зависшим
+CHAT_SEND_TIMEOUT = float(os.getenv("CHAT_SEND_TIMEOUT", "10"))
+# Что делать при переполнении очереди: drop_oldest | drop_newest | disconnect
+CHAT_OVERFLOW_POLICY = os.getenv("CHAT_OVERFLOW_POLICY", "drop_oldest")
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+
+# Код закрытия для медленных клиентов: "Try Again Later"
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class ClientConnection:
+    """
+    Одно WebSocket-подключение с ограниченной исходящей очередью.
+
+    Кадры кладутся в очередь без ожидания, отправляет их отдельная задача-писатель,
+    поэтому зависший клиент не тормозит доставку остальным и цикл приёма отправителя.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: Optional[int] = None,
+        is_admin: bool = False,
+        queue_size: int = CHAT_SEND_QUEUE_SIZE,
+        send_timeout: float = CHAT_SEND_TIMEOUT,
+        overflow_policy: str = CHAT_OVERFLOW_POLICY,
+        on_close=None,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow_policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.send_timeout = send_timeout
+        self.overflow_policy = overflow_policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+        self.evicted = False
+        self._on_close = on_close
+        self._writer_task: Optional[asyncio.Task] = None
+        # Пока клиент догружает пропущенное, живые кадры копятся здесь
+        self._held: Optional[List[str]] = None
+        self.hold_overflow = False
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: str) -> bool:
+        """Поставить кадр в очередь. Никогда не ждёт; False — кадр не принят"""
+        if self.closed:
+            return False
+        if self._held is not None:
+            if len(self._held) >= self.queue.maxsize:
+                self.hold_overflow = True
+                self.dropped += 1
+                return False
+            self._held.append(frame)
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == "drop_oldest":
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            self.dropped += 1
+            return True
+        if self.overflow_policy == "drop_newest":
+            self.dropped += 1
+            return False
+
+        print(f"⚠️ Медленный клиент (user_id={self.user_id}, admin={self.is_admin}): очередь переполнена, отключаем")
+        self.close(SLOW_CONSUMER_CLOSE_CODE, "slow consumer")
+        return False
+
+    def hold(self):
+        """Придержать живые кадры (на время догрузки пропущенных сообщений)"""
+        if self._held is None:
+            self._held = []
+
+    def release(self) -> int:
+        """Отправить придержанные кадры вслед за догруженными и вернуться к обычной доставке"""
+        held, self._held = self._held or [], None
+        for frame in held:
+            self.enqueue(frame)
+        return len(held)
+
+    async def send_now(self, frame: str):
+        """Поставить кадр в очередь, дожидаясь места (для догрузки: ничего не отбрасываем)"""
+        if not self.closed:
+            await self.queue.put(frame)
+
+    async def _writer(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(frame), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"⚠️ Медленный клиент (user_id={self.user_id}, admin={self.is_admin}): таймаут отправки, отключаем")
+            self.close(SLOW_CONSUMER_CLOSE_CODE, "slow consumer", cancel_writer=False)
+        except Exception as e:
+            print(f"❌ Ошибка отправки в WebSocket: {e}")
+            self.close(cancel_writer=False)
+
+    def close(self, code: Optional[int] = None, reason: str = "", cancel_writer: bool = True):
+        """Снять подключение с учёта; при code закрыть сокет со стороны сервера"""
+        if self.closed:
+            return
+        self.closed = True
+        self.evicted = code == SLOW_CONSUMER_CLOSE_CODE
+        if cancel_writer and self._writer_task is not None:
+            self._writer_task.cancel()
+        if self._on_close is not None:
+            self._on_close(self)
+        if code is not None:
+            asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    """
+    Реестр WebSocket-подключений чата.
+
+    Подключения индексируются по роли: у пользователя может быть несколько
+    сокетов (по одному на вкладку), админские сокеты хранятся отдельно.
+    Сообщение доставляется только своим получателям, кадр сериализуется
+    один раз и ставится в очереди подключений без ожидания отправки.
+
+    Кадры для других участников идут через шину (app.chat_backplane): так
+    получатель найдётся, даже если его сокет открыт в другом воркере.
+    Вместе с кадром по шине идёт само сообщение — им пополняется горячий
+    хвост истории (history_cache) каждого воркера.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = CHAT_SEND_QUEUE_SIZE,
+        send_timeout: float = CHAT_SEND_TIMEOUT,
+        overflow_policy: str = CHAT_OVERFLOW_POLICY,
+        history_cache: Optional[HotTailCache] = None,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow_policy}")
+        self.history_cache = history_cache if history_cache is not None else HotTailCache()
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.overflow_policy = overflow_policy
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self.user_connections: Dict[int, Set[ClientConnection]] = {}
+        self.admin_connections: Set[ClientConnection] = set()
+        self.evicted = 0
+        self.dropped = 0
+        self.backplane = InMemoryBackplane(self._deliver)
+
+    async def start_backplane(self, backplane):
+        """Подключить шину доставки (вызывается при старте приложения)"""
+        await self.backplane.stop()
+        self.backplane = backplane
+        await self.backplane.start(self._deliver)
+        print(f"✅ Шина чата: {self.backplane.name}")
+
+    async def stop_backplane(self):
+        await self.backplane.stop()
+        self.backplane = InMemoryBackplane(self._deliver)
+
+    async def publish(
+        self,
+        frame: str,
+        user_id: Optional[int] = None,
+        admins: bool = False,
+        message: Optional[dict] = None,
+    ):
+        """
+        Доставить кадр вкладкам пользователя и/или админам на всех воркерах.
+
+        message — сохранённое сообщение для горячего хвоста истории.
+        """
+        envelope = {"frame": frame, "user_id": user_id, "admins": admins}
+        if message is not None:
+            envelope["message"] = message
+        await self.backplane.publish(envelope)
+
+    def _deliver(self, envelope: dict):
+        if envelope.get("message") is not None:
+            self.history_cache.append(envelope["message"])
+        frame = envelope["frame"]
+        if envelope.get("user_id") is not None:
+            self.send_frame_to_user(envelope["user_id"], frame)
+        if envelope.get("admins"):
+            self.send_frame_to_admins(frame)
+
+    @property
+    def active_connections(self) -> List[ClientConnection]:
+        return list(self.connections.values())
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: Optional[int] = None,
+        is_admin: bool = False,
+        hold: bool = False,
+    ) -> ClientConnection:
+        """
+        Принять сокет и зарегистрировать подключение.
+
+        hold=True — живые кадры придерживаются до connection.release(): подключение
+        уже получает всё новое, но клиент сперва догружает пропущенное.
+        """
+        await websocket.accept()
+        connection = ClientConnection(
+            websocket,
+            user_id=user_id,
+            is_admin=is_admin,
+            queue_size=self.queue_size,
+            send_timeout=self.send_timeout,
+            overflow_policy=self.overflow_policy,
+            on_close=self._forget,
+        )
+        if hold:
+            connection.hold()
+        self.connections[websocket] = connection
+        if is_admin:
+            self.admin_connections.add(connection)
+        else:
+            self.user_connections.setdefault(user_id, set()).add(connection)
+        connection.start()
+        return connection
+
+    def disconnect(self, websocket: WebSocket):
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.close()
+
+    def _forget(self, connection: ClientConnection):
+        self.connections.pop(connection.websocket, None)
+        self.dropped += connection.dropped
+        if connection.evicted:
+            self.evicted += 1
+        if connection.is_admin:
+            self.admin_connections.discard(connection)
+            return
+        sockets = self.user_connections.get(connection.user_id)
+        if sockets is not None:
+            sockets.discard(connection)
+            if not sockets:
+                del self.user_connections[connection.user_id]
+
+    def is_user_online(self, user_id: int) -> bool:
+        return bool(self.user_connections.get(user_id))
+
+    @staticmethod
+    def serialize(message: dict) -> str:
+        """Сериализовать кадр один раз для всех получателей"""
+        return json.dumps(message, ensure_ascii=False, default=str)
+
+    def _enqueue(self, frame: str, connections: Iterable[ClientConnection]) -> int:
+        accepted = 0
+        # Копия: при переполнении подключение может сняться с учёта прямо в цикле
+        for connection in list(connections):
+            if connection.enqueue(frame):
+                accepted += 1
+        return accepted
+
+    def send_personal_message(self, message: dict, websocket: WebSocket) -> bool:
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return False
+        return connection.enqueue(self.serialize(message))
+
+    def send_frame_to_user(self, user_id: int, frame: str) -> int:
+        """Поставить готовый кадр в очереди всех вкладок пользователя"""
+        return self._enqueue(frame, self.user_connections.get(user_id, ()))
+
+    def send_frame_to_admins(self, frame: str) -> int:
+        """Поставить готовый кадр в очереди всех админских подключений"""
+        return self._enqueue(frame, self.admin_connections)
+
+    def send_to_user(self, user_id: int, message: dict) -> int:
+        return self.send_frame_to_user(user_id, self.serialize(message))
+
+    def send_to_admins(self, message: dict) -> int:
+        return self.send_frame_to_admins(self.serialize(message))
+
+    def broadcast(self, message: dict) -> int:
+        return self._enqueue(self.serialize(message), self.active_connections)
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "users_online": len(self.user_connections),
+            "admins_online": len(self.admin_connections),
+            "queued_frames": sum(c.queue.qsize() for c in self.connections.values()),
+            "dropped_frames": self.dropped + sum(c.dropped for c in self.connections.values()),
+            "evicted_connections": self.evicted,
+            "overflow_policy": self.overflow_policy,
+            "backplane": self.backplane.name,
+        }
+
+
+manager = ConnectionManager()
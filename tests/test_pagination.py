@@ -0,0 +1,78 @@
+"""
+Keyset-пагинация списков админки на SQLite: курсор строки совпадает с ней самой,
+каким бы способом ни было заполнено created_at.
+"""
+import asyncio
+import importlib.util
+import os
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.database import Base
+from app.models import Project
+from app.routers.admin import PROJECTS_LISTING
+
+MIGRATION = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "alembic", "versions", "f2a7c4e91b36_listing_indexes.py",
+)
+
+
+def load_migration():
+    spec = importlib.util.spec_from_file_location("listing_indexes", MIGRATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def collect_pages(sessions, sort: str):
+    """Пройти все страницы по одной строке, как клиент, который идёт по курсору до null"""
+    ids, cursor = [], None
+    async with sessions() as db:
+        for _ in range(20):
+            page = await PROJECTS_LISTING.page(db, cursor=cursor, limit=1, sort=sort)
+            ids.extend(project.id for project in page["items"])
+            cursor = page["cursor"]
+            if cursor is None:
+                return ids
+    raise AssertionError(f"Курсор не закончился: {ids}")
+
+
+async def with_database(tmp_path, scenario):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'app.db'}")
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        return await scenario(engine, async_sessionmaker(engine, expire_on_commit=False))
+    finally:
+        await engine.dispose()
+
+
+def test_orm_rows_page_without_repeats(tmp_path):
+    async def scenario(engine, sessions):
+        async with sessions() as db:
+            db.add_all([Project(title=f"p{i}", status="pending") for i in range(3)])
+            await db.commit()
+        return await collect_pages(sessions, "-created_at"), await collect_pages(sessions, "created_at")
+
+    newest_first, oldest_first = asyncio.run(with_database(tmp_path, scenario))
+    assert sorted(newest_first) == [1, 2, 3]
+    assert sorted(oldest_first) == [1, 2, 3]
+
+
+def test_rows_sharing_one_server_default_timestamp(tmp_path):
+    migration = load_migration()
+
+    async def scenario(engine, sessions):
+        async with engine.begin() as conn:
+            # Без created_at — значение ставит server_default, одно на всю вставку
+            await conn.execute(text(
+                "INSERT INTO projects (title, status) VALUES ('a', 'pending'), ('b', 'pending'), ('c', 'pending')"
+            ))
+            await conn.run_sync(migration.normalize_sqlite_timestamps)
+        return await collect_pages(sessions, "-created_at"), await collect_pages(sessions, "created_at")
+
+    newest_first, oldest_first = asyncio.run(with_database(tmp_path, scenario))
+    assert newest_first == [3, 2, 1]
+    assert oldest_first == [1, 2, 3]
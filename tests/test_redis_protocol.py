@@ -0,0 +1,98 @@
+"""
+Клиент RESP против заглушки брокера: AUTH/SELECT при подключении и таймауты
+публикации и лимитов.
+"""
+import asyncio
+
+from app.chat_backplane import RedisBackplane
+from app.rate_limit import RedisRateLimitBackend
+from app.redis_protocol import RespConnection
+
+
+async def start_stub(replies=None, delay: float = 0.0):
+    """Заглушка брокера: записывает команды и отвечает +OK (или по словарю replies)"""
+    commands = []
+    replies = replies or {}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode())
+                commands.append(args)
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(replies.get(args[0].upper(), b"+OK\r\n"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, port, commands
+
+
+def test_password_url_sends_auth_and_select_before_command():
+    async def scenario():
+        server, port, commands = await start_stub({"PING": b"+PONG\r\n"})
+        connection = RespConnection(f"redis://:secret@127.0.0.1:{port}/2")
+        try:
+            reply = await asyncio.wait_for(connection.execute("PING"), timeout=2)
+        finally:
+            await connection.close()
+            server.close()
+            await server.wait_closed()
+        return reply, commands
+
+    reply, commands = asyncio.run(scenario())
+    assert reply == "PONG"
+    assert commands == [["AUTH", "secret"], ["SELECT", "2"], ["PING"]]
+
+
+def test_password_url_pipeline():
+    async def scenario():
+        server, port, commands = await start_stub({"INCR": b":1\r\n", "GET": b"$-1\r\n"})
+        connection = RespConnection(f"redis://:secret@127.0.0.1:{port}")
+        try:
+            replies = await asyncio.wait_for(connection.pipeline(("INCR", "k"), ("GET", "k")), timeout=2)
+        finally:
+            await connection.close()
+            server.close()
+            await server.wait_closed()
+        return replies, commands
+
+    replies, commands = asyncio.run(scenario())
+    assert replies == [1, None]
+    assert commands[0] == ["AUTH", "secret"]
+
+
+def test_slow_broker_does_not_block_publish_or_rate_limit():
+    async def scenario():
+        server, port, _ = await start_stub(delay=5)
+        url = f"redis://:secret@127.0.0.1:{port}"
+        delivered = []
+        backplane = RedisBackplane(url, timeout=0.2)
+        backplane._handler = delivered.append
+        backend = RedisRateLimitBackend(url, timeout=0.2)
+        try:
+            await asyncio.wait_for(backplane.publish({"frame": "x"}), timeout=2)
+            retry_after = await asyncio.wait_for(backend.hit("login:ip", 10, 60), timeout=2)
+        finally:
+            await backplane.stop()
+            await backend.close()
+            server.close()
+            await server.wait_closed()
+        return delivered, retry_after, backend.errors
+
+    delivered, retry_after, errors = asyncio.run(scenario())
+    # Брокер не ответил вовремя: кадр доставлен локально, лимит посчитан в памяти
+    assert delivered == [{"frame": "x"}]
+    assert retry_after == 0.0
+    assert errors == 1
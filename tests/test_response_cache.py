@@ -0,0 +1,60 @@
+"""
+Single-flight кэша ответов: отмена запроса, который считает ответ, не должна
+доставаться тем, кто его ждёт.
+"""
+import asyncio
+
+import pytest
+
+from app.response_cache import ResponseCache
+
+
+def test_waiters_recompute_when_leader_is_cancelled():
+    async def scenario():
+        cache = ResponseCache()
+        started = asyncio.Event()
+        calls = []
+
+        async def slow_compute() -> bytes:
+            calls.append("leader")
+            started.set()
+            await asyncio.sleep(10)
+            return b"leader"
+
+        async def fast_compute() -> bytes:
+            calls.append("waiter")
+            return b"waiter"
+
+        leader = asyncio.create_task(cache.fetch(("k",), 5, 0, (), slow_compute, slow_compute))
+        await started.wait()
+        waiters = [asyncio.create_task(cache.fetch(("k",), 5, 0, (), fast_compute, fast_compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == [(b"waiter", "miss")] * 3
+    # Заново считает один из ждущих, остальные ждут уже его
+    assert calls == ["leader", "waiter"]
+
+
+def test_waiters_share_leader_error():
+    async def scenario():
+        cache = ResponseCache()
+        started = asyncio.Event()
+
+        async def failing() -> bytes:
+            started.set()
+            await asyncio.sleep(0.01)
+            raise RuntimeError("db down")
+
+        leader = asyncio.create_task(cache.fetch(("k",), 5, 0, (), failing, failing))
+        await started.wait()
+        waiter = asyncio.create_task(cache.fetch(("k",), 5, 0, (), failing, failing))
+        return await asyncio.gather(leader, waiter, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results] == ["db down", "db down"]